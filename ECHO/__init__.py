@@ -4,5 +4,6 @@ from . import plot_utils
 from . import position_utils
 from . import time_utils
 from . import server_utils
+from . import cache_utils
 from .observations import Observation
-from .beams import Beam
+from .beams import Beam, BeamAccumulator
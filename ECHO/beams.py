@@ -1,6 +1,7 @@
 from . import read_utils
 from . import plot_utils
 
+import numpy as np
 import healpy as hp
 
 class Beam:
@@ -141,3 +142,91 @@ class Beam:
         valid_beamtype = ['healpy', 'efield','power']
         assert (beam_type in valid_beamtype), "Invalid beamtype! Please select 'healpy', 'efield', or 'power'"
         return beam_type
+
+
+class BeamAccumulator:
+    '''Running healpix beam which takes drone data in batches as it arrives.
+
+    Per pixel counts, means and sums of squared deviations (M2) are kept and
+    each batch is folded in with Chan et al.'s pairwise update, which stays
+    numerically stable however many samples a pixel collects. A batch costs
+    time proportional to its own length, not to the data seen so far.
+
+    Args:
+        lat0 (float): latitude of the receiver instrument (deg)
+        lon0 (float): longitude of the receiver instrument (deg)
+        nside (int): of the healpix beam
+    '''
+    def __init__(self, lat0, lon0, nside=8):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.nside = nside
+        npix = hp.nside2npix(nside)
+        self.counts = np.zeros(npix)
+        self.mean = np.zeros(npix)
+        self.m2 = np.zeros(npix)
+
+    def add(self, lats, lons, alts, power):
+        '''Add a batch of drone positions and received power.
+
+        Args:
+            lats, lons (array): drone position (deg)
+            alts (array): drone altitude relative to the receiver (m)
+            power (array): received power (dB)
+        '''
+        pixes = plot_utils.healpix_pixels(lats, lons, alts, self.lat0, self.lon0, nside=self.nside)
+        self.add_pixels(pixes, power)
+        return
+
+    def add_pixels(self, pixes, power):
+        '''Add a batch of samples already binned into healpix pixels.
+
+        Args:
+            pixes (array): ring ordered pixel of each sample
+            power (array): sample values
+        '''
+        power = np.asarray(power, dtype=float).ravel()
+        if len(power)==0:
+            return
+        pix, inverse = np.unique(np.asarray(pixes).ravel(), return_inverse=True)
+        counts = np.bincount(inverse).astype(float)
+        mean = np.bincount(inverse, weights=power)/counts
+        m2 = np.bincount(inverse, weights=(power-mean[inverse])**2)
+        self._merge(pix, counts, mean, m2)
+        return
+
+    def _merge(self, pix, counts, mean, m2):
+        na = self.counts[pix]
+        n = na+counts
+        delta = mean-self.mean[pix]
+        self.mean[pix] += delta*counts/n
+        self.m2[pix] += m2+delta**2*na*counts/n
+        self.counts[pix] = n
+
+    def merge(self, other):
+        '''Fold another accumulator (e.g. another sortie or worker) into this one.
+
+        Args:
+            other (BeamAccumulator): accumulator with the same nside and receiver position
+
+        Returns:
+            self
+        '''
+        if (other.nside, other.lat0, other.lon0) != (self.nside, self.lat0, self.lon0):
+            raise ValueError("Can only merge accumulators with the same nside and receiver position")
+        pix = np.flatnonzero(other.counts)
+        self._merge(pix, other.counts[pix], other.mean[pix], other.m2[pix])
+        return self
+
+    def snapshot(self):
+        '''The beam so far, in the form plot_utils.grid_to_healpix returns.
+
+        Returns:
+            beam, rms, counts (array): healpix maps, hp.UNSEEN where empty
+        '''
+        counts = self.counts.copy()
+        beam = self.mean.copy()
+        rms = np.zeros_like(beam)
+        seen = counts>0
+        rms[seen] = np.sqrt(self.m2[seen]/counts[seen])
+        return plot_utils.fill_unseen(beam, rms, counts, inflate=True)
@@ -0,0 +1,160 @@
+"""On-disk cache of parsed drone and receiver data.
+
+Parsed arrays are stored as .npz files named by a key built from the
+fingerprints of the source files, so an entry is only used while its source
+files are unchanged. The cache directory is bounded in size, with the least
+recently used entries evicted first.
+
+The cache lives in $ECHO_CACHE_DIR, or ~/.cache/ECHO if that is not set.
+"""
+import os
+import glob
+import hashlib
+import tempfile
+import numpy as np
+
+CACHE_DIR = os.environ.get('ECHO_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'ECHO'))
+MAX_CACHE_BYTES = 2*1024**3
+#bytes hashed from each end of a file for its fingerprint
+HASH_BLOCK = 1024**2
+#bump this when the parsers change what they return, to drop stale entries
+CACHE_VERSION = 1
+
+
+def file_fingerprint(filename):
+    '''Fingerprint a file by path, size, mtime and the bytes at its ends.
+
+    Only the first and last HASH_BLOCK bytes are hashed, so fingerprinting a
+    multi-GB file stays cheap. An edit in the middle of a file which keeps its
+    size and mtime is not detected and the old parse is returned; call
+    clear_cache (or pass use_cache=False) after rewriting files in place.
+
+    Args:
+        filename (str): file to fingerprint
+
+    Returns:
+        fingerprint (str): hex digest
+    '''
+    stat = os.stat(filename)
+    digest = hashlib.sha1()
+    digest.update(('%s:%d:%d' % (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)).encode())
+    with open(filename, 'rb') as f:
+        digest.update(f.read(HASH_BLOCK))
+        if stat.st_size > 2*HASH_BLOCK:
+            f.seek(-HASH_BLOCK, os.SEEK_END)
+        digest.update(f.read(HASH_BLOCK))
+    return digest.hexdigest()
+
+
+def cache_key(filenames, tag=''):
+    '''Cache key for data parsed from a set of files.
+
+    Args:
+        filenames (list): source files
+        tag (str): distinguishes different products of the same files
+
+    Returns:
+        key (str): hex digest
+    '''
+    digest = hashlib.sha1(('%s:%d' % (tag, CACHE_VERSION)).encode())
+    for filename in filenames:
+        digest.update(file_fingerprint(filename).encode())
+    return digest.hexdigest()
+
+
+def _entry(key, cache_dir):
+    return os.path.join(cache_dir or CACHE_DIR, key+'.npz')
+
+
+def _remove(entry):
+    #another process may have evicted the entry already
+    try:
+        os.remove(entry)
+    except FileNotFoundError:
+        pass
+
+
+def load(key, cache_dir=None):
+    '''Load a cache entry.
+
+    Args:
+        key (str): key from cache_key
+        cache_dir (str, optional): cache directory, defaults to CACHE_DIR
+
+    Returns:
+        arrays (dict): the cached arrays, or None if there is no valid entry
+    '''
+    entry = _entry(key, cache_dir)
+    try:
+        with np.load(entry) as npz:
+            arrays = dict((name, npz[name]) for name in npz.files)
+    except FileNotFoundError:
+        #never written, or evicted by another process
+        return None
+    except Exception:
+        #a corrupt or partial entry is just a miss
+        _remove(entry)
+        return None
+    #mark as recently used for eviction
+    try:
+        os.utime(entry, None)
+    except FileNotFoundError:
+        pass
+    return arrays
+
+
+def save(key, arrays, cache_dir=None, max_bytes=None):
+    '''Store arrays in the cache, then evict old entries to stay under max_bytes.
+
+    Args:
+        key (str): key from cache_key
+        arrays (dict): arrays to store, keyed by name
+        cache_dir (str, optional): cache directory, defaults to CACHE_DIR
+        max_bytes (int, optional): cache size limit, defaults to MAX_CACHE_BYTES
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    #write then rename, so readers never see a partial entry
+    fd, tmpfile = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmpfile, _entry(key, cache_dir))
+    evict(cache_dir, max_bytes)
+    return
+
+
+def evict(cache_dir=None, max_bytes=None):
+    '''Remove the least recently used entries until the cache fits in max_bytes.
+
+    Args:
+        cache_dir (str, optional): cache directory, defaults to CACHE_DIR
+        max_bytes (int, optional): cache size limit, defaults to MAX_CACHE_BYTES
+    '''
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for entry in glob.glob(os.path.join(cache_dir or CACHE_DIR, '*.npz')):
+        try:
+            stat = os.stat(entry)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+    total = sum(size for mtime, size, entry in entries)
+    for mtime, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(entry)
+        total -= size
+    return
+
+
+def clear_cache(cache_dir=None):
+    '''Remove every entry from the cache.
+
+    Args:
+        cache_dir (str, optional): cache directory, defaults to CACHE_DIR
+    '''
+    for entry in glob.glob(os.path.join(cache_dir or CACHE_DIR, '*.npz')):
+        _remove(entry)
+    return
@@ -4,7 +4,11 @@ from . import position_utils
 from . import time_utils
 from . import server_utils
 from . import beams
+from . import cache_utils
 
+import functools
+import multiprocessing
+import traceback
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
@@ -16,6 +20,19 @@ import h5py
 from astropy.time import Time
 import healpy as hp
 
+def _read_sortie(sortie, use_cache=False, cache_dir=None):
+    '''Read a sortie, catching the failure so the other sorties still load.
+
+    Returns:
+        sortie: the populated sortie
+        error (str): traceback of the failure, or None if the read succeeded
+    '''
+    try:
+        sortie.read(use_cache=use_cache, cache_dir=cache_dir)
+    except Exception:
+        return sortie, traceback.format_exc()
+    return sortie, None
+
 class Observation:
     '''
     The class object for making observations.
@@ -60,13 +77,46 @@ class Observation:
 
         return
 
-    def read_sorties(self):
+    def read_sorties(self, nprocs=1, use_cache=False, cache_dir=None):
         '''Reads in the data files for a given sortie.
 
+        Sorties are independent, so with nprocs>1 they are read concurrently in
+        a pool of worker processes and the populated sorties are returned to
+        this process. Either way, a sortie which fails to read is reported and
+        left unread, the others are still read. The errors are kept in
+        self.read_errors, keyed by sortie name.
+
+        Args:
+            nprocs (int): number of worker processes to read sorties with
+            use_cache (bool): use the on-disk parsed-sortie cache, see Sortie.read
+            cache_dir (str): cache directory, defaults to cache_utils.CACHE_DIR
+
+        '''
+        read = functools.partial(_read_sortie, use_cache=use_cache, cache_dir=cache_dir)
+        if nprocs>1 and len(self.sortie_list)>1:
+            pool = multiprocessing.Pool(min(nprocs, len(self.sortie_list)))
+            try:
+                results = pool.map(read, self.sortie_list, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [read(sortie) for sortie in self.sortie_list]
+        self.read_errors = {}
+        for i, (sortie, error) in enumerate(results):
+            self.sortie_list[i] = sortie
+            if error:
+                print("Unable to read " + sortie.name + ":\n" + error)
+                self.read_errors[sortie.name] = error
+        return
+
+    def close(self):
+        '''Close the receiver datafiles held open by each sortie.
+
         '''
         for sortie in self.sortie_list:
-            sortie.read()
-            sortie.get_freq_chans()
+            sortie.close()
+
         return
 
     def flagSorties(self):
@@ -74,10 +124,8 @@ class Observation:
 
         '''
         for sortie in self.sortie_list:
-            print(sortie["name"])
-            #flag start/stop
-            sortie.flag_endpoints()
-            #flag waypoints
+            print(sortie.name)
+            #flag start/stop and split the waypoint legs, in one pass
             sortie.flag_waypoints()
             #flag yaws
             #sortie.flag_yaws()
@@ -147,50 +195,131 @@ class Observation:
         pol = polarization
 
         sorties = self.sort_sorties()
+        #everything stays in float unix seconds: the receiver and the position
+        #times are both unix, so no time scale conversion is needed
+        nrows = sum(len(sortie.mission_data) for sortie in sorties)
+        ncols = sorties[0].mission_data.shape[1]
+        refined_array = np.empty((nrows, ncols+1))
         rx_data = []
         t_rx = []
-        pos_times = []
+        row = 0
         for i,sortie in enumerate(sorties):
             #get frequency channel of sortie
 
-            #target_data = h5py.File(sortie.data,'r')
-            target_data = sortie.data_dict
             freqchan=sortie.freq_chan
 
             start_time, end_time = sortie.mission_data[0,0], sortie.mission_data[-1,0]
-            pos_times.append(list(sortie.mission_data[:,0]))
-
-            rx_times = target_data[obs]['time'][()]
-            indices = np.nonzero(np.logical_and(rx_times >= start_time , rx_times <= end_time))
-            times = target_data[obs]['time'][list(indices[0])]
-            t_rx.append(Time(times,scale='utc',format='unix'))
-            rx_data.append(
-                read_utils.dB(
-                    target_data[obs][tun][pol][indices[0],freqchan] #freqchan, 512]
-                )
-            )
+            refined_array[row:row+len(sortie.mission_data), :ncols] = sortie.mission_data
+            row += len(sortie.mission_data)
+
+            #only the mission window of the reference channel is read from disk
+            times, data = sortie.data_dict.read(obs, tun, pol, freqchan, start_time, end_time)
+            t_rx.append(times)
+            rx_data.append(read_utils.dB(data))
 
         rx = np.concatenate(rx_data)
         t_rx = np.concatenate(t_rx)
-        pos_times = np.concatenate(pos_times)
-        postimes = Time(pos_times, format = 'unix')
-        time_info =  Time(t_rx,scale='utc')
-        interp_rx = read_utils.interp_rx(postimes, time_info, rx)
+        refined_array[:, ncols] = read_utils.interp_rx(refined_array[:, 0], t_rx, rx)
 
-        for i,sortie in enumerate(sorties):
-            if i == 0:
-                sortie_full_mission = sortie.mission_data
-            else:
-                sortie_full_mission = np.vstack((sortie_full_mission, sortie.mission_data))
-
-        interp_arr = np.zeros((interp_rx.shape[0],1))
-        for i, interp in enumerate(interp_rx):
-            interp_arr[i,0] = interp
-
-        refined_array = np.hstack((sortie_full_mission, interp_arr))
         self.refined_array=refined_array[~np.isnan(refined_array).any(axis=1)]
         self.rx_full = rx
-        self.t_rx_full = time_info
+        self.t_rx_full = Time(t_rx, scale='utc', format='unix')
+
+        return
+
+    def interpolate_rx_cube(self, obsNum, tuning, polarizations=('XX','YY'), chans=None):
+        '''Interpolate many channels and polarizations onto the position times at once.
+
+        Like interpolate_rx, but every selected channel of every polarization is
+        read in the mission window and interpolated in one vectorized call.
+
+        Args:
+            obsNum (int): the number of the observation to use
+            tuning (int): the number of the tuning to use
+            polarizations (list): polarizations to use ('XX', 'YY', 'YX', 'XY')
+            chans (list): receiver channels to use, all channels if None
+
+        Returns:
+            refined_positions (array): 'Epoch Time(s), Lat(deg), Lon(deg), Alt(m from ground), Yaw(deg)'
+            refined_cube (array): (ntimes, npol, nchan) receiver power (dB) at those times
+        '''
+        obs='Observation'+str(obsNum)
+        tun='Tuning'+str(tuning)
+        pols = list(polarizations)
+
+        sorties = self.sort_sorties()
+        freqs = sorties[0].data_dict.freqs(obs,tun)
+        if chans is None:
+            chans = np.arange(len(freqs))
+            read_chans = slice(None)
+        else:
+            chans = np.atleast_1d(chans)
+            read_chans = list(chans)
+
+        nrows = sum(len(sortie.mission_data) for sortie in sorties)
+        positions = np.empty((nrows, sorties[0].mission_data.shape[1]))
+        rx_data = []
+        t_rx = []
+        row = 0
+        for sortie in sorties:
+            start_time, end_time = sortie.mission_data[0,0], sortie.mission_data[-1,0]
+            positions[row:row+len(sortie.mission_data)] = sortie.mission_data
+            row += len(sortie.mission_data)
+
+            pol_data = []
+            for pol in pols:
+                times, data = sortie.data_dict.read(obs, tun, pol, read_chans, start_time, end_time)
+                pol_data.append(data)
+            t_rx.append(times)
+            rx_data.append(read_utils.dB(np.stack(pol_data, axis=1)))
+
+        cube = read_utils.interp_rx(positions[:,0], np.concatenate(t_rx), np.concatenate(rx_data))
+        good = ~(np.isnan(positions).any(axis=1) | np.isnan(cube.reshape(nrows,-1)).any(axis=1))
+        self.refined_positions = positions[good]
+        self.refined_cube = cube[good]
+        self.cube_pols = pols
+        self.cube_freqs = freqs[chans]
+
+        return
+
+    def make_beam_cube(self, lat=None, lon=None, nside=8):
+        '''Grid the refined cube into (npol, nchan, npix) beam, rms and counts cubes.
+
+        The healpix pixel of each position is found once and shared by every
+        channel and polarization.
+
+        Args:
+            lat (): latitude of the receiver instrument
+            lon (): longitude of the receiver instrument
+            nside (int): of healpix maps
+        Returns:
+
+        '''
+        targetLat = lat if lat else self.lat
+        targetLon = lon if lon else self.lon
+        #skip the first row as Beam.make_hpx_beam does, so each plane matches make_beam
+        positions = self.refined_positions[1:]
+        beam,rms,counts = plot_utils.grid_to_healpix(
+            positions[:,1], positions[:,2], positions[:,3], self.refined_cube[1:],
+            lat0=targetLat, lon0=targetLon, nside=nside)
+        self.hpx_beam_cube = np.moveaxis(beam, 0, -1)
+        self.hpx_rms_cube = np.moveaxis(rms, 0, -1)
+        self.hpx_counts_cube = np.moveaxis(counts, 0, -1)
+        self.cube_nside = nside
+
+        return
+
+    def write_beam_cube(self, prefix):
+        '''Write the beam, rms and counts cubes to a single multi-extension .fits file.
+
+        Args:
+            prefix (str): A string used to name and identify the output file.
+
+        Returns:
+
+        '''
+        read_utils.write_beam_cube(prefix+'_beam_cube.fits', self.hpx_beam_cube, self.hpx_rms_cube,
+                                   self.hpx_counts_cube, self.cube_pols, self.cube_freqs, self.cube_nside)
 
         return
 
@@ -438,6 +567,8 @@ class Observation:
             if not sortie_name:
                 #self.name = "sortie"+f"{sortie_num:02d}"
                 self.name = "sortie%(sortienum)02d"%{'sortienum':sortie_num}
+            else:
+                self.name = sortie_name
             flag_mask = []
 
             return
@@ -483,56 +614,93 @@ class Observation:
             frequency=self.ref_frequency
             obs='Observation1'
             tun='Tuning1'
-            target_data = self.data_dict
             center_freq = frequency*1e6 #into Hz
-            freq_arr = target_data[obs][tun]['freq']
+            freq_arr = self.data_dict.freqs(obs,tun)
             get_ind = np.where(freq_arr<=center_freq)[0][-1]
             return get_ind
 
-        def read(self):
+        def read(self, use_cache=False, cache_dir=None):
             '''Read in the sortie from associated data files.
 
-            The stored tlog, ulog, and receiver datafiles are opened and copied into dictionaries.
+            The stored tlog and ulog are copied into dictionaries. The receiver
+            datafile is opened for lazy reading; call close() to release it.
+
+            With use_cache, the parsed logs and the receiver times/frequencies
+            are kept in an on-disk cache (see cache_utils) keyed by the
+            fingerprints of the three files, so reading an unchanged sortie
+            again skips the parsing. It is off by default, as for the orbcomm
+            readers, so nothing is written outside the data directories
+            unless asked for.
+
+            Args:
+                use_cache (bool): load from and save to the parsed-sortie cache
+                cache_dir (str): cache directory, defaults to cache_utils.CACHE_DIR
 
             Returns:
                 t_dict (dict): A dictionary containing info from the sortie tlog
                 u_dict (dict): A dictionary containing info from the sortie ulog
-                data_dict (dict): A dictionary containing info from the sortie receiver datafile
+                data_dict (ReceiverFile): Lazy access to the sortie receiver datafile
             '''
-            sortie_tlog = read_utils.read_tlog_txt(self.tlog)
-            sortie_ulog = read_utils.read_ulog(
-                self.ulog,
-                messages="vehicle_global_position,vehicle_local_position,vehicle_gps_position"
-            )
-            self.t_dict={
-                "log_type":"t",
-                "waypoint_t":sortie_tlog[0],
-                "global_t":sortie_tlog[1],
-                "local_t":sortie_tlog[2],
-                "gps_t":sortie_tlog[3]
-            }
-            self.u_dict={
-                "log_type":"u",
-                'global_position_u':sortie_ulog[0],
-                'local_position_u':sortie_ulog[1],
-                'gps_position_u':sortie_ulog[2]
-            }
-            #TODO: Add data read instead of reading in interpolate_rx
-            self.data_dict = read_utils.read_h5(self.data)
+            t_keys = ["waypoint_t", "global_t", "local_t", "gps_t"]
+            u_keys = ['global_position_u', 'local_position_u', 'gps_position_u']
+            cached = None
+            if use_cache:
+                key = cache_utils.cache_key([self.tlog, self.ulog, self.data], tag='sortie')
+                cached = cache_utils.load(key, cache_dir)
+            if cached is not None:
+                sortie_tlog = [cached['t/'+k] for k in t_keys]
+                sortie_ulog = [cached['u/'+k] for k in u_keys]
+                rx_index = dict((k[3:], arr) for k, arr in cached.items() if k.startswith('rx/'))
+                self.data_dict = read_utils.ReceiverFile(self.data, index=rx_index)
+            else:
+                sortie_tlog = read_utils.read_tlog_txt(self.tlog)
+                sortie_ulog = read_utils.read_ulog(
+                    self.ulog,
+                    messages="vehicle_global_position,vehicle_local_position,vehicle_gps_position"
+                )
+                self.data_dict = read_utils.ReceiverFile(self.data)
+                if use_cache:
+                    arrays = dict(('rx/'+k, arr) for k, arr in self.data_dict.index().items())
+                    arrays.update(zip(['t/'+k for k in t_keys], sortie_tlog))
+                    arrays.update(zip(['u/'+k for k in u_keys], sortie_ulog))
+                    cache_utils.save(key, arrays, cache_dir)
+            self.t_dict = {"log_type":"t"}
+            self.t_dict.update(zip(t_keys, sortie_tlog))
+            self.u_dict = {"log_type":"u"}
+            self.u_dict.update(zip(u_keys, sortie_ulog))
             self.freq_chan = self.get_freq_chans()
 
             return
 
+        def close(self):
+            '''Close the receiver datafile opened by read().
+
+            '''
+            if hasattr(self, 'data_dict'):
+                self.data_dict.close()
+
+            return
+
         #function to adjust gain?
 
         def flag_waypoints(self):
             '''Flag data arrays based on waypoint data.
 
-            Args:
+            Splits the mission into legs between consecutive waypoints, while
+            flagging the mission start/end as flag_endpoints does.
 
+            Return:
+                flagged_data:
+                mission_data:
+                waypoint_legs: list of (waypoint number, positions flown to reach it)
             '''
-            # flag based on mission waypoints
-            pass
+            self.flagged_data, self.mission_data, self.waypoint_legs = read_utils.mission_endpoint_flagging(
+                self.t_dict["global_t"],
+                self.t_dict["waypoint_t"],
+                segments=True
+            )
+
+            return
 
         def flag_endpoints(self):
             '''Flag data arrays based on mission start/end.
@@ -1,6 +1,10 @@
 from __future__ import print_function
 from __future__ import absolute_import
 import numpy as np,os,sys
+import hashlib
+from collections import OrderedDict
+from scipy import sparse
+from scipy.optimize import fmin
 import healpy as hp
 import math
 from healpy import _healpy_pixel_lib as pixlib
@@ -49,22 +53,97 @@ class nf(float):
             return '%.1f' % self.__float__()
 fmt = '%r$^\circ$'
 
-def rotate_hpm(hpm,rot_phi,rot_theta,pol='EW'):
-    """rotate hpm about phi, then theta (degrees)
-    if pol=EW theta is rotated about the X axis (default)
-    if pol=NS theta is rotated about the Y axis
+#number of rotation operators kept by rotation_operator
+ROTATION_CACHE_SIZE = 64
+
+def pixel_vectors(nside):
+    """Unit vectors of the ring ordered pixel centres, computed once per nside."""
+    return _pixel_vectors.get(nside,lambda: np.array(hp.pix2vec(nside,np.arange(hp.nside2npix(nside)))))
+
+def _rotated_angles(nside,rot_phi,rot_theta,pol='EW',pixels=None):
+    """theta, phi (rad) each pixel centre is taken from by the rotation, see rotation_operator.
+
+    pixels: only find the angles for these pixels, default all
     """
-    nside = hp.npix2nside(len(hpm))
-    indexes = np.arange(len(hpm))
-    theta,phi = hp.pix2ang(nside,indexes)      #get the input map angles (rad)
     if pol=='NS':
         eulertype='X'
     else:
         eulertype='Y'
     R = hp.rotator.Rotator(rot=(rot_phi,rot_theta),deg=True,eulertype=eulertype)                  #make the rotator
-    rotated_theta,rotated_phi = R(theta,phi) #rotate new radians
-    return get_interp_val(hpm,rotated_theta,rotated_phi)
-
+    vectors = pixel_vectors(nside)
+    if pixels is not None:
+        vectors = vectors[:,pixels]
+    return hp.vec2ang(np.dot(R.mat,vectors).T)
+
+def rotation_operator(nside,rot_phi,rot_theta,pol='EW',cache=True):
+    """Sparse operator rotating a map about phi, then theta (degrees).
+
+    The rotated pixel directions are found from the cached pixel vectors and
+    the interpolation onto them is an InterpOperator, kept in an LRU cache
+    so repeated rotations by the same angles are free. Pass cache=False for
+    one-off angles so they don't evict the operators that are reused.
+    if pol=EW theta is rotated about the X axis (default)
+    if pol=NS theta is rotated about the Y axis
+    """
+    def build():
+        return InterpOperator(nside,*_rotated_angles(nside,rot_phi,rot_theta,pol))
+    if not cache:
+        return build()
+    eulertype = 'X' if pol=='NS' else 'Y'
+    return _rotation_operators.get((nside,float(rot_phi),float(rot_theta),eulertype),build)
+
+def rotate_hpm(hpm,rot_phi,rot_theta,pol='EW',cache=True):
+    """rotate hpm about phi, then theta (degrees)
+    if pol=EW theta is rotated about the X axis (default)
+    if pol=NS theta is rotated about the Y axis
+    hpm may be a stack of maps with the pixel axis last, all rotated at once
+    cache=False skips the operator cache, see rotation_operator
+    """
+    nside = hp.npix2nside(np.shape(hpm)[-1])
+    return rotation_operator(nside,rot_phi,rot_theta,pol=pol,cache=cache)(hpm)
+
+def fit_tx_rotation(map_A,err_A,map_B,err_B,model,pol='EW',start=(0,0)):
+    """Fit for a transmitter pointing offset between two maps of the same receiver.
+
+    Finds the rotation (theta, phi) of the transmitter model which, subtracted
+    from map_A, best matches map_B with the unrotated model subtracted,
+    minimizing mean((RXA-RXB)**2/(2*(err_A**2+err_B**2))) over unmasked pixels.
+    Flags on the model propagate to the residuals. Every step of the fit
+    tries new angles, so it rotates the model as rotate_hpm does but with the
+    interpolation weights alone, without building (or caching) an operator.
+
+    Args:
+        map_A, err_A (array): beam and rms of the map with the offset transmitter
+        map_B, err_B (array): beam and rms of the reference map
+        model (array): healpix transmitter beam model, may be masked
+        pol (str): 'NS' or 'EW', see rotate_hpm
+        start (tuple): initial (theta, phi) guess (degrees)
+
+    Returns:
+        theta, phi (float): best fit rotation (degrees)
+    """
+    nside = hp.npix2nside(len(model))
+    valid = ~np.ma.getmaskarray(model)
+    values = np.where(valid,np.ma.getdata(model).astype(float),0)
+    #RXA-RXB is this minus the rotated model, only its unmasked pixels count
+    target = np.ma.asarray(map_A - (map_B - model))
+    weight = np.ma.asarray(2*(err_A**2+err_B**2))
+    pixels = np.flatnonzero(~(np.ma.getmaskarray(target)|np.ma.getmaskarray(weight)))
+    target = np.ma.getdata(target)[pixels]
+    weight = np.ma.getdata(weight)[pixels]
+    def chisq(angles):
+        theta,phi = angles
+        r = pixlib._get_interpol_ring(nside,*_rotated_angles(nside,phi,theta,pol,pixels))
+        p = np.array(r[0:4])
+        w = np.array(r[4:8])
+        #masked model pixels are left out and the weights renormalized, as
+        #in InterpOperator; pixels with only masked neighbours are dropped
+        den = (w*valid[p]).sum(axis=0)
+        keep = den>0
+        rotated = (w*values[p]).sum(axis=0)[keep]/den[keep]
+        return np.mean((target[keep]-rotated)**2/weight[keep])
+    theta,phi = fmin(chisq,start,disp=False)
+    return float(theta),float(phi)
 
 def rotate_hpm_old(hpm,angle,theta_angle=0):
     "rotate hpm angle degrees around the zero pixel (ie around the north pole)"
@@ -87,24 +166,130 @@ def rotate_hpm_old(hpm,angle,theta_angle=0):
         rotated_hpm = get_interp_val(rotated_interpolated_beam,theta,phi)
     return rotated_hpm
 
-def project_healpix(M,rotate_angle=0):
-    #flat plotting
-    try:
-        M.mask
-    except(AttributeError):
-        M = np.ma.array(M)
+#number of projection grids kept by projection_grid
+PROJECTION_CACHE_SIZE = 16
+
+def _projection_angles(res=100,rotate_angle=0):
+    """THETA, PHI and outside of the projection_grid points, made read-only."""
     xmax = 1#np.sin(theta.max())
-    X,Y = np.meshgrid(np.linspace(-xmax,xmax,num=100),
-        np.linspace(-xmax,xmax,num=100))
+    X,Y = np.meshgrid(np.linspace(-xmax,xmax,num=res),
+        np.linspace(-xmax,xmax,num=res))
     R = X**2 + Y**2
-    Z = np.sqrt(1-X**2 - Y**2)
-    Z[np.isnan(Z)] = 0
+    Z = np.sqrt(np.clip(1-X**2 - Y**2,0,None))
     THETA,PHI = hp.vec2ang(np.array([X,Y,Z]).T)
     THETA.shape = PHI.shape = X.shape
     PHI += rotate_angle*np.pi/180
-    IM = get_interp_val(M,THETA,PHI).T
-    IM = np.ma.masked_where(R>1,IM)
+    outside = R>1
+    #shared by every caller, so they must not be changed in place
+    for a in (THETA,PHI,outside):
+        a.flags.writeable = False
+    return THETA,PHI,outside
+
+def projection_grid(nside,res=100,rotate_angle=0):
+    """Orthographic projection grid of the upper hemisphere, cached per (nside, res, rotate_angle).
+
+    Returns:
+        THETA,PHI (array): (res,res) angles of the grid points, read-only
+        outside (array): (res,res) True outside the unit circle, read-only
+        op (InterpOperator): interpolation from nside maps to the grid points
+    """
+    def build():
+        THETA,PHI,outside = _projection_angles(res,rotate_angle)
+        return THETA,PHI,outside,InterpOperator(nside,THETA,PHI)
+    return _projection_grids.get((nside,res,float(rotate_angle)),build)
+
+def project_healpix(M,rotate_angle=0,res=100):
+    """Flat (orthographic) projection of a healpix map, or of a stack of maps.
+
+    The grid and its interpolation weights come from projection_grid, so
+    projecting many maps of the same nside costs one sparse product each,
+    or a single one for a stack.
+
+    Args:
+        M (array): healpix map, or (N,npix) stack of maps
+        rotate_angle (float): azimuthal rotation of the grid (deg)
+        res (int): number of grid points along each side
+
+    Returns:
+        THETA,PHI (array): (res,res) angles of the grid points, read-only
+            (copy them to modify)
+        IM (masked array): (res,res), or (N,res,res) for a stack, masked
+            outside the unit circle
+    """
+    #flat plotting
+    try:
+        M.mask
+    except(AttributeError):
+        M = np.ma.array(M)
+    nside = hp.npix2nside(M.shape[-1])
+    THETA,PHI,outside,op = projection_grid(nside,res=res,rotate_angle=rotate_angle)
+    IM = np.swapaxes(op(M),-1,-2)
+    IM = np.ma.masked_where(np.broadcast_to(outside,IM.shape),IM)
     return THETA,PHI,IM
+def healpix_moments(pixes,values,npix):
+    """Accumulate samples into healpix pixels in a single vectorized pass.
+
+    Sums, sums of squares and counts are reduced with np.bincount, which adds
+    the samples in the same order as a per-sample loop would. Values with
+    more than one dimension (e.g. a (nsamples,npol,nchan) spectrum cube) are
+    sorted by pixel once and reduced for every column together.
+
+    Args:
+        pixes (array): healpix pixel index of each sample
+        values (array): sample values, first axis the same length as pixes
+        npix (int): number of pixels in the output map
+
+    Returns:
+        beam (array): mean of the samples falling in each pixel
+        rms (array): standard deviation of the samples falling in each pixel
+        counts (array): number of samples falling in each pixel
+        The maps have shape (npix,)+values.shape[1:].
+    """
+    pixes = np.asarray(pixes).ravel()
+    values = np.asarray(values,dtype=float)
+    if values.ndim==1:
+        counts = np.bincount(pixes,minlength=npix).astype(float)
+        beam = np.bincount(pixes,weights=values,minlength=npix)
+        rms = np.bincount(pixes,weights=values**2,minlength=npix)
+    else:
+        order = np.argsort(pixes,kind='stable')
+        sorted_pixes = pixes[order]
+        values = values[order]
+        starts = np.flatnonzero(np.r_[True,sorted_pixes[1:]!=sorted_pixes[:-1]])
+        used = sorted_pixes[starts]
+        counts = np.zeros((npix,)+values.shape[1:])
+        beam = np.zeros_like(counts)
+        rms = np.zeros_like(counts)
+        counts[used] = np.diff(np.r_[starts,len(pixes)]).reshape((-1,)+(1,)*(values.ndim-1))
+        beam[used] = np.add.reduceat(values,starts,axis=0)
+        rms[used] = np.add.reduceat(values**2,starts,axis=0)
+    seen = counts>0
+    beam[seen] /= counts[seen]
+    rms[seen] /= counts[seen]
+    rms -= beam**2
+    rms = np.sqrt(rms)
+    return beam,rms,counts
+def fill_unseen(beam,rms,counts,inflate=False):
+    """Mark empty pixels as hp.UNSEEN, optionally inflating the rms.
+
+    Args:
+        beam, rms, counts (array): maps as returned by healpix_moments
+        inflate (bool): scale the rms by the worst case error on the standard
+            deviation, 1+1/sqrt(2(N-1))
+
+    Returns:
+        beam,rms,counts
+    """
+    empty = counts==0
+    beam[empty] = hp.UNSEEN
+    counts[empty] = hp.UNSEEN
+    rms[empty] = hp.UNSEEN
+    if inflate:
+        #the standard deviation is uncertain for small counts
+        #the the error in the standard deviation goes as 1/sqrt(2(N-1))
+        #lets inflate the reported error to report the worst case upper limit
+        rms *= (1+1./np.sqrt(2*(counts-1)))
+    return beam,rms,counts
 def grid_theta_phi_to_healpix(theta,phi,inbeam):
     """
     inputs:
@@ -115,57 +300,41 @@ def grid_theta_phi_to_healpix(theta,phi,inbeam):
     print((len(theta),len(phi),len(inbeam)))
     nside = hp.npix2nside(len(inbeam))
     pixes = hp.ang2pix(nside,theta,phi)
-    beam = np.zeros(hp.nside2npix(nside))
-    rms = np.zeros(hp.nside2npix(nside))
-    counts = np.zeros(hp.nside2npix(nside))
-    for i,pix in enumerate(pixes):
-        beam[pix] += inbeam[i]
-        rms[pix] += inbeam[i]**2
-        counts[pix] += 1
-    beam[counts>0] /= counts[counts>0]
-    rms[counts>0] /= counts[counts>0]
-    rms -= beam**2
-    rms = np.sqrt(rms)
-    beam[counts==0] = hp.UNSEEN
-    counts[counts==0] = hp.UNSEEN
-    rms[counts==0] = hp.UNSEEN
-    return beam,rms,counts
+    beam,rms,counts = healpix_moments(pixes,inbeam,hp.nside2npix(nside))
+    return fill_unseen(beam,rms,counts)
+def healpix_pixels(lats,lons,alts,lat0,lon0,nside=8):
+    """Healpix pixel of each drone position, as seen from the receiver.
+
+    Args:
+        lats, lons (array): drone position (deg)
+        alts (array): drone altitude relative to the receiver (m)
+        lat0, lon0 (float): receiver position (deg)
+        nside (int): of healpix map
+
+    Returns:
+        pixes (array): ring ordered pixel index of each position
+    """
+    # Convert lat/lon to x/y
+    x,y = latlon2xy(lats,lons,lat0,lon0)
+    # Obtain spherical coordinates for x, y, and alt
+    rs,thetas,phis = to_spherical(x,y,alts)
+    return hp.ang2pix(nside,thetas,phis)
 def grid_to_healpix(lats,lons,alts,rx,lat0,lon0,nside=8):
     """
     input:
         lats (deg)
         lons (deg)
         alts (m) (relative)
-        rx: power in dB
+        rx: power in dB, (nsamples,) or (nsamples,...) for several channels
         lat0: lat of rx ant (deg)
         lon0: lon of rx ant
         nside: of healpix map
+    return:
+        beam, rms, counts maps of shape (npix,)+rx.shape[1:]
     """
-    # Convert lat/lon to x/y
-    x,y = latlon2xy(lats,lons,lat0,lon0)
-    # Obtain spherical coordinates for x, y, and alt
-    rs,thetas,phis = to_spherical(x,y,alts)
-    pixes = hp.ang2pix(nside,thetas,phis)
-    beam = np.zeros(hp.nside2npix(nside))
-    rms = np.zeros(hp.nside2npix(nside))
-    counts = np.zeros(hp.nside2npix(nside))
-    for i,pix in enumerate(pixes):
-        beam[pix] += rx[i]
-        rms[pix] += rx[i]**2
-        counts[pix] += 1
-    beam[counts>0] /= counts[counts>0]
-    rms[counts>0] /= counts[counts>0]
-    rms -= beam**2
-    rms = np.sqrt(rms)
-    beam[counts==0] = hp.UNSEEN
-    counts[counts==0] = hp.UNSEEN
-    rms[counts==0] = hp.UNSEEN
-    #the standard deviation is uncertain for small counts
-    #the the error in the standard deviation goes as 1/sqrt(2(N-1))
-    #lets inflate the reported error to report the worst case upper limit
-    #print 'Inflating error bars for low number counts'
-    rms *= (1+1./np.sqrt(2*(counts-1)))
-    return beam,rms,counts
+    pixes = healpix_pixels(lats,lons,alts,lat0,lon0,nside=nside)
+    beam,rms,counts = healpix_moments(pixes,rx,hp.nside2npix(nside))
+    return fill_unseen(beam,rms,counts,inflate=True)
 def downgrade_rms(Map):
     #input a healpix map
     #return the standard deviation we'd get if we degraded to nside/2
@@ -173,7 +342,7 @@ def downgrade_rms(Map):
     Map_nest = np.reshape(Map_nest,(len(Map)/4,4))
     return np.std(Map_nest,axis=1)
 def make_beam(lats,lons,alts,spec_raw,lat0=0.0,lon0=0.0,
-              nsides=8,volts=False,normalize=False,freq_chan=0):
+              nsides=8,volts=False,normalize=False,freq_chan=0,binsize=5):
     # Convert lat/lon to x/y
     x,y = latlon2xy(lats,lons,lat0,lon0)
     # Obtain spherical coordinates for x, y, and alt
@@ -192,10 +361,8 @@ def make_beam(lats,lons,alts,spec_raw,lat0=0.0,lon0=0.0,
     if normalize:
         z -= z.max() # Scaled on [-infty,0]
 
-    # Set binsize (used in function grid_data)
-    # Affects the apparent size of the pixels on the plot created below.
-    binsize=5
     # Obtain gridded data
+    # binsize affects the apparent size of the pixels on the plot created below.
     grid,bins,rmsBins,binloc,xg,yg,gcounts,grms = grid_data(x,y,z,binsize=binsize)
 
     # Healpix things
@@ -220,56 +387,76 @@ def make_beam(lats,lons,alts,spec_raw,lat0=0.0,lon0=0.0,
 
 
 def grid_data(x, y, z, binsize=0.01, retbin=True, retloc=True, retrms=True):
+    """Bin scattered z(x,y) samples onto a regular grid of cells.
+
+    Every sample is assigned to its cell once, from integer bin indices, and
+    the samples are then sorted and grouped by cell so the per-cell median,
+    standard deviation and counts are computed in O(N log N) rather than by
+    scanning all samples for every cell.
+
+    Args:
+        x, y (array): sample coordinates
+        z (array): sample values
+        binsize (float): width of a grid cell, in the units of x and y
+        retbin (bool): return the number of samples in each cell
+        retloc (bool): return the sample indices falling in each cell
+        retrms (bool): return the standard deviation in each cell
+
+    Returns:
+        grid (masked array): median of each cell, masked where empty
+        bins (array): number of samples in each cell (if retbin)
+        rmsBins (masked array): standard deviation of each cell (if retrms)
+        wherebin (list): nrow lists of ncol arrays of sample indices (if retloc)
+        xi, yi (array): coordinates of the cell centers
+        gcounts (array): number of samples sharing each sample's cell
+        grms (array): standard deviation of each sample's cell
+    """
     # Get extrema values.
     xmin, xmax = x.min(), x.max()
     ymin, ymax = y.min(), y.max()
     # Make coordinate arrays.
     xi = np.arange(xmin, xmax+binsize, binsize)
     yi = np.arange(ymin, ymax+binsize, binsize)
+    ncol, nrow = len(xi), len(yi)
+
+    # Assign each sample to the cell whose center is within binsize/2
+    col = np.clip(np.rint((x - xmin)/binsize).astype(int), 0, ncol-1)
+    row = np.clip(np.rint((y - ymin)/binsize).astype(int), 0, nrow-1)
+    inbin = np.logical_and(np.abs(x - xi[col]) < binsize/2.,
+                           np.abs(y - yi[row]) < binsize/2.)
+    ind = np.where(inbin)[0]
+    cell = row[ind]*ncol + col[ind]
     xi, yi = np.meshgrid(xi,yi)
 
-    # Make the grid.
-    grid = np.zeros(xi.shape, dtype=x.dtype)
-    nrow, ncol = grid.shape
-    if retbin: bins = np.copy(grid)
-    if retrms: rmsBins = np.copy(grid)
+    # Group the samples by cell, sorted by value within each cell
+    zb = z[ind]
+    counts = np.bincount(cell, minlength=nrow*ncol)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    zsorted = zb[np.lexsort((zb, cell))]
+    full = counts > 0
+    lo = starts[full] + (counts[full]-1)//2
+    hi = starts[full] + counts[full]//2
+    grid = np.full(nrow*ncol, np.nan, dtype=x.dtype)
+    grid[full] = (zsorted[lo] + zsorted[hi])/2.
+    mean = np.bincount(cell, weights=zb, minlength=nrow*ncol)
+    mean[full] /= counts[full]
+    var = np.bincount(cell, weights=(zb - mean[cell])**2, minlength=nrow*ncol)
+    rms = np.full(nrow*ncol, np.nan)
+    rms[full] = np.sqrt(var[full]/counts[full])
 
     # Make arrays to store counts/rms for Healpix data
     gcounts = np.zeros_like(z)
     grms = np.zeros_like(z)
+    gcounts[ind] = counts[cell]
+    grms[ind] = rms[cell]
 
-    # Create list in same shape as grid to store indices
+    grid = grid.reshape(nrow, ncol)
+    if retbin: bins = counts.reshape(nrow, ncol).astype(x.dtype)
+    if retrms: rmsBins = rms.reshape(nrow, ncol).astype(x.dtype)
     if retloc:
-        wherebin = np.copy(grid)
-        wherebin = wherebin.tolist()
-    # Fill in the grid.
-    for row in range(nrow):
-        for col in range(ncol):
-            xc = xi[row, col]    # x coordinate.
-            yc = yi[row, col]    # y coordinate.
-
-            # Find the position that xc and yc correspond to.
-            posx = np.abs(x - xc)
-            posy = np.abs(y - yc)
-            ibin = np.logical_and(posx < binsize/2., posy < binsize/2.)
-            ind  = np.where(ibin == True)[0]
-
-            # Fill the bin.
-            bin = z[ibin]
-            gcounts[ibin] = np.sum(ibin) # Update counts at each x position
-            if retloc: wherebin[row][col] = ind
-            if retbin: bins[row, col] = bin.size
-            if bin.size != 0:
-                binval = np.median(bin)
-                grid[row, col] = binval
-                if retrms:
-                    rmsBins[row,col] = np.std(bin)
-                    grms[ibin] = np.std(bin)
-            else:
-                grid[row, col] = np.nan   # Fill empty bins with nans.
-                if retrms:
-                    rmsBins[row,col] = np.nan
-                    grms[ibin] = np.nan
+        # ascending sample indices for each cell, in nested row/col lists
+        cellind = np.split(ind[np.argsort(cell, kind='stable')], np.cumsum(counts)[:-1])
+        wherebin = [cellind[r*ncol:(r+1)*ncol] for r in range(nrow)]
 
     # Return the grid
     if retbin:
@@ -347,24 +534,64 @@ def animate_peak(i,peak_plot,peak_line,noise_line,pkrms_plot,pkrms_line,spec_tim
     pkrms_plot.autoscale_view(True,True,True)
 
 
+def pixel_boundaries(nside):
+    """(npix,4,2) x/y vertices of every healpix pixel, computed once per nside."""
+    def build():
+        boundaries = hp.boundaries(nside,np.arange(hp.nside2npix(nside)))
+        return np.swapaxes(boundaries[:,0:2,:],1,2)
+    return _pixel_boundaries.get(nside,build)
+
 def make_polycoll(hpx_beam,plot_lim=[-90,-50],nsides=8,cmap=cm.gnuplot):
     #pixnums = np.arange(len(hpx_beam))
     #theta,phi = hp.pix2ang(nsides,pixnums)
     #pix = pixnums[np.argwhere(theta<np.pi/2)].squeeze()
     pix = np.where(np.isnan(hpx_beam)==False)[0]
-    boundaries = hp.boundaries(nsides,pix)
-    verts = np.swapaxes(boundaries[:,0:2,:],1,2)
+    verts = pixel_boundaries(nsides)[pix]
     coll = PolyCollection(verts, array=hpx_beam[np.isnan(hpx_beam)==False],\
                                     cmap=cmap,edgecolors='none')
     return coll
 
+class HealpixCollection(PolyCollection):
+    """PolyCollection of every pixel of a healpix map, recoloured in place.
+
+    The pixel geometry comes from the per-nside cache (pixel_boundaries) and
+    is never rebuilt; set_beam only swaps the colour array, so animating a
+    beam as it fills in costs a colour update per frame. NaN or masked
+    pixels are drawn in the colormap's 'bad' colour, transparent by default.
+
+    Args:
+        hpx_beam (array): healpix map
+        nsides (int): nside of the map
+        cmap: matplotlib colormap
+    """
+    def __init__(self,hpx_beam,nsides=8,cmap=cm.gnuplot,**kwargs):
+        kwargs.setdefault('edgecolors','none')
+        super(HealpixCollection,self).__init__(pixel_boundaries(nsides),cmap=cmap,**kwargs)
+        self.nside = nsides
+        self.set_beam(hpx_beam)
+
+    def set_beam(self,hpx_beam,autoscale=True):
+        """Recolour the pixels from a new map, rescaling the colours unless autoscale=False."""
+        values = np.ma.masked_invalid(np.ma.asarray(hpx_beam,dtype=float))
+        self.set_array(values)
+        if autoscale and values.count():
+            self.norm.autoscale(values)
 
 def animate_beam(beam_plot,hpx_beam,fig,cax,cbar,plot_lim=[-40,5],nsides=8):
-    coll = make_polycoll(hpx_beam,nsides=8)#,plot_lim=plot_lim)
+    colls = beam_plot.collections
+    if len(colls) and isinstance(colls[-1],HealpixCollection) and colls[-1].nside==nsides:
+        coll = colls[-1]
+        coll.set_beam(hpx_beam)
+        if coll.colorbar is not None and coll.colorbar.ax is cax:
+            #the colorbar follows the collection's norm on its own
+            return
+    else:
+        coll = HealpixCollection(hpx_beam,nsides=nsides)#,plot_lim=plot_lim)
+        if len(colls):
+            colls[-1].remove()
+        beam_plot.add_collection(coll)
     cax.cla()
     cbar = fig.colorbar(coll, cax=cax, use_gridspec=True, label='dB')
-    beam_plot.collections.remove(beam_plot.collections[-1])
-    beam_plot.add_collection(coll)
 
 
 def adjustErrbarxy(errobj, x, y, y_error):
@@ -383,10 +610,9 @@ def adjustErrbarxy(errobj, x, y, y_error):
 
 
 def animate_cuts(cuts_plot,cuts_E_line,cuts_H_line,hpx_beam,hpx_rms,ell,az):
-    beam_slice_E = get_interp_val(hpx_beam,ell,az)
-    beam_slice_E_err = get_interp_val(hpx_rms,ell,az)
-    beam_slice_H = get_interp_val(hpx_beam,ell,az+np.pi/2)
-    beam_slice_H_err = get_interp_val(hpx_rms,ell,az+np.pi/2)
+    maps = np.ma.stack((hpx_beam,hpx_rms))
+    beam_slice_E,beam_slice_E_err = get_interp_val(maps,ell,az)
+    beam_slice_H,beam_slice_H_err = get_interp_val(maps,ell,az+np.pi/2)
 
     beam_slice_E = np.ma.masked_invalid(beam_slice_E)
     beam_slice_E_err = np.ma.masked_invalid(beam_slice_E_err)
@@ -434,21 +660,106 @@ def add_cut_glyph(parent_fig=None,parent_axes=None,pos=(0.8,0.8),size=(.1),cut='
     ax.imshow(glyph,interpolation='none')
     return
 
+#number of interpolation operators kept by interp_operator
+INTERP_CACHE_SIZE = 32
+
+class _LRUCache(object):
+    """Least recently used cache of values which are expensive to build."""
+    def __init__(self,maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+    def get(self,key,build):
+        """Return the value for key, calling build() to make it on a miss."""
+        if key in self._items:
+            self._items.move_to_end(key)
+            return self._items[key]
+        value = build()
+        self._items[key] = value
+        while len(self._items)>self.maxsize:
+            self._items.popitem(last=False)
+        return value
+    def clear(self):
+        self._items.clear()
+def _array_key(*arrays):
+    """Hashable key for the contents of some arrays."""
+    digest = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a,dtype=float)
+        digest.update(str(a.shape).encode())
+        digest.update(a.tobytes())
+    return digest.hexdigest()
+
+class InterpOperator(object):
+    """Healpix bilinear interpolation onto fixed points, as a sparse matrix.
+
+    Row i holds the four neighbour pixels and weights of point i, as given by
+    healpy's interpolation. Once built, interpolating any map (or stack of
+    maps) of this nside to the points is one sparse matrix product.
+
+    Args:
+        nside (int): of the maps to interpolate
+        theta, phi (array): points to interpolate to (rad)
+        nest (bool): maps are nest ordered
+    """
+    def __init__(self,nside,theta,phi,nest=False):
+        theta,phi = np.broadcast_arrays(np.asarray(theta,dtype=float),np.asarray(phi,dtype=float))
+        self.shape = theta.shape
+        self.npix = hp.nside2npix(nside)
+        if nest:
+            r=pixlib._get_interpol_nest(nside,theta.ravel(),phi.ravel())
+        else:
+            r=pixlib._get_interpol_ring(nside,theta.ravel(),phi.ravel())
+        p = np.array(r[0:4])
+        w = np.array(r[4:8])
+        npts = p.shape[1]
+        rows = np.tile(np.arange(npts),4)
+        self.matrix = sparse.csr_matrix((w.ravel(),(rows,p.ravel())),shape=(npts,self.npix))
+        self.weight_sums = np.asarray(self.matrix.sum(axis=1)).ravel()
+
+    def __call__(self,m):
+        """Interpolate a map, or a stack of maps with the pixel axis last.
+
+        Masked pixels are left out and the weights of the rest renormalized,
+        points with only masked neighbours are masked.
+
+        Returns:
+            val (masked array): shape m.shape[:-1]+points shape
+        """
+        data = np.ma.getdata(m).astype(float)
+        stack = data.shape[:-1]
+        data = data.reshape(-1,self.npix).T
+        if np.ma.is_masked(m):
+            valid = ~np.ma.getmaskarray(m).reshape(-1,self.npix).T
+            num = self.matrix.dot(np.where(valid,data,0))
+            den = self.matrix.dot(valid.astype(float))
+        else:
+            num = self.matrix.dot(data)
+            den = np.repeat(self.weight_sums[:,None],num.shape[1],axis=1)
+        empty = den==0
+        den[empty] = 1
+        val = (num/den).T.reshape(stack+self.shape)
+        return np.ma.array(val,mask=empty.T.reshape(stack+self.shape))
+
+_interp_operators = _LRUCache(INTERP_CACHE_SIZE)
+_rotation_operators = _LRUCache(ROTATION_CACHE_SIZE)
+_pixel_vectors = _LRUCache(8)
+_projection_grids = _LRUCache(PROJECTION_CACHE_SIZE)
+_pixel_boundaries = _LRUCache(8)
+def interp_operator(nside,theta,phi,nest=False):
+    """InterpOperator for these points, reused while it stays in the LRU cache."""
+    key = (nside,nest,_array_key(theta,phi))
+    return _interp_operators.get(key,lambda: InterpOperator(nside,theta,phi,nest=nest))
+
 def get_interp_val(m,theta,phi,nest=False):
-    m2=m.ravel()
-    nside=hp.pixelfunc.npix2nside(m2.size)
-    if nest:
-        r=pixlib._get_interpol_nest(nside,theta,phi)
-    else:
-        r=pixlib._get_interpol_ring(nside,theta,phi)
-    p = np.array(r[0:4])
-    w = np.array(r[4:8])
-    w = np.ma.array(w)
-    if np.ma.is_masked(m2):
-        w.mask = m2[p].mask
-    del r
-    val = np.ma.sum(m2[p]*w/np.ma.sum(w,axis=0),axis=0)
-    return val
+    """Interpolate a healpix map (or a stack of maps, pixel axis last) at theta, phi.
+
+    The sparse interpolation operator for the points is built on first use and
+    cached (see interp_operator), so evaluating many maps on the same grid only
+    costs a sparse product each.
+    """
+    m = np.ma.asanyarray(m) if np.ma.isMaskedArray(m) else np.asanyarray(m)
+    nside=hp.pixelfunc.npix2nside(m.shape[-1] if m.ndim else m.size)
+    return interp_operator(nside,theta,phi,nest=nest)(m)
 
 
 def add_diagram(axs,xys,xytexts,colors,labels=None):
@@ -509,8 +820,9 @@ def healpix_grid(beams,title,subtitles,rows,cols):
     plt.figure()
     plt.axis('equal')
     plt.suptitle(title)
+    #only the grid angles are needed for the contours
+    THETA,PHI,outside = _projection_angles()
     for i,beam in enumerate(beams):
-        THETA,PHI,IM = project_healpix(beam)
         X,Y = np.meshgrid(
                 np.linspace(-1,1,num=THETA.shape[0]),
                 np.linspace(-1,1,num=THETA.shape[1]))
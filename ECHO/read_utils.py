@@ -1,12 +1,14 @@
 from __future__ import print_function
 from __future__ import absolute_import
 import numpy as np,healpy as hp
-import sys
+import io,os,sys,tempfile
 import glob
+from itertools import islice
 from astropy.time import Time
 
 from scipy.interpolate import interp1d
-from .time_utils import flight_time_filter,waypt_time_filter, DatetimetoUnix
+from .time_utils import flight_time_filter,waypt_time_filter, datetimes_to_unix, interval_mask
+from . import cache_utils
 from distutils.version import StrictVersion
 import pyulog.core as pyu
 import pyulog.ulog2csv as pyucsv
@@ -35,35 +37,290 @@ def write_map(filename,M):
     M.set_fill_value(hp.UNSEEN)
     hp.write_map(filename,M.filled())
     return 0
+def write_beam_cube(filename,beam,rms,counts,pols,freqs,nside):
+    """Write a beam cube to a single multi-extension fits file.
+
+    Extensions BEAM, RMS and COUNTS hold (npol,nchan,npix) ring ordered
+    healpix maps, FREQS the channel frequencies (Hz). The polarizations are
+    listed in the primary header.
+    """
+    from astropy.io import fits
+    primary = fits.PrimaryHDU()
+    primary.header['NSIDE'] = nside
+    primary.header['ORDERING'] = 'RING'
+    primary.header['POLS'] = ','.join(pols)
+    hdus = [primary]
+    for name,cube in (('BEAM',beam),('RMS',rms),('COUNTS',counts)):
+        hdus.append(fits.ImageHDU(np.asarray(cube,dtype=np.float64),name=name))
+    hdus.append(fits.ImageHDU(np.asarray(freqs,dtype=np.float64),name='FREQS'))
+    fits.HDUList(hdus).writeto(filename,overwrite=True)
+    return 0
+def read_beam_cube(filename):
+    """Read a beam cube written by write_beam_cube.
+
+    Returns:
+        cube (dict): 'beam', 'rms', 'counts' (npol,nchan,npix) arrays,
+            'freqs', 'pols' and 'nside'
+    """
+    from astropy.io import fits
+    with fits.open(filename) as hdus:
+        cube = dict((name.lower(),np.array(hdus[name].data)) for name in ('BEAM','RMS','COUNTS','FREQS'))
+        cube['pols'] = hdus[0].header['POLS'].split(',')
+        cube['nside'] = hdus[0].header['NSIDE']
+    return cube
+#Layout of the dataflash text messages read_apm_log uses, by firmware version.
+#Fields are indices into the comma separated line (0 is the message name).
+#GPS gives the GPS ms of week, week number, lat, lon, alt and (last field)
+#the log clock time; the mode number field of MODE lines differs between
+#versions, and 3.3.3 logs are only read after the STRT message. 3.3.2 logs
+#stay past the start waypoint until auto mode is left, 3.3.3 logs re-check
+#it at every CMD.
+APM_LAYOUTS = {
+    '3.3.2':{'timescale':1e3,'mode':1,'strt':False,'latch':True,
+             'GPS':(2,3,6,7,8,-1),'ATT':(1,7),'CMD':(1,3)},
+    '3.3.3':{'timescale':1e6,'mode':3,'strt':True,'latch':False,
+             'GPS':(3,4,7,8,9,-1),'ATT':(1,7),'CMD':(1,3)},
+}
+APM_COLUMNS = {
+    'GPS':(('ms',int),('week',int),('lat',float),('lon',float),('alt',float),('time',float)),
+    'ATT':(('time',float),('yaw',float)),
+    'CMD':(('time',float),('num',int)),
+}
+#the last waypoint before the mapping run; data is kept once a later one is commanded
+APM_START_WAYPOINT = 3
+def _apm_layout(version):
+    if StrictVersion(version)<StrictVersion('3.3.3'):
+        return APM_LAYOUTS['3.3.2']
+    return APM_LAYOUTS['3.3.3']
 def apm_version(filename):
     """
     Read an apm file and try to detirmine the version of the firmware which wrote it
+
+    Only the log header is read: the firmware writes its version in the first
+    MSG line, before any GPS data. A log without one is assumed to be 3.3.2
+    (MSG without a version) or unknown, '0.0.1' (no MSG at all).
     """
-    lines = open(filename).readlines()
-    for line in lines:
-        #in 3.3.3 and higher the first MSG line gives the version
-        if line.startswith('MSG'):
-            try:
-                version = line.split('V')[1].split()[0]
-                return version
-            except(IndexError):
-                #big assumption here, that if the version is unlisted its 3.3.2
-                #if you know a better way to tell the version in old logs
-                #  please put it here
-                return '3.3.2'
+    with open(filename) as f:
+        for line in f:
+            #in 3.3.3 and higher the first MSG line gives the version
+            if line.startswith('MSG'):
+                try:
+                    version = line.split('V')[1].split()[0]
+                    return version
+                except(IndexError):
+                    #big assumption here, that if the version is unlisted its 3.3.2
+                    #if you know a better way to tell the version in old logs
+                    #  please put it here
+                    return '3.3.2'
+            if line.startswith('GPS'):
+                break
     return '0.0.1'
-def read_apm_logs(apm_files):
+def _message_lines(buf,starts,names):
+    """Line numbers of each message type, from the first bytes of every line of buf."""
+    #only look closer at lines starting with the right letter
+    first = buf[starts]
+    candidates = np.flatnonzero(np.isin(first,np.frombuffer(''.join(name[0] for name in names).encode(),dtype=np.uint8)))
+    #lines too short to hold a name read into the next line, which can't match
+    head = buf[np.minimum(starts[candidates,None]+np.arange(5),len(buf)-1)]
+    keys = np.ascontiguousarray(head[:,:4]).view('<u4').ravel()
+    lines = {}
+    for name in names:
+        prefix = (name+',').encode()
+        match = keys==np.frombuffer(prefix[:4],dtype='<u4')[0]
+        if len(prefix)>4:
+            match &= head[:,4]==prefix[4]
+        lines[name] = candidates[match]
+    return lines
+def _parse_apm_fields(block,starts,ends,fields):
+    """Selected numeric fields of a set of same message lines, as (n,nfields) floats.
+
+    The lines are joined and the fields converted by numpy's loadtxt in one
+    call. If the lines don't all have the same numeric fields they are parsed
+    one by one instead.
+    """
+    out = np.full((len(starts),len(fields)),np.nan)
+    if len(starts)==0:
+        return out
+    starts,ends = starts.tolist(),ends.tolist()
+    nfields = block.count(b',',starts[0],ends[0])+1
+    usecols = [f%nfields for f in fields]
+    text = b''.join([block[s:e+1] for s,e in zip(starts,ends)])
+    try:
+        out[:] = np.loadtxt(io.BytesIO(text),delimiter=',',usecols=usecols,ndmin=2)
+        return out
+    except (ValueError,IndexError):
+        pass
+    for i,(s,e) in enumerate(zip(starts,ends)):
+        line = block[s:e].decode(errors='replace').split(',')
+        try:
+            out[i] = [float(line[f]) for f in fields]
+        except (ValueError,IndexError):
+            continue
+    return out
+class _APMState(object):
+    """MODE/CMD state carried from one chunk of a dataflash log to the next."""
+    def __init__(self,layout):
+        self.layout = layout
+        self.started = not layout['strt']
+        self.auto = False
+        self.pastwaypoint = False
+    @property
+    def active(self):
+        return self.started and self.auto and self.pastwaypoint
+    def event(self,name,fields):
+        """Step the state machine on a STRT, MODE or CMD line.
+
+        Returns:
+            keep (bool): whether a CMD line is inside the mission
+        """
+        if name=='STRT':
+            self.started = True
+        elif not self.started:
+            return False
+        elif name=='MODE':
+            #http://ardupilot.org/copter/docs/common-downloading-and-analyzing-data-logs-in-mission-planner.html
+            #Mode (0=Stabilize, 1=Acro, 2=AltHold, 3=Auto, 4=Guided, 5=Loiter, 6=RTL, 7=Circle, 8=Position, 9=Land, 10=OF_Loiter, 11=Drift, 13=Sport, 14=Flip, 15=AutoTune, 16=PosHold, 17=Brake)
+            #only collect data in auto mode
+            self.auto = int(fields[self.layout['mode']])==3
+            if not self.auto:
+                #if we go out of auto reset this check
+                self.pastwaypoint = False
+        elif name=='CMD' and self.auto:
+            if not (self.layout['latch'] and self.pastwaypoint):
+                cmd = int(fields[self.layout['CMD'][1]])
+                #only collect data once we pass the start waypoint
+                self.pastwaypoint = cmd>APM_START_WAYPOINT
+            return self.pastwaypoint
+        return False
+def _parse_apm_chunk(block,state):
+    """Columns of the GPS, ATT and CMD lines in the mission, from complete lines in block."""
+    layout = state.layout
+    buf = np.frombuffer(block,dtype=np.uint8)
+    ends = np.flatnonzero(buf==ord('\n'))
+    starts = np.r_[0,ends[:-1]+1]
+    lines = _message_lines(buf,starts,('STRT','MODE','CMD','GPS','ATT'))
+    #step the state machine through the (few) STRT/MODE/CMD lines, in order
+    events = np.sort(np.concatenate((lines['STRT'],lines['MODE'],lines['CMD'])))
+    active = np.empty(len(events)+1,dtype=bool)
+    active[0] = state.active
+    keep_cmd = []
+    for j,i in enumerate(events):
+        fields = block[starts[i]:ends[i]].decode(errors='replace').split(',')
+        name = fields[0].strip()
+        if state.event(name,fields) and name=='CMD':
+            keep_cmd.append(i)
+        active[j+1] = state.active
+    chunk = {}
+    for name in APM_COLUMNS:
+        if name=='CMD':
+            rows = np.array(keep_cmd,dtype=int)
+        else:
+            #the state in force at each line is the one after the last event before it
+            rows = lines[name]
+            rows = rows[active[np.searchsorted(events,rows)]]
+        chunk[name] = _parse_apm_fields(block,starts[rows],ends[rows],layout[name])
+    return chunk
+def _line_blocks(filename,chunk_bytes=2**24,size=None):
+    """Read a text file in blocks of whole lines.
+
+    Args:
+        size (int, optional): only read the first size bytes, so a file which
+            is still being written reads the same each time
+
+    Yields:
+        offset (int): byte offset of the block in the file
+        block (bytes): complete lines, each ending in a newline
+    """
+    with open(filename,'rb') as f:
+        offset = 0
+        tail = b''
+        remaining = size
+        while True:
+            block = f.read(chunk_bytes if remaining is None else min(chunk_bytes,remaining))
+            if remaining is not None:
+                remaining -= len(block)
+            if len(block)==0:
+                if len(tail)==0:
+                    break
+                #the last line may not end in a newline
+                block,tail = tail+b'\n',b''
+            else:
+                block,tail = tail+block,b''
+                end = block.rfind(b'\n')+1
+                block,tail = block[:end],block[end:]
+                if end==0:
+                    continue
+            yield offset,block
+            offset += len(block)
+def read_apm_dataflash(apm_file,version=None,chunk_bytes=2**24,index=None):
+    """Stream the GPS, ATT and CMD messages of an apm dataflash text log.
+
+    The log is read once, chunk_bytes at a time, so memory is bounded by the
+    chunk size and the output. Only data in auto mode and after the start
+    waypoint (APM_START_WAYPOINT) is commanded is kept, as in read_apm_log.
+    Lines are sorted by message type with numpy; only the STRT, MODE and CMD
+    lines are stepped through one at a time.
+
+    Args:
+        apm_file (str): dataflash log in text format
+        version (str, optional): firmware version, by default read from the
+            log header (apm_version)
+        chunk_bytes (int): bytes read at a time
+        index (LogIndex, optional): index of the log. Only the lines of the
+            message types used are then read, and the version comes from it.
+
+    Returns:
+        log (dict): 'version' and, for 'GPS', 'ATT' and 'CMD', a dictionary of
+            typed columns (see APM_COLUMNS)
+    """
+    if version is None:
+        version = apm_version(apm_file) if index is None else index.version
+    state = _APMState(_apm_layout(version))
+    columns = dict((name,_ColumnBuffer(len(APM_COLUMNS[name]))) for name in APM_COLUMNS)
+    if index is None:
+        blocks = _line_blocks(apm_file,chunk_bytes)
+    else:
+        rows = np.sort(np.concatenate([index.rows(name) for name in ('STRT','MODE','CMD','GPS','ATT')]))
+        blocks = index.blocks(rows,chunk_bytes)
+    for offset,block in blocks:
+        chunk = _parse_apm_chunk(block,state)
+        for name,rows in chunk.items():
+            columns[name].append(rows)
+    log = {'version':version}
+    for name,cols in APM_COLUMNS.items():
+        data = columns[name].array()
+        log[name] = dict((col,data[:,i].astype(dtype)) for i,(col,dtype) in enumerate(cols))
+    return log
+def _apm_log_arrays(log):
+    """read_apm_log style outputs from read_apm_dataflash columns."""
+    apm_timescale = _apm_layout(log['version'])['timescale']
+    gps,att,cmd = log['GPS'],log['ATT'],log['CMD']
+    apm_times = gps['week']*SEC_PER_WEEK+gps['ms']/1000.
+    #log clock times are converted by lining up the first GPS fix
+    startTime = gps['time'][0]
+    ATTGPSseconds = att['time']/apm_timescale - startTime/apm_timescale+apm_times[0]
+    ATT_times = Time(ATTGPSseconds, format = 'gps',scale='utc')
+    CMDgpsseconds = cmd['time']/apm_timescale - startTime/apm_timescale+apm_times[0]
+    CMD_times = Time(CMDgpsseconds, format='gps',scale='utc')
+    apm_times = Time(apm_times,format='gps',scale='utc')
+    return apm_times,[gps['lat'],gps['lon'],gps['alt']],ATT_times,[att['yaw']],CMD_times,cmd['num']
+def read_apm_logs(apm_files,use_index=False):
     """
     input:
     apm_files: a list of apm logs
+    use_index: read through a LogIndex of each log (built and saved in the
+        ECHO cache on the first read), so later reads skip the messages which
+        aren't used
     waypoints: range of waypoints to include [1,-1] will get everything between first and last
     return: positiontimes,positions,angletimes,angles
     times are astropy.time.Time vectors
     positions are (3,ntimes) in order lat,lon,alt
     angles are (1,ntimes) with only yaw (todo, add roll,pitch)
     """
+    indexes = [LogIndex(f,kind='apm') if use_index else None for f in apm_files]
     #check the firmware version
-    versions = [apm_version(f) for f in apm_files]
+    versions = [apm_version(f) if index is None else index.version
+                for f,index in zip(apm_files,indexes)]
     if len(set(versions))>1:
         for f,v in zip(apm_files,versions):
             print((f,v))
@@ -74,8 +331,8 @@ def read_apm_logs(apm_files):
     angles = []
     CMD_times = []
     CMD_nums = []
-    for apm_file in apm_files:
-        file_postimes,file_positions,file_angletimes,file_angles,file_cmdtimes,file_cmds = read_apm_log(apm_file)
+    for apm_file,index in zip(apm_files,indexes):
+        file_postimes,file_positions,file_angletimes,file_angles,file_cmdtimes,file_cmds = read_apm_log(apm_file,index=index)
         positions.append(file_positions)
         angles.append(file_angles)
         postimes.append(file_postimes)
@@ -89,144 +346,524 @@ def read_apm_logs(apm_files):
     CMD_times = concat_times(CMD_times)
     CMD_nums = np.concatenate(CMD_nums)
     return postimes,positions,angletimes,angles,CMD_times,CMD_nums
-def read_apm_log_3_3_2(apm_file):
-    apm_timescale = 1000.
-    startTime = -1
-    lats,lons,alts,weektimes,ATT_times,yaws = [],[],[],[],[],[]
-    CMD_times,CMD_nums = [],[]
-    isAuto = False
-    paststartwaypoint = False
-    lines = open(apm_file).readlines()
-    if len(lines) == 0: return None,None,None,None,None,None
-    for line in lines:
-        """
-        http://ardupilot.org/copter/docs/common-downloading-and-analyzing-data-logs-in-mission-planner.html
-        Mode (0=Stabilize, 1=Acro, 2=AltHold, 3=Auto, 4=Guided, 5=Loiter, 6=RTL, 7=Circle, 8=Position, 9=Land, 10=OF_Loiter, 11=Drift, 13=Sport, 14=Flip, 15=AutoTune, 16=PosHold, 17=Brake)
-        """
-        #only collect data in auto mode
-        if line.startswith('MODE'):
-            isAuto = int(line.split(',')[1])==3
-        if not isAuto:
-            #if we go out of auto reset this check
-            # and skip data
-            paststartwaypoint = False
-            continue
-        if line.startswith('CMD') and not paststartwaypoint:
-            cmd = int(line.split(',')[3].strip())
-            #only collect data once we hit the first mapping waypoint
-            # which is when waypoint 3 is commanded
-            paststartwaypoint = cmd>3
-        if not paststartwaypoint:continue
-        #checks are complete, any lines now are fair game
-        if line.startswith('GPS'):
-            if startTime<0:
-                startTime = float(line.split(',')[-1])
-            lats.append(map(float,line.split(',')[6:7]))
-            lons.append(map(float,line.split(',')[7:8]))
-            alts.append(map(float,line.split(',')[8:9]))
-            weektimes.append(map(float,line.split(',')[2:4])) #ms and week number
-        if line.startswith('ATT'):
-            ATT_times.append(map(float,[line.split(',')[1].strip(' ')]))
-            yaws.append(map(float,[line.split(',')[7].strip(' ')]))
-        if line.startswith('CMD'):
-            CMD_times.append(float(line.split(',')[1].strip()))
-            CMD_nums.append(cmd)
-    weektimes = np.array(weektimes)
-    apm_times = weektimes[:,1]*SEC_PER_WEEK+weektimes[:,0]/1000.
-    apm_times = Time(apm_times,format='gps',scale='utc')
-    ATT_times = np.array(ATT_times).squeeze()
-    ATTGPSseconds = ATT_times/apm_timescale - startTime/apm_timescale+apm_times.gps[0]
-    ATT_times = Time(ATTGPSseconds, format = 'gps',scale='utc')
-    CMD_times = np.array(CMD_times)
-    CMDgpsseconds = CMD_times/apm_timescale - startTime/apm_timescale+apm_times.gps[0]
-    CMD_times = Time(CMDgpsseconds, format='gps',scale='utc')
-    lats = np.array(lats).squeeze()
-    lons = np.array(lons).squeeze()
-    alts = np.array(alts).squeeze()
-    yaws = np.array(yaws).squeeze()
-    return apm_times,[lats,lons,alts],ATT_times,[yaws],CMD_times,CMD_nums
-def read_apm_log_3_3_3(apm_file):
-    apm_timescale = 1.e6
-    startTime = -1
-    lats,lons,alts,weektimes,ATT_times,yaws = [],[],[],[],[],[]
-    CMD_times,CMD_nums = [],[]
-    isAuto = False
-    paststartwaypoint = False
-    start = False
-    lines = open(apm_file).readlines()
-    if len(lines) == 0: return None,None,None,None,None,None
-    for i,line in enumerate(lines):
-        """
-        http://ardupilot.org/copter/docs/common-downloading-and-analyzing-data-logs-in-mission-planner.html
-        Mode (0=Stabilize, 1=Acro, 2=AltHold, 3=Auto, 4=Guided, 5=Loiter, 6=RTL, 7=Circle, 8=Position, 9=Land, 10=OF_Loiter, 11=Drift, 13=Sport, 14=Flip, 15=AutoTune, 16=PosHold, 17=Brake)
-        """
-        if line.startswith('STRT'):
-            start = True
-            continue
-        elif not start:
-            continue
-        #only collect data in auto mode
-        if line.startswith('MODE'):
-            isAuto = int(line.split(',')[3])==3
-            continue
-        if not isAuto:
-            #if we go out of auto reset this check
-            # and skip data
-            paststartwaypoint = False
-            continue
-        if line.startswith('CMD') and isAuto:
-            cmd = int(line.split(',')[3].strip())
-            #only collect data once we hit the first mapping waypoint
-            # which is when waypoint 3 is commanded
-            paststartwaypoint = cmd>3
-        if not paststartwaypoint:continue
-        #checks are complete, any lines now are fair game
-        if line.startswith('GPS'):
-            if startTime<0:
-                startTime = float(line.split(',')[-1])
-            lats.append(float(line.split(',')[7].strip()))
-            lons.append(float(line.split(',')[8].strip()))
-            alts.append(float(line.split(',')[9].strip()))
-            weektimes.append(map(float,line.split(',')[3:5])) #ms and week number
-        if line.startswith('ATT'):
-            ATT_times.append(map(float,[line.split(',')[1].strip(' ')]))
-            yaws.append(map(float,[line.split(',')[7].strip(' ')]))
-        if line.startswith('CMD'):
-            CMD_times.append(float(line.split(',')[1].strip()))
-            CMD_nums.append(cmd)
-    weektimes = np.array(weektimes)
-    apm_times = weektimes[:,1]*SEC_PER_WEEK+weektimes[:,0]/1000.
-    apm_times = Time(apm_times,format='gps',scale='utc')
-    ATT_times = np.array(ATT_times).squeeze()
-    ATTGPSseconds = ATT_times/apm_timescale - startTime/apm_timescale+apm_times.gps[0]
-    ATT_times = Time(ATTGPSseconds, format = 'gps',scale='utc')
-    CMD_times = np.array(CMD_times)
-    CMDgpsseconds = CMD_times/apm_timescale - startTime/apm_timescale+apm_times.gps[0]
-    CMD_times = Time(CMDgpsseconds, format='gps',scale='utc')
-    lats = np.array(lats).squeeze()
-    lons = np.array(lons).squeeze()
-    alts = np.array(alts).squeeze()
-    yaws = np.array(yaws).squeeze()
-    return apm_times,[lats,lons,alts],ATT_times,[yaws],CMD_times,CMD_nums
-def read_apm_log(apm_file):
+def read_apm_log_3_3_2(apm_file,index=None):
+    if os.path.getsize(apm_file) == 0: return None,None,None,None,None,None
+    return _apm_log_arrays(read_apm_dataflash(apm_file,version='3.3.2',index=index))
+def read_apm_log_3_3_3(apm_file,index=None):
+    if os.path.getsize(apm_file) == 0: return None,None,None,None,None,None
+    return _apm_log_arrays(read_apm_dataflash(apm_file,version='3.3.3',index=index))
+def read_apm_log(apm_file,index=None):
     "read in an apm log file"
     "return [time,lat,lon,alts],[time,yaws],CMDtimes,CMDnums"
     "time objects are astropy.time.Time objects"
     "only returns data in auto mode "
     " and after waypoint #2 is commanded"
-    version = apm_version(apm_file)
+    "index: optional LogIndex of the log, to read only the messages used"
+    version = apm_version(apm_file) if index is None else index.version
     if StrictVersion(version)<StrictVersion('3.3.3'):
-        return read_apm_log_3_3_2(apm_file)
+        return read_apm_log_3_3_2(apm_file,index=index)
     if StrictVersion(version)>=StrictVersion('3.3.3'):
-        return read_apm_log_3_3_3(apm_file)
+        return read_apm_log_3_3_3(apm_file,index=index)
+
+def _log_kind(filename,nlines=20):
+    """'tlog' if any of the first lines of a log is a ground station tlog message, else 'apm'."""
+    with open(filename,'rb') as f:
+        for i,line in enumerate(f):
+            #e.g. 10/25/2019 10:35:01 AM : 254, 1, 1, 0 0 0 0 mavlink_...
+            fields = line.split(None,12)
+            if len(fields)>11 and fields[3]==b':' and fields[11].startswith(b'mavlink_'):
+                return 'tlog'
+            if i+1>=nlines:
+                break
+    return 'apm'
+#bump when LogIndex changes what it stores, so old sidecars are rebuilt
+LOG_INDEX_VERSION = 1
+class LogIndex(object):
+    """Index of the messages in an apm dataflash or tlog text log.
+
+    The log is scanned once for the byte offset, message type and time of
+    every line, and the index is saved in the ECHO cache (cache_utils), or in
+    a sidecar file if one is given (e.g. the log name plus '.idx.npz'; the
+    cache is used instead if it can't be written). Later LogIndex objects for
+    the same, unchanged log load the saved index, and queries read only the
+    lines they need instead of re-reading the whole file.
+
+    Times are GPS seconds of the last GPS fix at or before the line for apm
+    logs, and the unix time stamped by the ground station for tlogs.
+
+    Args:
+        filename (str): apm dataflash (.log) or tlog text file
+        kind (str, optional): 'apm' or 'tlog', found from the log's first
+            lines if not given
+        sidecar (str, optional): index file to use instead of the cache
+        cache_dir (str, optional): cache directory, defaults to cache_utils.CACHE_DIR
+        rebuild (bool): rescan the log even if a valid index exists
+        timezone (str): timezone of tlog time stamps (see read_tlog_txt)
+    """
+    def __init__(self,filename,kind=None,sidecar=None,cache_dir=None,rebuild=False,timezone='MST'):
+        if kind not in (None,'apm','tlog'):
+            raise ValueError("kind must be 'apm' or 'tlog', not %r" % (kind,))
+        self.filename = filename
+        self.sidecar = sidecar
+        self.cache_dir = cache_dir
+        self.timezone = timezone
+        self._kind = kind
+        self._fingerprint = cache_utils.file_fingerprint(filename)
+        arrays = None if rebuild else self._load()
+        self.built = arrays is None
+        if self.built:
+            arrays = self._build()
+            self._save(arrays)
+        self.kind = str(arrays['kind'])
+        self.version = str(arrays['version'])
+        self.names = [str(name) for name in arrays['names']]
+        self.types = arrays['types']
+        self.offsets = arrays['offsets']
+        self.times = arrays['times']
+
+    def __len__(self):
+        return len(self.types)
+
+    def _cache_key(self):
+        return cache_utils.cache_key([self.filename],'index%d' % LOG_INDEX_VERSION)
+
+    def _load(self):
+        if self.sidecar:
+            try:
+                with np.load(self.sidecar) as npz:
+                    arrays = dict((name,npz[name]) for name in npz.files)
+                if (str(arrays['fingerprint'])==self._fingerprint and
+                        int(arrays['index_version'])==LOG_INDEX_VERSION):
+                    return arrays
+            except Exception:
+                #a missing, stale or unreadable sidecar means a rebuild
+                pass
+        arrays = cache_utils.load(self._cache_key(),self.cache_dir)
+        if arrays is not None and self._kind not in (None,str(arrays['kind'])):
+            return None
+        return arrays
+
+    def _save(self,arrays):
+        arrays = dict(arrays,fingerprint=self._fingerprint,index_version=LOG_INDEX_VERSION)
+        if self.sidecar:
+            try:
+                #write then rename, so readers never see a partial index
+                fd,tmpfile = tempfile.mkstemp(suffix='.tmp',dir=os.path.dirname(os.path.abspath(self.sidecar)))
+                with os.fdopen(fd,'wb') as f:
+                    np.savez_compressed(f,**arrays)
+                os.replace(tmpfile,self.sidecar)
+                return
+            except (IOError,OSError):
+                pass
+        cache_utils.save(self._cache_key(),arrays,self.cache_dir)
+
+    def _build(self):
+        kind = self._kind or _log_kind(self.filename)
+        version = apm_version(self.filename) if kind=='apm' else ''
+        codes = {}
+        types,offsets,times = [],[],[]
+        for offset,block in _line_blocks(self.filename):
+            if kind=='apm':
+                block_types,block_times = self._scan_apm(block,codes,version)
+            else:
+                block_types,block_times = self._scan_tlog(block,codes)
+            ends = np.flatnonzero(np.frombuffer(block,dtype=np.uint8)==ord('\n'))
+            types.append(block_types)
+            times.append(block_times)
+            offsets.append(offset+np.r_[0,ends[:-1]+1])
+            end = offset+len(block)
+        types = np.concatenate(types) if types else np.zeros(0,dtype=np.int16)
+        times = np.concatenate(times) if times else np.zeros(0)
+        offsets = np.concatenate(offsets+[[end]]) if offsets else np.zeros(1,dtype=np.int64)
+        if kind=='apm':
+            #lines take the time of the last GPS fix
+            fixes = np.flatnonzero(np.isfinite(times))
+            last = np.searchsorted(fixes,np.arange(len(times)),side='right')-1
+            times = np.where(last>=0,times[fixes[np.maximum(last,0)]] if len(fixes) else np.nan,np.nan)
+        names = sorted(codes,key=codes.get)
+        return {'kind':kind,'version':version,'names':np.array(names,dtype=str),
+                'types':types.astype(np.int16),'offsets':offsets.astype(np.int64),'times':times}
+
+    @staticmethod
+    def _scan_apm(block,codes,version):
+        """Message type of each line, and the GPS time of GPS lines (nan elsewhere)."""
+        buf = np.frombuffer(block,dtype=np.uint8)
+        ends = np.flatnonzero(buf==ord('\n'))
+        starts = np.r_[0,ends[:-1]+1]
+        #the name is everything before the first comma, at most 4 characters
+        head = buf[np.minimum(starts[:,None]+np.arange(8),len(buf)-1)].copy()
+        stop = (head==ord(','))|(head==ord('\n'))
+        first = np.argmax(stop,axis=1)
+        named = stop.any(axis=1)&(first>0)&(first<=4)&(head[np.arange(len(head)),first]==ord(','))
+        head[np.cumsum(stop,axis=1)>0] = 0
+        keys,inverse = np.unique(head[named].view('<u8').ravel(),return_inverse=True)
+        lookup = np.empty(len(keys),dtype=np.int16)
+        for i,key in enumerate(keys):
+            name = np.array(key,dtype='<u8').tobytes().rstrip(b'\0').decode(errors='replace')
+            lookup[i] = codes.setdefault(name,len(codes))
+        types = np.full(len(starts),-1,dtype=np.int16)
+        types[named] = lookup[inverse.ravel()]
+        times = np.full(len(starts),np.nan)
+        if 'GPS' in codes:
+            gps = np.flatnonzero(types==codes['GPS'])
+            weektimes = _parse_apm_fields(block,starts[gps],ends[gps],_apm_layout(version)['GPS'][:2])
+            times[gps] = weektimes[:,1]*SEC_PER_WEEK+weektimes[:,0]/1000.
+        return types,times
+
+    def _scan_tlog(self,block,codes):
+        """Message type and ground station time of each line."""
+        lines = block.decode(errors='replace').split('\n')[:-1]
+        types = np.full(len(lines),-1,dtype=np.int16)
+        stamps = []
+        stamped = []
+        for i,line in enumerate(lines):
+            tokens = line.split(None,12)
+            if len(tokens)<12 or not tokens[11].startswith('mavlink_'):
+                continue
+            types[i] = codes.setdefault(tokens[11],len(codes))
+            stamps.append(' '.join(tokens[:3]))
+            stamped.append(i)
+        times = np.full(len(lines),np.nan)
+        if stamped:
+            times[stamped] = datetimes_to_unix(stamps,timezone=self.timezone)
+        return types,times
+
+    def rows(self,name,t0=None,t1=None):
+        """Line numbers of the name messages, optionally only those with t0<=time<=t1."""
+        if name not in self.names:
+            return np.zeros(0,dtype=int)
+        match = self.types==self.names.index(name)
+        if t0 is not None:
+            match &= self.times>=t0
+        if t1 is not None:
+            match &= self.times<=t1
+        return np.flatnonzero(match)
+
+    def time_range(self):
+        """First and last line times in the log, or None if there are none."""
+        times = self.times[np.isfinite(self.times)]
+        if len(times)==0:
+            return None
+        return times.min(),times.max()
+
+    def blocks(self,rows,chunk_bytes=2**24):
+        """Read the given lines, in order.
+
+        Runs of lines close together in the file are read with one seek and
+        read, and the lines are yielded in blocks of about chunk_bytes.
+
+        Yields:
+            offset (int): byte offset of the first line in the block
+            block (bytes): the lines, each ending in a newline
+        """
+        rows = np.asarray(rows,dtype=int)
+        if len(rows)==0:
+            return
+        starts = self.offsets[rows]
+        ends = self.offsets[rows+1]
+        #start a new read where the gap to the next line is over 64kB or the block is full
+        breaks = np.flatnonzero((starts[1:]-ends[:-1]>2**16)|
+                                (np.diff(starts//chunk_bytes)!=0))+1
+        with open(self.filename,'rb') as f:
+            for run in np.split(np.arange(len(rows)),breaks):
+                first = starts[run[0]]
+                f.seek(first)
+                data = f.read(ends[run[-1]]-first)
+                if np.array_equal(starts[run[1:]],ends[run[:-1]]):
+                    block = data
+                else:
+                    block = b''.join([data[s-first:e-first] for s,e in zip(starts[run],ends[run])])
+                if not block.endswith(b'\n'):
+                    block += b'\n'
+                yield first,block
+
+    def lines(self,rows):
+        """Text of the given lines, without their newlines."""
+        return [line for offset,block in self.blocks(rows)
+                for line in block.decode(errors='replace').split('\n')[:-1]]
+
+    def columns(self,rows,fields):
+        """Numeric fields of the given lines, as an (n,nfields) float array.
+
+        Fields index the comma separated values of apm lines (0 is the message
+        name) or the whitespace separated tokens of tlog lines.
+        """
+        out = []
+        for offset,block in self.blocks(rows):
+            if self.kind=='apm':
+                ends = np.flatnonzero(np.frombuffer(block,dtype=np.uint8)==ord('\n'))
+                out.append(_parse_apm_fields(block,np.r_[0,ends[:-1]+1],ends,fields))
+            else:
+                tokens = [line.split() for line in block.decode(errors='replace').split('\n')[:-1]]
+                out.append(np.array([[float(t[f]) for f in fields] for t in tokens]).reshape(-1,len(fields)))
+        if len(out)==0:
+            return np.zeros((0,len(fields)))
+        return np.concatenate(out)
+
+
+def _join_lines(block,starts,ends):
+    """The given whole lines of block (ends at their newlines), as one bytes string.
+
+    Kept lines are mostly contiguous, so they are copied a run of adjacent
+    lines at a time; when every line is kept this is a single slice.
+    """
+    breaks = np.flatnonzero(starts[1:]!=ends[:-1]+1)
+    run_starts = starts[np.r_[0,breaks+1]].tolist()
+    run_ends = (ends[np.r_[breaks,len(ends)-1]]+1).tolist()
+    if len(run_starts)==1:
+        return block[run_starts[0]:run_ends[0]]
+    return b''.join([block[s:e] for s,e in zip(run_starts,run_ends)])
+def _spectrum_lines(block,nvalues,first_line=0):
+    """Spectrum lines of block: line starts and ends, and the positions of all commas.
+
+    Lines are kept if they start with a digit and have exactly nvalues values
+    after the time, which drops comments, messages and partly written lines.
+    Lines before first_line are skipped.
+
+    Returns:
+        starts,ends (arrays): kept lines
+        first (array): index in commas of the first comma of each kept line
+        commas (array): positions of every comma in block
+    """
+    buf = np.frombuffer(block,dtype=np.uint8)
+    ends = np.flatnonzero(buf==ord('\n'))
+    starts = np.r_[0,ends[:-1]+1]
+    commas = np.flatnonzero(buf==ord(','))
+    first = np.searchsorted(commas,starts)
+    lead = buf[starts]
+    good = ((np.searchsorted(commas,ends)-first)==nvalues)&(lead>=ord('0'))&(lead<=ord('9'))
+    good[:max(first_line,0)] = False
+    return starts[good],ends[good],first[good],commas
+def _parse_spectrum_block(block,nvalues,chans,dtype,first_line=0):
+    """Times and a channel window of the complete spectrum lines in block.
+
+    The spectrum lines (see _spectrum_lines) are passed to loadtxt as they
+    are, a run of adjacent lines at a time, and only the time and the
+    chans[0]:chans[1] window are converted.
+    """
+    starts,ends,first,commas = _spectrum_lines(block,nvalues,first_line)
+    if len(starts)==0:
+        return np.zeros(0),np.zeros((0,chans[1]-chans[0]),dtype=dtype)
+    text = _join_lines(block,starts,ends)
+    usecols = [0]+list(range(chans[0]+1,chans[1]+1))
+    try:
+        data = np.loadtxt(io.BytesIO(text),delimiter=',',usecols=usecols,ndmin=2)
+    except ValueError:
+        #a non-numeric value somewhere, fall back to converting line by line
+        rows = []
+        for line in text.decode(errors='replace').split('\n')[:-1]:
+            values = line.split(',')
+            try:
+                rows.append([float(values[col]) for col in usecols])
+            except ValueError:
+                continue
+        data = np.array(rows).reshape(-1,len(usecols))
+    return data[:,0],data[:,1:].astype(dtype,copy=False)
+def _spectrum_header(filename):
+    """Frequencies (MHz) from the second line of a spectrum file."""
+    with open(filename,'rb') as f:
+        header = [f.readline() for i in range(2)]
+    return np.array(header[1].decode().rstrip('\n').split(',')[1:],dtype=float)
+def _spectrum_blocks(filename,skip_lines=0,chunk_bytes=2**24,size=None):
+    """Blocks of whole lines of a spectrum file, with the first data line of each."""
+    line = -2-skip_lines
+    for offset,block in _line_blocks(filename,chunk_bytes,size):
+        yield block,-line
+        line += block.count(b'\n')
+def read_spectrum_file(filename,chans=None,dtype=np.float64,skip_lines=0,nvalues=None,
+                       chunk_bytes=2**24):
+    """Read a spectrum text file written by get_sh_spectra (or similar).
+
+    The file is a comment line, a line of frequencies (MHz) after a time stamp,
+    then one 'unix time,value,...' line per spectrum. It is read in chunks of
+    chunk_bytes and parsed with numpy, converting only the requested channel
+    window. Comment and message lines, and lines with missing values (such as
+    the last line of a file still being written), are skipped.
+
+    Args:
+        filename (str): spectrum file
+        chans (tuple, optional): (start,stop) channel window, default all
+        dtype: data type of the waterfall, float64 or float32
+        skip_lines (int): lines to skip after the frequency line
+        nvalues (int, optional): values per spectrum line, by default the
+            number of frequencies
+
+    Returns:
+        times (array): unix times
+        freqs (array): frequencies of the window (MHz)
+        waterfall (array): (len(times),len(freqs)) spectra
+    """
+    freqs = _spectrum_header(filename)
+    if nvalues is None:
+        nvalues = len(freqs)
+    start,stop = (0,nvalues) if chans is None else (max(chans[0],0),min(chans[1],nvalues))
+    times,waterfall = [],[]
+    for block,first_line in _spectrum_blocks(filename,skip_lines,chunk_bytes):
+        block_times,block_data = _parse_spectrum_block(block,nvalues,(start,stop),dtype,first_line=first_line)
+        times.append(block_times)
+        waterfall.append(block_data)
+    if len(times)==0:
+        return np.zeros(0),freqs[start:stop],np.zeros((0,stop-start),dtype=dtype)
+    return np.concatenate(times),freqs[start:stop],np.concatenate(waterfall)
+class Waterfall(object):
+    """Receiver spectra stored as a memory-mapped binary array.
+
+    A waterfall is kept in two files: prefix+'.npy', the (ntimes,nchan)
+    spectra in channel-major (Fortran) order, and the sidecar prefix+'.npz'
+    with the times and frequencies. The spectra are memory mapped, so only
+    the parts that are sliced are read from disk, and a single channel over
+    the whole flight is one contiguous read. Write one with write_waterfall
+    or spectrum_to_waterfall.
+
+    Waterfalls can be indexed like the spectra array, and channel_select and
+    interp_rx accept them (or slices of them) in place of an array.
+
+    Args:
+        prefix (str): path of the waterfall files, without extension
+
+    Attributes:
+        times (array): times of the spectra, in time_format
+        time_format (str): astropy Time format of times, 'unix' or 'gps'
+        freqs (array): channel frequencies (MHz)
+        spectra (memmap): (ntimes,nchan) read only spectra
+    """
+    def __init__(self,prefix):
+        self.prefix = prefix
+        with np.load(prefix+'.npz') as sidecar:
+            self.times = sidecar['times']
+            self.freqs = sidecar['freqs']
+            self.time_format = str(sidecar['time_format'])
+        self.spectra = np.load(prefix+'.npy',mmap_mode='r')[:len(self.times)]
+
+    @property
+    def shape(self):
+        return self.spectra.shape
+
+    @property
+    def dtype(self):
+        return self.spectra.dtype
+
+    @property
+    def ndim(self):
+        return self.spectra.ndim
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self,key):
+        return self.spectra[key]
+
+    def __array__(self,dtype=None,copy=None):
+        if copy:
+            return np.array(self.spectra,dtype=dtype,copy=True)
+        if copy is False and dtype is not None and np.dtype(dtype)!=self.dtype:
+            raise ValueError('converting the waterfall to %s needs a copy' % np.dtype(dtype))
+        return np.asarray(self.spectra,dtype=dtype)
+
+    def time_slice(self,t0=None,t1=None):
+        """Slice of the spectra with t0<=time<=t1 (times are sorted)."""
+        start = 0 if t0 is None else np.searchsorted(self.times,t0,side='left')
+        stop = len(self.times) if t1 is None else np.searchsorted(self.times,t1,side='right')
+        return slice(start,stop)
+
+    def select(self,t0=None,t1=None,chans=None):
+        """Times, frequencies and spectra in a time range and channel window.
+
+        Args:
+            t0,t1 (float, optional): time range, in time_format
+            chans (tuple, optional): (start,stop) channel window
+
+        Returns:
+            times,freqs (arrays): of the selection
+            spectra (memmap): view of the selected spectra, read on access
+        """
+        rows = self.time_slice(t0,t1)
+        cols = slice(None) if chans is None else slice(*chans)
+        return self.times[rows],self.freqs[cols],self.spectra[rows,cols]
+def _write_waterfall_sidecar(prefix,times,freqs,time_format):
+    np.savez(prefix+'.npz',times=np.asarray(times,dtype=float),
+             freqs=np.asarray(freqs,dtype=float),time_format=time_format)
+def write_waterfall(prefix,times,freqs,spectra,time_format='unix',dtype=None,chunk_rows=4096):
+    """Store spectra as a memory-mapped waterfall (see Waterfall).
 
+    Args:
+        prefix (str): path of the waterfall files, without extension
+        times (array or Time): times of the spectra, sorted
+        freqs (array): channel frequencies (MHz)
+        spectra (array): (ntimes,nchan) spectra
+        time_format (str): astropy Time format of float times; Time objects
+            are stored in their own format
+        dtype (optional): data type stored, by default that of spectra
+        chunk_rows (int): spectra copied at a time
+
+    Returns:
+        waterfall (Waterfall): the stored waterfall
+    """
+    if isinstance(times,Time):
+        time_format = times.format
+        times = times.value
+    dtype = np.dtype(dtype or np.asarray(spectra[:0]).dtype)
+    out = np.lib.format.open_memmap(prefix+'.npy',mode='w+',dtype=dtype,
+                                    shape=np.shape(spectra),fortran_order=True)
+    for start in range(0,len(out),chunk_rows):
+        out[start:start+chunk_rows] = spectra[start:start+chunk_rows]
+    out.flush()
+    del out
+    _write_waterfall_sidecar(prefix,times,freqs,time_format)
+    return Waterfall(prefix)
+def spectrum_to_waterfall(spec_files,prefix,chans=None,dtype=np.float32,chunk_bytes=2**24):
+    """Convert spectrum text files (see read_spectrum_file) to a Waterfall.
+
+    The text is streamed twice, once to count the spectra and once to parse
+    them into the memory-mapped file, so the whole waterfall never has to fit
+    in memory. Both passes stop at the size each file had when the first
+    began, so a file which is still being written converts what was there.
 
+    Args:
+        spec_files (list): spectrum files in time order, all with the same
+            frequencies (ValueError otherwise)
+        prefix (str): path of the waterfall files, without extension
+        chans (tuple, optional): (start,stop) channel window to keep
+        dtype: data type stored
+        chunk_bytes (int): bytes of text read at a time
 
-def read_echo_spectrum(infiles):
+    Returns:
+        waterfall (Waterfall): the converted spectra
+    """
+    spec_files = [f for f in spec_files if os.path.getsize(f)>0]
+    if len(spec_files)==0:
+        raise ValueError('no spectra to convert')
+    freqs = _spectrum_header(spec_files[0])
+    for spec_file in spec_files[1:]:
+        if not np.array_equal(_spectrum_header(spec_file),freqs):
+            raise ValueError('%s has different frequencies from %s' % (spec_file,spec_files[0]))
+    nvalues = len(freqs)
+    start,stop = (0,nvalues) if chans is None else (max(chans[0],0),min(chans[1],nvalues))
+    sizes = [os.path.getsize(spec_file) for spec_file in spec_files]
+    nrows = sum(len(_spectrum_lines(block,nvalues,first_line)[0])
+                for spec_file,size in zip(spec_files,sizes)
+                for block,first_line in _spectrum_blocks(spec_file,chunk_bytes=chunk_bytes,size=size))
+    out = np.lib.format.open_memmap(prefix+'.npy',mode='w+',dtype=np.dtype(dtype),
+                                    shape=(nrows,stop-start),fortran_order=True)
+    times = []
+    row = 0
+    for spec_file,size in zip(spec_files,sizes):
+        for block,first_line in _spectrum_blocks(spec_file,chunk_bytes=chunk_bytes,size=size):
+            block_times,block_data = _parse_spectrum_block(block,nvalues,(start,stop),dtype,first_line=first_line)
+            out[row:row+len(block_times)] = block_data
+            times.append(block_times)
+            row += len(block_times)
+    out.flush()
+    del out
+    _write_waterfall_sidecar(prefix,np.concatenate(times),freqs[start:stop],'unix')
+    return Waterfall(prefix)
+def read_echo_spectrum(infiles,chans=None,dtype=np.float64):
     """
     input:
     filenames: list of string paths pointing to files generated by get_sh_spectra
     (or similar)
+    chans: optional (start,stop) channel window to read (see read_spectrum_file)
+    dtype: data type of the waterfall, float64 or float32
 
     return: times,frequencies,spectrumwaterfall
     times: astropy.time.Time object
@@ -235,20 +872,15 @@ def read_echo_spectrum(infiles):
     """
     spec_times = []
     spec_raw = []
+    freqs = []
     for i,spec_file in enumerate(infiles):
         #print 'Reading in %s...' %spec_file
-        lines = open(spec_file).readlines()
-        freqs = np.array(map(float,lines[1].rstrip('\n').split(',')[1:]))
-        if len(lines) == 0:continue
-        for line in lines[2:]:
-            if line.startswith('#'):
-                continue
-            line = line.strip().split(',')
-            if len(line)!=(len(freqs)+1):continue #skip lines with missing data
-            spec_times.append(float(line[0]))
-            spec_raw.append(map(float,line[1:]))
-    spec_times = Time(spec_times,format='unix')
-    spec_raw = np.array(spec_raw)
+        if os.path.getsize(spec_file) == 0:continue
+        file_times,freqs,file_raw = read_spectrum_file(spec_file,chans=chans,dtype=dtype)
+        spec_times.append(file_times)
+        spec_raw.append(file_raw)
+    spec_times = Time(np.concatenate(spec_times) if spec_times else [],format='unix')
+    spec_raw = np.concatenate(spec_raw) if spec_raw else np.zeros((0,len(freqs)),dtype=dtype)
     freqs = np.array(freqs).squeeze()
     return spec_times,freqs,spec_raw,
 #from orbcomm_compile.py S-NS[7:12], N-NS[13:18], S-EW[14:19], N-EW[20:25]'
@@ -256,45 +888,106 @@ getsatfourchanNG_channels = {'S_NS':np.arange(0,6),
                              'N_NS':np.arange(6,12),
                              'S_EW':np.arange(12,18),
                              'N_EW':np.arange(18,24)}
-def read_orbcomm_spectrum(infiles,ant,pol):
+#frequencies (MHz) are hard-coded based on Abrahams notes, .002 is a WAG on
+#the orbcomm spectral res
+getsatfourchanNG_freqs = np.arange(-3,4)*.002 + 137.500
+def _orbcomm_lines(block):
+    """Lines of block holding 25 single space separated values, as read_orbcomm_spectrum checks."""
+    buf = np.frombuffer(block,dtype=np.uint8)
+    ends = np.flatnonzero(buf==ord('\n'))
+    starts = np.r_[0,ends[:-1]+1]
+    spaces = np.flatnonzero(buf==ord(' '))
+    good = (np.searchsorted(spaces,ends)-np.searchsorted(spaces,starts))==24
+    #lines with leading or trailing spaces are checked one by one
+    padded = np.flatnonzero((ends>starts)&((buf[starts]==ord(' '))|(buf[np.maximum(ends-1,0)]==ord(' '))))
+    for i in padded.tolist():
+        good[i] = len(block[starts[i]:ends[i]].decode(errors='replace').strip(' \n').split(' '))==25
+    return starts[good],ends[good]
+def read_orbcomm_satpower(infiles,chans=None,use_cache=False,cache_dir=None):
+    """Read getsatfourchanNG satpower files: a gps time and 24 channel powers per line.
+
+    The files are parsed in bulk, lines found and checked with numpy and the
+    values converted by loadtxt. With use_cache the 24 channels are parsed
+    once and stored in the ECHO cache (cache_utils), keyed by the files, so
+    reading other channel blocks of the same files only loads the cache.
+    Without it (the default) nothing is written and only the chans columns
+    are converted.
+
+    Args:
+        infiles (list): satpower files
+        chans (array, optional): channel columns (0-23) to return, default all
+        use_cache (bool): read and store the parsed files in the cache
+        cache_dir (str, optional): cache directory, defaults to cache_utils.CACHE_DIR
+
+    Returns:
+        times (array): gps seconds
+        power (array): (len(times),len(chans)) linear power
+    """
+    chans = np.arange(24) if chans is None else np.asarray(chans)
+    if use_cache:
+        key = cache_utils.cache_key(infiles,tag='orbcomm')
+        cached = cache_utils.load(key,cache_dir)
+        if cached is None:
+            times,power = read_orbcomm_satpower(infiles,use_cache=False)
+            cache_utils.save(key,{'times':times,'power':power},cache_dir)
+        else:
+            times,power = cached['times'],cached['power']
+        return times,power[:,chans]
+    usecols = [0]+list(chans+1)
+    data = []
+    for ORB_file in infiles:
+        for offset,block in _line_blocks(ORB_file):
+            starts,ends = _orbcomm_lines(block)
+            if len(starts)==0:
+                continue
+            data.append(np.loadtxt(io.BytesIO(_join_lines(block,starts,ends)),usecols=usecols,ndmin=2))
+    data = np.concatenate(data) if data else np.zeros((0,len(usecols)))
+    return data[:,0],data[:,1:]
+def read_orbcomm_spectrum(infiles,ant,pol,use_cache=False,cache_dir=None):
     """
     input: filenames,ant,pol
     filenames: list of string paths pointing to files generated by Neben, getsatfourchanNG
     ant: 'N' or 'S'
     pol: 'EW' or 'NS'
+    use_cache,cache_dir: opt in to keeping the parsed files in the ECHO cache
+        so other ant/pol reads of the same files skip parsing (see
+        read_orbcomm_satpower)
 
     return: times,frequencies,spectrumwaterfall
     times: astropy.time.Time object
     frequencies: in MHz
     spectrumwaterfall: shape=(len(times),len(frequencies))
     """
-    #frequencies are hard-coded based on Abrahams notes
-    df = .002 #WAG on the orbcomm spectral res
-    freqs = np.arange(-3,4)*df + 137.500
-    orbTimes = []
-    orbData = []
-    for ORB_file in infiles:
-        lines = open(ORB_file).readlines()
-        for line in lines:
-            string = line.strip(' \n')
-            if len(string.split(' ')) == 25:
-                orbTimes.append(float(string.split()[0]))
-                orbData.append(map(float,string.strip(' \n').split()[1:]))
-
-    orbData = np.array(orbData)
-    orbTimes = Time(orbTimes,format='gps')
-    assert(orbData.shape[1]==24)
     chans = getsatfourchanNG_channels[ant+'_'+pol]
-    return orbTimes,freqs,dB2(orbData[:,chans])
+    orbTimes,orbData = read_orbcomm_satpower(infiles,chans=chans,use_cache=use_cache,cache_dir=cache_dir)
+    orbTimes = Time(orbTimes,format='gps')
+    return orbTimes,getsatfourchanNG_freqs.copy(),dB2(orbData)
+def read_orbcomm_spectra(infiles,use_cache=False,cache_dir=None):
+    """Every antenna/polarization block of satpower files, from one read.
+
+    Args:
+        infiles (list): satpower files
+        use_cache,cache_dir: see read_orbcomm_satpower
+
+    Returns:
+        times (Time): spectrum times
+        freqs (array): frequencies in MHz (as read_orbcomm_spectrum)
+        spectra (dict): dB spectra keyed by 'ant_pol', e.g. 'N_EW'
+    """
+    orbTimes,orbData = read_orbcomm_satpower(infiles,use_cache=use_cache,cache_dir=cache_dir)
+    spectra = dict((name,dB2(orbData[:,chans])) for name,chans in getsatfourchanNG_channels.items())
+    return Time(orbTimes,format='gps'),getsatfourchanNG_freqs.copy(),spectra
 def channel_select(freqs,rxspectrum,channel):
     """
     input:
         freqs: measured frequences in MHz
-        rxspectrum: power in volt^2 shape(len(times),len(freqs))
+        rxspectrum: power in volt^2 shape(len(times),len(freqs)), or a
+            Waterfall
         channel: give a channel as an int or a float frequency in MHz
 
     return:
-        a single vector ntimes long
+        a single vector ntimes long (a view, not a copy, for memory-mapped
+        spectra)
 
     """
     if type(channel)==int:
@@ -317,6 +1010,12 @@ def interp_rx(postimes,rxtimes,rx):
         rxtime: astropy.time.Time vector (input points)
         Assumes that both position and spectrum data have been properly flagged
         and that the flags match between the two
+        Both may instead be float arrays of seconds on the same time scale
+        (e.g. both unix), which skips the astropy conversion entirely.
+        rx may have extra dimensions after time (e.g. (ntimes,npol,nchan)),
+        which are all interpolated at once. rx may be memory mapped (e.g. a
+        Waterfall or a channel of one): for sorted rxtimes only the spectra
+        spanning postimes are read.
 
     return:
         interpolation of the rx power to the gps times
@@ -324,8 +1023,21 @@ def interp_rx(postimes,rxtimes,rx):
        and can be used for anything
 
     """
-    power_interp_model = interp1d(rxtimes.gps,rx, bounds_error=False)
-    rx_interp = power_interp_model(postimes.gps)
+    postimes = getattr(postimes,'gps',postimes)
+    rxtimes = np.asarray(getattr(rxtimes,'gps',rxtimes))
+    if isinstance(rx,Waterfall):
+        rx = rx.spectra
+    outtimes = np.asarray(postimes,dtype=float)
+    outtimes = outtimes[np.isfinite(outtimes)]
+    if len(outtimes) and len(rxtimes)>2 and np.all(rxtimes[1:]>=rxtimes[:-1]):
+        #only the rx samples bracketing the output times are needed
+        tmin,tmax = outtimes.min(),outtimes.max()
+        start = max(np.searchsorted(rxtimes,tmin,side='right')-1,0)
+        stop = min(np.searchsorted(rxtimes,tmax,side='left')+1,len(rxtimes))
+        if stop-start>=2:
+            rxtimes,rx = rxtimes[start:stop],rx[start:stop]
+    power_interp_model = interp1d(rxtimes,rx, axis=0, bounds_error=False)
+    rx_interp = power_interp_model(postimes)
     return rx_interp
 def flag_apm_pos(postimes,positions,waypoint_times=None):
     """
@@ -358,15 +1070,26 @@ def flag_angles(angletimes,angles,sigma=2):
     badyaw_indices = np.where(yawmask)[0]
     return yawmask,angletimes[badyaw_indices]
 def apply_flagtimes(datatimes,flagtimes,dt):
-    #generate a mask for postimes (astropy.time.Time)
-    #given a list of times which are bad (astropy.time.Time)
-    #flag anything within dt seconds (float seconds)
+    """Flag data times within dt of any of a list of bad times.
+
+    The windows (t-dt,t+dt) are merged into a sorted disjoint set and every
+    data time is checked against it with one binary search, see
+    time_utils.interval_mask.
+
+    Args:
+        datatimes (astropy.time.Time): times of the data to flag
+        flagtimes (astropy.time.Time): times which are bad
+        dt (float or array): flag anything within dt seconds, either one value
+            or a padding for each flag time
+
+    Returns:
+        mask (array): 1 where flagged, 0 otherwise, len(datatimes)
+    """
+    flag_gps = np.atleast_1d(flagtimes.gps)
+    dt = np.asarray(dt,dtype=float)
+    inside = interval_mask(datatimes.gps,flag_gps-dt,flag_gps+dt)
     mask = np.zeros(len(datatimes))
-    for t in flagtimes.gps:
-        bad_ind = np.where(np.logical_and(
-                        datatimes.gps>(t-dt),
-                        datatimes.gps<(t+dt)))
-        mask[bad_ind] = 1
+    mask[inside] = 1
     return mask
 def flag_waypoints(postimes,waypoint_times):
     """
@@ -379,34 +1102,61 @@ def flag_waypoints(postimes,waypoint_times):
     """
     return np.zeros(len(postimes))
 
-def mission_endpoint_flagging(pos_data,wpt_data):
+def mission_endpoint_flagging(pos_data,wpt_data,segments=False):
     """Read in position and waypoint array, flag all waypoints
 
+    The mission runs from the time waypoint 1 is reached to the time the
+    last waypoint is reached (inclusive). The mission start and end are
+    located with a binary search on the time column, so for time sorted
+    positions mission_data is a view of pos_data rather than a copy. With no
+    waypoints reached there is no mission, and every position is flagged.
+
     Args:
-        ulog (int): the ulog to be converted.
+        pos_data (array): positions, time in the first column.
+        wpt_data (array): (time, waypoint number) of each waypoint reached.
+        segments (bool): also split the mission into legs between
+            consecutive waypoints, in the same pass.
 
     Returns:
         flagged_array: array of flagged data.
         mission_data: array of valid mission data.
+        legs (list): only if segments, (waypoint number, positions) for each
+            leg, the positions being those from reaching the previous waypoint
+            up to reaching this one. The last leg includes the mission end.
 
     """
-    flagged_indices = []
-    mission_indices = []
+    if len(wpt_data)==0:
+        if segments:
+            return pos_data.copy(), pos_data[:0], []
+        return pos_data.copy(), pos_data[:0]
     mission_start = 0
     mission_end = wpt_data[-1][0]
-
-    for row in wpt_data:
-        if row[1] == 1:
-            mission_start = row[0]
-            break
-
-    for index,row in enumerate(pos_data):
-        if row[0]<mission_start or row[0]>mission_end: flagged_indices.append(index)
-        else: mission_indices.append(index)
-
-    flagged_data = np.delete(pos_data,mission_indices,0)
-    mission_data = np.delete(pos_data,flagged_indices,0)
-    return flagged_data, mission_data
+    started = np.flatnonzero(wpt_data[:,1]==1)
+    if len(started):
+        mission_start = wpt_data[started[0],0]
+    times = pos_data[:,0]
+
+    if np.all(times[1:]>=times[:-1]):
+        i0 = np.searchsorted(times,mission_start,side='left')
+        i1 = np.searchsorted(times,mission_end,side='right')
+        flagged_data = np.concatenate((pos_data[:i0],pos_data[i1:]))
+        mission_data = pos_data[i0:i1]
+        leg_data = mission_data
+    else:
+        #unsorted positions, select by mask instead
+        in_mission = (times>=mission_start)&(times<=mission_end)
+        flagged_data, mission_data = pos_data[~in_mission], pos_data[in_mission]
+        leg_data = mission_data[np.argsort(mission_data[:,0],kind='stable')]
+    if not segments:
+        return flagged_data, mission_data
+
+    #legs are split where each waypoint after the first is reached
+    wpt_in = (wpt_data[:,0]>mission_start)&(wpt_data[:,0]<mission_end)
+    edges = np.r_[0,np.searchsorted(leg_data[:,0],wpt_data[wpt_in,0],side='left'),len(leg_data)]
+    leg_wpts = np.r_[wpt_data[wpt_in,1],wpt_data[-1][1]]
+    legs = [(int(wpt),leg_data[start:stop])
+            for wpt,start,stop in zip(leg_wpts,edges[:-1],edges[1:])]
+    return flagged_data, mission_data, legs
 
 
 def get_data(infile,filetype=None,freqs=[],freq=0.0,freq_chan=None,
@@ -467,23 +1217,23 @@ def get_data(infile,filetype=None,freqs=[],freq=0.0,freq_chan=None,
         spec_files = glob.glob(infile)
         for spec_file in spec_files:
             #print 'Reading in %s...' %spec_file
-            lines = open(spec_file).readlines()
-            if not len(lines) == 0:
+            if not os.path.getsize(spec_file) == 0:
                 if len(freqs) == 0:
-                    freqs = np.array(map(float,lines[1].rstrip('\n').split(',')[1:]))
+                    with open(spec_file) as f:
+                        f.readline()
+                        freqs = np.array(f.readline().rstrip('\n').split(',')[1:],dtype=float)
                     # Get index of freq for gridding
                     freq_chan = np.where(np.abs(freqs-freq).min()==np.abs(freqs-freq))[0]
                     # Filter freqs around freq_chan
-                    freqs = freqs[freq_chan-width:freq_chan+width]
-                for line in lines[2+start_lines:]:
-                    if line.startswith('#'):
-                        continue
-                    line = line.rstrip('\n').split(',')
-                    if len(line) == (nfft+1): # Make sure line has finished printing
-                        spec_times.append(float(line[0]))
-                        spec_raw.append(map(float,line[freq_chan-width+1:freq_chan+width+1]))
-        spec_times = Time(spec_times,format='unix')
-        spec_raw = np.array(spec_raw)
+                    freqs = freqs[int(freq_chan[0])-width:int(freq_chan[0])+width]
+                # Read only the channels around freq_chan
+                chan = int(np.ravel(freq_chan)[0])
+                file_times,file_freqs,file_raw = read_spectrum_file(spec_file,chans=(chan-width,chan+width),
+                                                                    skip_lines=start_lines,nvalues=nfft)
+                spec_times.append(file_times)
+                spec_raw.append(file_raw)
+        spec_times = Time(np.concatenate(spec_times) if spec_times else [],format='unix')
+        spec_raw = np.concatenate(spec_raw) if spec_raw else np.zeros((0,len(freqs)))
         freqs = np.array(freqs).squeeze()
         return spec_times,spec_raw,freqs,freq_chan
 
@@ -576,42 +1326,69 @@ def get_data(infile,filetype=None,freqs=[],freq=0.0,freq_chan=None,
         sys.exit()
 
 
-def get_start_stop_times(infile):
+#GPS ms and week fields read by get_start_stop_times and get_way. These are
+#where 3.3.3 and later logs keep them, and are used for every log version
+GPS_WEEKTIME_FIELDS = (3,4)
+def _apm_message_fields(apm_file,fields,start_line=0,use_index=False):
+    """Numeric fields of some apm message types, from line start_line on.
+
+    Args:
+        apm_file (str): apm dataflash text log
+        fields (dict): message name: fields to read (see LogIndex.columns)
+        start_line (int): first line of the log to use
+        use_index (bool): read only the needed lines through the saved
+            LogIndex of the log, building and caching it if needed. By
+            default the log is scanned once and nothing is saved.
+
+    Returns:
+        columns (dict): message name: (n,nfields) float array
+    """
+    if use_index:
+        index = LogIndex(apm_file,kind='apm')
+        columns = {}
+        for name,cols in fields.items():
+            rows = index.rows(name)
+            columns[name] = index.columns(rows[rows>=start_line],cols)
+        return columns
+    out = dict((name,[np.zeros((0,len(cols)))]) for name,cols in fields.items())
+    line = 0
+    for offset,block in _line_blocks(apm_file):
+        buf = np.frombuffer(block,dtype=np.uint8)
+        ends = np.flatnonzero(buf==ord('\n'))
+        starts = np.r_[0,ends[:-1]+1]
+        lines = _message_lines(buf,starts,tuple(fields))
+        for name,cols in fields.items():
+            rows = lines[name][lines[name]+line>=start_line]
+            out[name].append(_parse_apm_fields(block,starts[rows],ends[rows],cols))
+        line += len(starts)
+    return dict((name,np.concatenate(arrays)) for name,arrays in out.items())
+
+
+def get_start_stop_times(infile,use_index=False):
     # infile can be filename or glob
+    # use_index: read only the GPS lines through the LogIndex of each log
 
     start_stop_times = []
     apm_files = glob.glob(infile)
     for apm_file in apm_files:
-        lines=open(apm_file).readlines()
-        weektimes = []
-        for line in lines:
-            if line.startswith('GPS'):
-                weektimes.append(map(float,line.split(',')[3:5]))
-        weektimes = np.array(weektimes)
+        weektimes = _apm_message_fields(apm_file,{'GPS':GPS_WEEKTIME_FIELDS},use_index=use_index)['GPS']
         seconds = weektimes[:,1]*SEC_PER_WEEK + weektimes[:,0]/1000.
-        times = Time(seconds, format='gps')
-        mintime = times.gps.min()
-        maxtime = times.gps.max()
-        start_stop_times.append([mintime,maxtime])
+        start_stop_times.append([seconds.min(),seconds.max()])
     return start_stop_times
 
 
-def get_way(infile):
-    lines=open(infile).readlines()
-    GPS_weektimes,GPS_arm,CMD_time,CMD_num =[],[],[],[]
-    for line in lines[630:]:
-        if line.startswith('GPS'):
-            GPS_weektimes.append(map(float,line.split(',')[3:5]))
-            GPS_arm.append(float(line.split(',')[1]))
-        if line.startswith('CMD'):
-            CMD_time.append(float(line.split(',')[1].strip()))
-            CMD_num.append(int(line.split(',')[3].strip()))
-    GPS_weektimes = np.array(GPS_weektimes)
-    GPS_seconds = GPS_weektimes[:,1]*SEC_PER_WEEK + GPS_weektimes[:,0]/1000.
-    GPS_arm= Time((np.array(GPS_arm[0])*APMLOG_SEC_PER_TICK), format = 'gps')
+def get_way(infile,start_line=630,use_index=False):
+    # GPS and CMD messages from start_line on, which skips the mission the
+    # log header lists as CMD messages
+    # use_index: read only those lines through the LogIndex of the log
+    columns = _apm_message_fields(infile,{'GPS':(1,)+GPS_WEEKTIME_FIELDS,'CMD':(1,3)},
+                                  start_line=start_line,use_index=use_index)
+    GPS,CMD = columns['GPS'],columns['CMD']
+    GPS_seconds = GPS[:,2]*SEC_PER_WEEK + GPS[:,1]/1000.
+    GPS_arm= Time((np.array(GPS[0,0])*APMLOG_SEC_PER_TICK), format = 'gps')
     GPS_time = Time(GPS_seconds, format='gps')
-    CMD_time = (np.array(CMD_time).astype(float))*APMLOG_SEC_PER_TICK
-    return GPS_time, GPS_arm, np.array(CMD_num), CMD_time
+    CMD_time = CMD[:,0]*APMLOG_SEC_PER_TICK
+    return GPS_time, GPS_arm, CMD[:,1].astype(int), CMD_time
 
 
 def get_filter_times(infile,first_waypt=3,waypts=False):
@@ -643,11 +1420,89 @@ def get_filter_times(infile,first_waypt=3,waypts=False):
     else:
         return start_stop_times
 
-def read_tlog_txt(tlog):
+#mavlink messages kept from text dumps of tlogs. Each line is a timestamp
+#followed by the message name as the 12th token, then alternating field names
+#and values. For every message: the token that must not hold a field name
+#(those lines are not data), the tokens holding the values we keep, and the
+#divisors that put those values in degrees, meters and seconds.
+TLOG_MESSAGES = {
+    'mavlink_mission_item_reached_t':(None,None,(13,),(1.,)),
+    'mavlink_global_position_int_t':(15,'time_boot_ms',(13,15,17,19,29),(1e3,1e7,1e7,1e3,1e2)),
+    'mavlink_local_position_ned_t':(15,'time_boot_ms',(13,15,17,19),(1e3,1.,1.,1.)),
+    'mavlink_gps_raw_int_t':(15,'time_usec',(13,15,17,19),(1e6,1e7,1e7,1e3)),
+}
+class _ColumnBuffer(object):
+    """Preallocated float columns which double in capacity as rows are appended."""
+    def __init__(self,ncols,capacity=4096):
+        self.data = np.empty((capacity,ncols))
+        self.nrows = 0
+    def _reserve(self,end):
+        if end>self.data.shape[0]:
+            grown = np.empty((max(end,2*self.data.shape[0]),self.data.shape[1]))
+            grown[:self.nrows] = self.data[:self.nrows]
+            self.data = grown
+    def append(self,rows):
+        end = self.nrows+len(rows)
+        self._reserve(end)
+        self.data[self.nrows:end] = rows
+        self.nrows = end
+    def new_row(self):
+        """Add a row at the end, to be filled in place, and return its index."""
+        self._reserve(self.nrows+1)
+        self.nrows += 1
+        return self.nrows-1
+    def array(self):
+        return self.data[:self.nrows].copy()
+def _parse_tlog_lines(lines,columns,timezone='MST'):
+    """Sort one chunk of tlog text lines into the columns of each message type.
+
+    Each line is split once and its values written straight into a new row of
+    columns[msg], a _ColumnBuffer of unix time then the message values. The
+    time stamps of the whole chunk are converted in one call at the end.
+    """
+    messages = list(TLOG_MESSAGES)
+    first = [columns[msg].nrows for msg in messages]
+    stamps = []
+    kinds = []
+    rows = []
+    for line in lines:
+        tokens = line.split()
+        if len(tokens)<13 or tokens[11] not in TLOG_MESSAGES:
+            continue
+        msg = tokens[11]
+        check,fieldname,cols,divisors = TLOG_MESSAGES[msg]
+        if check is not None and tokens[check]==fieldname:
+            continue
+        buf = columns[msg]
+        row = buf.new_row()
+        #numpy parses the value strings as they are assigned
+        buf.data[row,1:] = [tokens[col] for col in cols]
+        stamps.append(tokens[0]+' '+tokens[1]+' '+tokens[2])
+        kinds.append(messages.index(msg))
+        rows.append(row)
+    if len(stamps)==0:
+        return
+    unix_times = datetimes_to_unix(stamps,timezone=timezone)
+    kinds = np.array(kinds)
+    rows = np.array(rows)
+    for i,msg in enumerate(messages):
+        buf = columns[msg]
+        buf.data[rows[kinds==i],0] = unix_times[kinds==i]
+        buf.data[first[i]:buf.nrows,1:] /= TLOG_MESSAGES[msg][3]
+def read_tlog_txt(tlog,chunk_lines=None,timezone='MST'):
     """Read in text files converted from tlogs, put them into appropriate arrays.
 
+    The file is read in a single pass, one chunk of lines at a time. Each line
+    is classified by message type and its values written into a growing numpy
+    array for that message; the time stamps are converted once per chunk.
+
     Args:
-        tlog (int): the text tlog to be read.
+        tlog (str): the text tlog to be read.
+        chunk_lines (int, optional): number of lines to parse at once. By
+            default the whole file is parsed as one chunk; set this to bound
+            memory use on very large files.
+        timezone (str, optional): timezone of the ground station clock which
+            wrote the timestamps (see time_utils.datetimes_to_unix).
 
     Returns:
         wpt_array: waypoints.
@@ -655,47 +1510,125 @@ def read_tlog_txt(tlog):
         local_array: local position.
         gps_array: gps raw data.
     """
-    wpt_data = []
-    global_data = []
-    local_data = []
-    gps_data = []
-    #att_data = []
-
-    lines = open(tlog).readlines()
-    for line in lines:
-
-        if line.find('mavlink_mission_item_reached_t') != -1:
-            datapoints = line.split()
-            if datapoints[11]=='mavlink_mission_item_reached_t': wpt_data.append([datapoints[0]+' '+datapoints[1]+' '+datapoints[2],datapoints[13]])
-        elif line.find('mavlink_global_position_int_t') != -1:
-            datapoints = line.split()
-            if datapoints[15]!='time_boot_ms': global_data.append([datapoints[0]+' '+datapoints[1]+' '+datapoints[2],float(datapoints[13])/1e3,float(datapoints[15])/1e7,float(datapoints[17])/1e7,(float(datapoints[19])/1e3)-1477.8,float(datapoints[29])/1e2])
-        elif line.find('mavlink_local_position_ned_t') != -1:
-            datapoints = line.split()
-            if datapoints[15]!='time_boot_ms': local_data.append([datapoints[0]+' '+datapoints[1]+' '+datapoints[2],float(datapoints[13])/1e3,datapoints[15],datapoints[17],float(datapoints[19])*-1])
-        elif line.find('mavlink_gps_raw_int_t') !=- 1:
-            datapoints = line.split()
-            if datapoints[15]!='time_usec': gps_data.append([datapoints[0]+' '+datapoints[1]+' '+datapoints[2],float(datapoints[13])/1e6,float(datapoints[15])/1e7,float(datapoints[17])/1e7,float(datapoints[19])/1e3])
-        #elif line.find('mavlink_attitude_t') != -1:
-            #datapoints = line.split()
-            #if datapoints[15]!='body_roll_rate' and datapoints[15]!='time_boot_ms': att_data.append([datapoints[1],datapoints[13],datapoints[15],datapoints[17],datapoints[19]])
-
-    wpt_data = DatetimetoUnix(wpt_data)
-    global_data = DatetimetoUnix(global_data)
-    local_data = DatetimetoUnix(local_data)
-    gps_data = DatetimetoUnix(gps_data)
-    #DatetimetoUnix(att_data)
-
-    wpt_array = np.array(wpt_data,dtype='int')
-    global_array = np.array(global_data,dtype='float')
-    local_array = np.array(local_data,dtype='float')
-    gps_array = np.array(gps_data,dtype='float')
-    #att_array = np.array(att_data)
-    return wpt_array, global_array, local_array, gps_array#, att_array
+    columns = dict((msg,_ColumnBuffer(1+len(TLOG_MESSAGES[msg][2]))) for msg in TLOG_MESSAGES)
+    with open(tlog) as f:
+        while True:
+            lines = list(islice(f,chunk_lines))
+            if len(lines)==0:
+                break
+            _parse_tlog_lines(lines,columns,timezone=timezone)
+            if chunk_lines is None:
+                break
+
+    wpt_array = columns['mavlink_mission_item_reached_t'].array().astype('int')
+    global_array = columns['mavlink_global_position_int_t'].array()
+    global_array[:,4] -= 1477.8
+    local_array = columns['mavlink_local_position_ned_t'].array()
+    local_array[:,4] *= -1
+    gps_array = columns['mavlink_gps_raw_int_t'].array()
+    return wpt_array, global_array, local_array, gps_array
+
+class GPSTail(object):
+    """Follow a GPS text file as it is written, parsing only the new lines.
+
+    The file holds 'gps time,lat,lon,alt' lines (see get_data(filetype='gps')),
+    with '#' comment lines. The byte offset of the last complete line read is
+    kept, so each update() reads and parses only what was appended since. A
+    line still being written (no trailing newline yet) is left for the next
+    update. Rows are kept sorted by time. If the file shrinks (truncated or
+    replaced) the rows are dropped, it is read again from the start and
+    restarts is incremented.
 
+    Args:
+        filename (str): the GPS file to follow
+    """
+    def __init__(self,filename):
+        self.filename = filename
+        self.offset = 0
+        self.restarts = 0
+        self._buf = _ColumnBuffer(4)
+
+    @property
+    def data(self):
+        """(n,4) view of the rows read so far: gps time, lat, lon, alt."""
+        return self._buf.data[:self._buf.nrows]
+
+    def update(self):
+        """Parse the complete lines appended since the last update.
+
+        Returns:
+            rows (array): (n,4) rows added, empty if nothing new was written
+        """
+        rows = np.empty((0,4))
+        try:
+            with open(self.filename,'rb') as f:
+                f.seek(0,2)
+                if f.tell()<self.offset:
+                    #the file was truncated or replaced, start over
+                    self.offset = 0
+                    self._buf.nrows = 0
+                    self.restarts += 1
+                f.seek(self.offset)
+                chunk = f.read()
+        except IOError:
+            return rows
+        end = chunk.rfind(b'\n')+1
+        if end==0:
+            return rows
+        self.offset += end
+        parsed = []
+        for line in chunk[:end].decode(errors='replace').splitlines():
+            if line.startswith('#'):
+                continue
+            fields = line.split(',')
+            if len(fields)!=4:
+                continue
+            try:
+                parsed.append([float(field) for field in fields])
+            except ValueError:
+                continue
+        if len(parsed)==0:
+            return rows
+        rows = np.array(parsed)
+        nold = self._buf.nrows
+        self._buf.append(rows)
+        times = self.data[max(nold-1,0):,0]
+        if np.any(times[1:]<times[:-1]):
+            self._buf.data[:self._buf.nrows] = self.data[np.argsort(self.data[:,0],kind='stable')]
+        return rows
+
+#ulog fields kept for each message, in output column order. Selecting by name
+#keeps us independent of the order the firmware packs the fields in.
+ULOG_FIELDS = {
+    'vehicle_global_position':['timestamp','lat','lon','alt','yaw'],
+    'vehicle_local_position':['timestamp','ref_timestamp','ref_lat','ref_lon','x','y','z','yaw','ref_alt'],
+    'vehicle_gps_position':['timestamp','time_utc_usec','lat','lon','alt'],
+}
+def _check_fields(available,fields,source):
+    missing = [field for field in fields if field not in available]
+    if missing:
+        raise ValueError('%s has no field(s) %s' % (source,', '.join(missing)))
+def _stack_fields(columns,fields):
+    """Copy the named columns of a ulog message into a single float array."""
+    _check_fields(columns,fields,'ulog message')
+    data = np.empty((len(columns[fields[0]]),len(fields)))
+    for i,field in enumerate(fields):
+        data[:,i] = columns[field]
+    return data
+def _read_ulog_csv(csvfile,fields):
+    """Read the named columns of a csv written by pyulog's ulog2csv."""
+    with open(csvfile) as f:
+        header = f.readline().strip().split(',')
+    _check_fields(header,fields,csvfile)
+    usecols = [header.index(field) for field in fields]
+    return np.genfromtxt(csvfile, delimiter=',',skip_header=1,usecols=usecols)
 def read_ulog(ulog, output=None, messages='vehicle_global_position,vehicle_local_position,vehicle_gps_position'):
     """Read in ulog file, put them into appropriate arrays, then save to .csv
 
+    The fields listed in ULOG_FIELDS are selected by name. Without an output
+    directory the arrays are filled straight from the numpy columns pyulog
+    holds for each message. A field missing from a message raises ValueError.
+
     Input:
         ulog (int): the ulog to be converted.
 
@@ -706,59 +1639,30 @@ def read_ulog(ulog, output=None, messages='vehicle_global_position,vehicle_local
     """
     name = ulog[:-4]
     if output:
-        pyucsv.convert_ulog2csv(ulog,messages=messages, output=output ,delimiter=',')
-
-        global_data = np.genfromtxt(name+'_vehicle_global_position_0.csv', delimiter=',',skip_header=1,usecols=(0,1,2,3,9))
-        global_data[:,0] = global_data[:,0]/1e6
-        global_data[:,3] = global_data[:,3]-1477.8
-
-        local_data = np.genfromtxt(name+'_vehicle_local_position_0.csv', delimiter=',',skip_header=1,usecols=(0,1,2,3,4,5,6,20,21))
-        local_data[:,0] = local_data[:,0]/1e6
-        local_data[:,6] = local_data[:,6]*-1
-
-        gps_data = np.genfromtxt(name+'_vehicle_gps_position_0.csv', delimiter=',',skip_header=1,usecols=(0,1,2,3,4))
-        gps_data[:,0] = gps_data[:,0]/1e6
-        gps_data[:,1] = gps_data[:,1]/1e6
-        gps_data[:,2] = gps_data[:,2]/1e7
-        gps_data[:,3] = gps_data[:,3]/1e7
-        gps_data[:,4] = gps_data[:,4]/1e3
+        pyucsv.convert_ulog2csv(ulog,messages=messages, output=output ,delimiter=',',time_s=None,time_e=None)
+
+        global_data = _read_ulog_csv(name+'_vehicle_global_position_0.csv',ULOG_FIELDS['vehicle_global_position'])
+        local_data = _read_ulog_csv(name+'_vehicle_local_position_0.csv',ULOG_FIELDS['vehicle_local_position'])
+        gps_data = _read_ulog_csv(name+'_vehicle_gps_position_0.csv',ULOG_FIELDS['vehicle_gps_position'])
     else:
         msg_filter = messages.split(',') if messages else None
         log=pyu.ULog(ulog, message_name_filter_list=msg_filter)
-        biglist=[]
-        for data in log.data_list:
-            data_keys = [f.field_name for f in data.field_data]
-            data_keys.remove('timestamp')
-            data_keys.insert(0, 'timestamp')
-            datalist=[]
-            for i in range(len(data.data['timestamp'])):
-                rowlist=[]
-                for k in range(len(data_keys)):
-                    rowlist.append(data.data[data_keys[k]][i])
-                datalist.append(rowlist)
-            biglist.append((str(data.name),np.asarray(datalist, dtype=float)))
-
-        for i,mess in enumerate(msg_filter):
-            if "global" in biglist[i][0]:
-                global_data = biglist[i][1][:,[0,1,2,3,9]]
-            if "local" in biglist[i][0]:
-                local_data = biglist[i][1][:,[0,1,2,3,4,5,6,20,21]]
-            if "gps" in biglist[i][0]:
-                gps_data = biglist[i][1][:,[0,1,2,3,4]]
-
-        global_data[:,0] = global_data[:,0]/1e6
-        global_data[:,3] = global_data[:,3]-1477.8
-
-        local_data[:,0] = local_data[:,0]/1e6
-        local_data[:,6] = local_data[:,6]*-1
-
-        gps_data[:,0] = gps_data[:,0]/1e6
-        gps_data[:,1] = gps_data[:,1]/1e6
-        gps_data[:,2] = gps_data[:,2]/1e7
-        gps_data[:,3] = gps_data[:,3]/1e7
-        gps_data[:,4] = gps_data[:,4]/1e3
-
-        #u_log_dict = {'global_position_u':,'local_position_u':,'gps_position_u':gps_data}
+        global_data = _stack_fields(log.get_dataset('vehicle_global_position').data,ULOG_FIELDS['vehicle_global_position'])
+        local_data = _stack_fields(log.get_dataset('vehicle_local_position').data,ULOG_FIELDS['vehicle_local_position'])
+        gps_data = _stack_fields(log.get_dataset('vehicle_gps_position').data,ULOG_FIELDS['vehicle_gps_position'])
+
+    global_data[:,0] = global_data[:,0]/1e6
+    global_data[:,3] = global_data[:,3]-1477.8
+
+    local_data[:,0] = local_data[:,0]/1e6
+    local_data[:,6] = local_data[:,6]*-1
+
+    gps_data[:,0] = gps_data[:,0]/1e6
+    gps_data[:,1] = gps_data[:,1]/1e6
+    gps_data[:,2] = gps_data[:,2]/1e7
+    gps_data[:,3] = gps_data[:,3]/1e7
+    gps_data[:,4] = gps_data[:,4]/1e3
+
     return global_data, local_data, gps_data
 
 def read_h5(dataFile):
@@ -794,6 +1698,138 @@ def read_h5(dataFile):
         dataDict[key] = obsDict
     return dataDict
 
+class ReceiverFile(object):
+    """Lazy access to a receiver HDF5 file.
+
+    Unlike read_h5, nothing is copied into memory up front. The file is opened
+    on first use and kept open, and only the requested (time window, channel,
+    polarization) hyperslab is read from disk. Indexing with a key returns
+    the h5py group, so code written against the read_h5 dictionary still works.
+
+    The file is laid out as <observation>/time, <observation>/<tuning>/freq
+    and <observation>/<tuning>/<polarization> with shape (ntimes,nchan).
+
+    Use it as a context manager, or call close(), to release the file handle.
+
+    Args:
+        filename (str): path to the HDF5 file
+        index (dict, optional): times and frequencies from a previous index(),
+            so they need not be read from the file again
+    """
+    def __init__(self,filename,index=None):
+        self.filename = filename
+        self._h5 = None
+        self._times = {}
+        self._freqs = {}
+        if index is not None:
+            for key,arr in index.items():
+                path = key.split('/')
+                if path[-1]=='time':
+                    self._times[path[0]] = arr
+                else:
+                    self._freqs[(path[0],path[1])] = arr
+
+    @property
+    def h5(self):
+        if self._h5 is None:
+            self._h5 = h5py.File(self.filename,'r')
+        return self._h5
+
+    def close(self):
+        """Close the file handle. It is reopened if the file is used again."""
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def __getstate__(self):
+        #h5py handles can't be pickled, the copy reopens the file when used
+        state = self.__dict__.copy()
+        state['_h5'] = None
+        return state
+
+    def __getitem__(self,key):
+        return self.h5[key]
+
+    def keys(self):
+        return self.h5.keys()
+
+    def times(self,obs):
+        """Receiver times of an observation (read once, then cached)."""
+        if obs not in self._times:
+            self._times[obs] = np.asarray(self.h5[obs]['time'])
+        return self._times[obs]
+
+    def freqs(self,obs,tuning):
+        """Channel frequencies of a tuning (Hz, read once, then cached)."""
+        if (obs,tuning) not in self._freqs:
+            self._freqs[(obs,tuning)] = np.asarray(self.h5[obs][tuning]['freq'])
+        return self._freqs[(obs,tuning)]
+
+    def index(self):
+        """Times of every observation and frequencies of every tuning.
+
+        Returns:
+            index (dict): arrays keyed by '<obs>/time' and '<obs>/<tuning>/freq'
+        """
+        index = {}
+        for obs in self.keys():
+            index[obs+'/time'] = self.times(obs)
+            for tuning in self.h5[obs].keys():
+                if isinstance(self.h5[obs][tuning],h5py.Group):
+                    index[obs+'/'+tuning+'/freq'] = self.freqs(obs,tuning)
+        return index
+
+    def time_window(self,obs,start_time=None,end_time=None):
+        """Index of the receiver times within [start_time,end_time].
+
+        Returns a slice when the times are sorted, otherwise an index array.
+        """
+        times = self.times(obs)
+        lo = -np.inf if start_time is None else start_time
+        hi = np.inf if end_time is None else end_time
+        if np.all(times[1:]>=times[:-1]):
+            return slice(np.searchsorted(times,lo,side='left'),
+                         np.searchsorted(times,hi,side='right'))
+        return np.nonzero(np.logical_and(times>=lo,times<=hi))[0]
+
+    def read(self,obs,tuning,pol,chans=slice(None),start_time=None,end_time=None):
+        """Read the receiver data for a time window and set of channels.
+
+        Args:
+            obs (str): observation key, eg 'Observation1'
+            tuning (str): tuning key, eg 'Tuning1'
+            pol (str): polarization ('XX', 'YY', 'XY', 'YX')
+            chans (int, slice or list): channels to read
+            start_time, end_time (float, optional): bounds of the time window,
+                in the units of the file's time dataset (unix seconds)
+
+        Returns:
+            times (array): receiver times in the window
+            data (array): the hyperslab, shape (ntimes,) for a single channel
+        """
+        window = self.time_window(obs,start_time,end_time)
+        dset = self.h5[obs][tuning][pol]
+        if isinstance(chans,(list,np.ndarray)):
+            #h5py takes one increasing, unique index list per selection
+            uniq,inverse = np.unique(np.asarray(chans),return_inverse=True)
+            if isinstance(window,slice):
+                data = dset[window,list(uniq)]
+            else:
+                data = dset[window,uniq[0]:uniq[-1]+1][:,uniq-uniq[0]]
+            data = data[:,inverse]
+        else:
+            data = dset[window,chans]
+        return self.times(obs)[window],data
+
 def CST_to_hp(beamfile,outfile,nside=8,rot=0,zflip=False):
     '''
     Reads in a ASCII formatted CST export file and returns a healpix map.
@@ -1,102 +1,209 @@
 from __future__ import absolute_import
-import optparse,sys,threading,atexit
+import optparse,sys,threading,atexit,json
+from urllib.request import Request,urlopen
 import numpy as np
-from flask import Flask,jsonify
-from .read_utils import get_data
-from .position_utils import interp_pos
-import time
+from flask import Flask,jsonify,request
+from .read_utils import GPSTail
 
-if __name__ == "__main__":
-    # =========== Start Selection. These lines are copied from ECHO_server.py to fix this code.
-    o = optparse.OptionParser()
-    o.set_description('Reads in GPS positional data in realtime from a user specified \
-    text file. Starts a server which is queryable by a user on the same or another \
-    machine. The query returns an interpolated GPS position which can be read by the \
-    querier and used to accumulate GPS and spectral data into one output file.\
-    See ECHO_accumulate.py for the output file format.')
+pool_time=0.3
 
-    o.add_option('--gps_file',type=str,
-        help='File name for GPS positional data to be read')
-    o.add_option('--dt',type=float,default=0.5,
-        help='User specified time interval for binning resolution')
-        #Since v_drone<2m/s, dt gives a maximum positional extrapolation range, i.e. dx~v*dt')
-    o.add_option('--host',type=str,default='10.1.1.1',
-        help='Host address')
+class PositionTracker(object):
+    """Drone positions from a GPS file which is still being written.
 
-    opts,args = o.parse_args(sys.argv[1:])
+    Each update() parses only the lines appended since the last one (see
+    read_utils.GPSTail) and adds them to the occupancy counts, so the cost of
+    a poll depends on how much was written since, not on the flight length.
 
+    Positions are interpolated with a zero order hold (the last fix at or
+    before the query time, as interp_pos(kind='zero')), straight from the
+    sorted sample arrays. A query time is valid if it lies within the GPS
+    time range and a fix was logged in the same dt wide time bin. If the file
+    is truncated or replaced the counts start over with what it now holds.
 
+    Args:
+        gps_file (str): GPS file written by ECHO_get_gps.py
+        dt (float): time bin width (s) for the occupancy check
+    """
+    def __init__(self,gps_file,dt=0.5):
+        self.gps = GPSTail(gps_file)
+        self.dt = dt
+        self.t0 = None
+        self.counts = np.zeros(0,dtype=int)
+        self._restarts = 0
+        self.lock = threading.Lock()
+        self.update()
 
+    def _bins(self,times):
+        return np.floor((times-self.t0)/self.dt).astype(int)
 
-    """# Verify a GPS file was passed by the user
-    if not opts.gps_file:
-        print '\n Please enter valid file for GPS information\nExiting...\n\n'
-        sys.exit()"""
-    # ========= End Selection
+    def update(self):
+        """Read newly written GPS lines and update the occupancy counts.
 
-''' NEED TO FIX THE CREATE_APP FUNCTION TO ACCOUNT FOR MODIFICATION OF GLOBAL QUANTITIES !!! '''
-dataLock=threading.Lock()
-pool_time=0.3
+        Returns:
+            nnew (int): number of new GPS fixes
+        """
+        with self.lock:
+            rows = self.gps.update()
+            if self.gps.restarts!=self._restarts:
+                #the file was truncated or replaced, forget the old fixes
+                self._restarts = self.gps.restarts
+                self.t0 = None
+                self.counts = np.zeros(0,dtype=int)
+            if len(rows)==0:
+                return 0
+            if self.t0 is None or rows[:,0].min()<self.t0:
+                #(re)anchor the bins on the earliest fix and recount
+                self.t0 = self.gps.data[0,0]
+                self.counts = np.bincount(self._bins(self.gps.data[:,0]))
+            else:
+                bins = self._bins(rows[:,0])
+                first = bins.min()
+                new = np.bincount(bins-first)
+                end = first+len(new)
+                if end>len(self.counts):
+                    self.counts = np.concatenate((self.counts,np.zeros(end-len(self.counts),dtype=int)))
+                self.counts[first:end] += new
+            return len(rows)
+
+    def time_range(self):
+        """First and last GPS times, or None if nothing has been read."""
+        with self.lock:
+            if len(self.gps.data)==0:
+                return None
+            return self.gps.data[0,0],self.gps.data[-1,0]
+
+    def query(self,times):
+        """Interpolated positions at an array of times.
 
-def create_app():
+        Args:
+            times (array): gps times to look up
+
+        Returns:
+            lats,lons,alts (arrays): interpolated positions, nan where not valid
+            valid (array): boolean, whether each time had a position
+        """
+        times = np.atleast_1d(np.asarray(times,dtype=float))
+        lats,lons,alts = (np.full(times.shape,np.nan) for i in range(3))
+        valid = np.zeros(times.shape,dtype=bool)
+        with self.lock:
+            data = self.gps.data
+            if len(data)==0:
+                return lats,lons,alts,valid
+            inrange = (times>=data[0,0])&(times<=data[-1,0])
+            bins = self._bins(np.where(inrange,times,data[0,0]))
+            valid[inrange] = self.counts[np.clip(bins[inrange],0,len(self.counts)-1)]>0
+            i = np.searchsorted(data[:,0],times[valid],side='right')-1
+            lats[valid],lons[valid],alts[valid] = data[i,1],data[i,2],data[i,3]
+        return lats,lons,alts,valid
+
+def create_app(gps_file,dt=0.5):
+    """Flask app serving interpolated drone positions from a GPS file.
+
+    A background timer polls the file every pool_time seconds, reading only
+    what was appended since the last poll.
+
+    Args:
+        gps_file (str): GPS file written by ECHO_get_gps.py
+        dt (float): time bin width (s) for the occupancy check
+    """
     app = Flask(__name__)
+    tracker = PositionTracker(gps_file,dt=dt)
+    app.config['tracker'] = tracker
+    timer = {}
 
     def interrupt(): # Method called upon script exit
-        global yourThread
-        yourThread.cancel()
+        timer['thread'].cancel()
 
     def collection():
-        # Call global variables that will be used/modified
-        global gps_raw,lati,loni,alti
-        global lastlen
-        global tmin,tmax,dt
-        global counts,tbins,weights
-        global yourThread
-        with dataLock: # Wait for lock on current thread
-            gps_raw = get_data(opts.gps_file,filetype='gps')
-            lati,loni,alti = interp_pos(gps_raw)
-            currlen = gps_raw.shape[0]
-            if currlen == lastlen:
-                time.sleep(pool_time)
-            elif currlen > lastlen:
-                lastlen = currlen
-                tmin,tmax = gps_raw[:,0].min(),gps_raw[:,0].max()
-                # Create weights array for check of GPS data when user queries server
-                counts,tbins = np.histogram(gps_raw[:,0],bins=int((tmax-tmin)/dt))
-                #counts = list(counts)
-                #counts.append(0) # len(counts) -1 = len(tbins)
-                #weights = np.column_stack((counts,tbins))
+        tracker.update()
         # Start the next thread
-        yourThread = threading.Timer(pool_time, collection, ())
-        yourThread.start()
-
-    def initialize():
-        # Do initialisation stuff here
-        global yourThread
-        # Create your thread
-        yourThread = threading.Timer(pool_time, collection, ())
-        yourThread.start()
+        timer['thread'] = threading.Timer(pool_time, collection, ())
+        timer['thread'].daemon = True
+        timer['thread'].start()
 
     # Initiate
-    initialize()
+    collection()
     # When you kill Flask (SIGTERM), clear the trigger for the next thread
     atexit.register(interrupt)
 
     # Add get function to app before returning
     @app.route('/ECHO/lms/v1.0/pos/<float:query_time>', methods=['GET'])
-    def get_gps_pos(query_time,counts):
-        if np.logical_and(query_time>=gps_raw[0,0],query_time<=gps_raw[-1,0]):
-            if counts[np.abs(tbins-query_time).argmin()] > 0:
-                # Return a dictionary of latitude, longitude, and altitude at query time
-                lat,lon,alt = float(lati(query_time)),float(loni(query_time)),float(alti(query_time))
-                pos = {'lat': lat, 'lon': lon, 'alt': alt}
-                return jsonify(pos)
-            else:
-                pos = {'lat': -1, 'lon': -1, 'alt': -1}
-                return jsonify(pos)
-        else:
+    def get_gps_pos(query_time):
+        trange = tracker.time_range()
+        if trange is None or not trange[0]<=query_time<=trange[1]:
             return 'Error: Query time '+str(query_time)+' outside range '+\
-                        str(gps_raw[0,0])+'to'+str(gps_raw[-1,0])
+                        (str(trange[0])+'to'+str(trange[1]) if trange else 'of empty GPS file')
+        lats,lons,alts,valid = tracker.query(query_time)
+        if valid[0]:
+            # Return a dictionary of latitude, longitude, and altitude at query time
+            pos = {'lat': float(lats[0]), 'lon': float(lons[0]), 'alt': float(alts[0])}
+        else:
+            pos = {'lat': -1, 'lon': -1, 'alt': -1}
+        return jsonify(pos)
+
+    @app.route('/ECHO/lms/v1.0/pos', methods=['POST'])
+    def get_gps_pos_batch():
+        # Body is {"times": [t0, t1, ...]}, answered in one vectorized lookup
+        body = request.get_json(force=True, silent=True)
+        if not isinstance(body, dict) or 'times' not in body:
+            return jsonify({'error': 'expected a JSON body {"times": [...]}'}), 400
+        try:
+            times = np.asarray(body['times'],dtype=float).ravel()
+        except (TypeError,ValueError):
+            return jsonify({'error': 'times must be numbers'}), 400
+        lats,lons,alts,valid = tracker.query(times)
+        pos = {}
+        for key,arr in (('lat',lats),('lon',lons),('alt',alts)):
+            arr[~valid] = -1
+            pos[key] = arr.tolist()
+        pos['valid'] = valid.tolist()
+        return jsonify(pos)
 
     # Return app with get function
     return app
+
+def query_positions(host,times,port=5000,timeout=10):
+    """Look up drone positions for many times in one request to the server.
+
+    Args:
+        host (str): address of the position server
+        times (array): gps times to look up
+        port (int): server port
+        timeout (float): request timeout (s)
+
+    Returns:
+        lats,lons,alts (arrays): positions, -1 where not valid
+        valid (array): boolean, whether each time had a position
+    """
+    body = json.dumps({'times': np.asarray(times,dtype=float).ravel().tolist()}).encode()
+    req = Request('http://%s:%d/ECHO/lms/v1.0/pos' % (host,port), data=body,
+                  headers={'Content-Type': 'application/json'})
+    pos = json.loads(urlopen(req,timeout=timeout).read().decode())
+    return (np.array(pos['lat']),np.array(pos['lon']),np.array(pos['alt']),
+            np.array(pos['valid'],dtype=bool))
+
+if __name__ == "__main__":
+    o = optparse.OptionParser()
+    o.set_description('Reads in GPS positional data in realtime from a user specified \
+    text file. Starts a server which is queryable by a user on the same or another \
+    machine. The query returns an interpolated GPS position which can be read by the \
+    querier and used to accumulate GPS and spectral data into one output file.\
+    See ECHO_accumulate.py for the output file format.')
+
+    o.add_option('--gps_file',type=str,
+        help='File name for GPS positional data to be read')
+    o.add_option('--dt',type=float,default=0.5,
+        help='User specified time interval for binning resolution')
+        #Since v_drone<2m/s, dt gives a maximum positional extrapolation range, i.e. dx~v*dt')
+    o.add_option('--host',type=str,default='10.1.1.1',
+        help='Host address')
+
+    opts,args = o.parse_args(sys.argv[1:])
+
+    # Verify a GPS file was passed by the user
+    if not opts.gps_file:
+        print('\n Please enter valid file for GPS information\nExiting...\n\n')
+        sys.exit()
+
+    app = create_app(opts.gps_file,dt=opts.dt)
+    app.run(host=opts.host,port=5000)
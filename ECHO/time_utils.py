@@ -1,6 +1,6 @@
 import numpy as np
+import pandas as pd
 from astropy.time import Time
-from datetime import datetime
 
 
 
@@ -31,36 +31,208 @@ def inrange(tr,t,diff=3):
     return False
 
 
+def merge_intervals(starts,ends,closed=False):
+    """Merge time intervals into a sorted set of disjoint intervals.
+
+    Args:
+        starts (array): interval start times
+        ends (array): interval end times
+        closed (bool): whether the intervals include their endpoints. Open
+            intervals which only touch, (a,b) and (b,c), are kept apart so
+            that b stays outside both.
+
+    Returns:
+        starts,ends (arrays): sorted disjoint intervals covering the same times
+    """
+    starts = np.asarray(starts,dtype=float).ravel()
+    ends = np.asarray(ends,dtype=float).ravel()
+    keep = ends>=starts if closed else ends>starts
+    starts,ends = starts[keep],ends[keep]
+    if len(starts)==0:
+        return starts,ends
+    order = np.argsort(starts,kind='stable')
+    starts = starts[order]
+    reach = np.maximum.accumulate(ends[order])
+    #an interval starts a new group if it begins after everything before it ends
+    if closed:
+        new = np.r_[True,starts[1:]>reach[:-1]]
+    else:
+        new = np.r_[True,starts[1:]>=reach[:-1]]
+    first = np.flatnonzero(new)
+    return starts[first],reach[np.r_[first[1:]-1,len(starts)-1]]
+
+
+class TimeIndex(object):
+    """Sample times sorted once, to be filtered against several sets of windows.
+
+    Pass a TimeIndex as the times of interval_mask, window_index,
+    flight_time_filter or waypt_time_filter. Each window edge is then located
+    in the sorted times with one binary search, O(M log N + N) per filter for
+    N times and M windows, and the times are not searched again per filter.
+
+    Args:
+        times (array): sample times, in any order
+    """
+    def __init__(self,times):
+        self.times = np.asarray(times,dtype=float)
+        self.order = np.argsort(self.times.ravel(),kind='stable')
+        self.sorted = self.times.ravel()[self.order]
+
+    def __len__(self):
+        return len(self.sorted)
+
+    def searchsorted(self,edges,side='left'):
+        """np.searchsorted(edges,self.times,side) for sorted edges."""
+        #edge i counts for every sorted time from pos[i] on
+        pos = np.searchsorted(self.sorted,edges,side='right' if side=='left' else 'left')
+        counts = np.cumsum(np.bincount(pos,minlength=len(self.sorted)+1))[:len(self.sorted)]
+        out = np.empty(len(self.sorted),dtype=int)
+        out[self.order] = counts
+        return out.reshape(self.times.shape)
+
+
+def _search(edges,times,side):
+    """Index of each time in the sorted edges, and the times as an array."""
+    if isinstance(times,TimeIndex):
+        return times.searchsorted(edges,side=side),times.times
+    times = np.asarray(times,dtype=float)
+    return np.searchsorted(edges,times,side=side),times
+
+
+def interval_mask(times,starts,ends,closed=False):
+    """Which times fall inside any of a set of intervals.
+
+    The intervals are merged (merge_intervals) and each time located with one
+    binary search, so this is O((N+M)log M) for N times and M intervals. To
+    filter the same times against several sets of intervals, pass them as a
+    TimeIndex so they are sorted only once.
+
+    Args:
+        times (array or TimeIndex): times to test
+        starts (array): interval start times
+        ends (array): interval end times
+        closed (bool): whether the intervals include their endpoints
+
+    Returns:
+        mask (array): boolean, same shape as times
+    """
+    starts,ends = merge_intervals(starts,ends,closed=closed)
+    #index of the last interval starting before (or at, if closed) each time
+    k,times = _search(starts,times,side='right' if closed else 'left')
+    if len(starts)==0:
+        return np.zeros(times.shape,dtype=bool)
+    k = k-1
+    after_start = k>=0
+    k = np.maximum(k,0)
+    if closed:
+        return after_start&(times<=ends[k])
+    return after_start&(times<ends[k])
+
+
+def window_index(times,starts,ends,closed=False):
+    """Index of the window each time falls in.
+
+    Windows are sorted by start once and each time located with one binary
+    search. Use this to group samples by flight leg or waypoint without
+    scanning the data once per window.
+
+    Args:
+        times (array or TimeIndex): times to locate
+        starts (array): window start times
+        ends (array): window end times
+        closed (bool): whether the windows include their endpoints
+
+    Returns:
+        index (array): int, position of the containing window in starts/ends,
+            or -1 for times outside every window. Where windows overlap, the
+            one extending furthest is given.
+    """
+    starts = np.asarray(starts,dtype=float).ravel()
+    ends = np.asarray(ends,dtype=float).ravel()
+    order = np.argsort(starts,kind='stable')
+    k,times = _search(starts[order],times,side='right' if closed else 'left')
+    index = np.full(times.shape,-1,dtype=int)
+    if len(starts)==0:
+        return index
+    sorted_ends = ends[order]
+    reach = np.maximum.accumulate(sorted_ends)
+    #for each prefix of the sorted windows, the one reaching furthest
+    furthest = np.where(sorted_ends==reach,np.arange(len(starts)),0)
+    furthest = np.maximum.accumulate(furthest)
+    k = k-1
+    after_start = k>=0
+    k = np.maximum(k,0)
+    if closed:
+        inside = after_start&(times<=reach[k])
+    else:
+        inside = after_start&(times<reach[k])
+    index[inside] = order[furthest[k[inside]]]
+    return index
+
+
 def flight_time_filter(timeranges,times):
-    inds = []
-    for timerange in timeranges:
-        inds.append(np.logical_and(times>timerange[0],
-                                   times<timerange[1]))
-    inds = np.sum(inds,axis=0).astype(np.bool)
-    return inds
+    """Which times fall inside any of the flight time ranges.
+
+    Args:
+        timeranges (array): (n,2) start and end of each flight (exclusive)
+        times (array or TimeIndex): times to filter
+
+    Returns:
+        inds (array): boolean mask on times
+    """
+    timeranges = np.asarray(timeranges,dtype=float).reshape(-1,2)
+    return interval_mask(times,timeranges[:,0],timeranges[:,1])
+
 
+def waypt_time_filter(waypt_times,times,diff=3):
+    """Which times are within diff seconds of any waypoint time.
 
-def waypt_time_filter(waypt_times,times):
-    inds = np.array([inrange(waypt_times,t) for t in times])
-    return inds
+    Args:
+        waypt_times (array): times the waypoints were reached
+        times (array or TimeIndex): times to filter
+        diff (float): window half width (s), inclusive
+
+    Returns:
+        inds (array): boolean mask on times
+    """
+    waypt_times = np.asarray(waypt_times,dtype=float)
+    return interval_mask(times,waypt_times-diff,waypt_times+diff,closed=True)
+
+def datetimes_to_unix(timestamps,timezone='MST',fmt='%m/%d/%Y %I:%M:%S %p'):
+    """Convert a whole column of timestamp strings to unix time at once.
+
+    The strings are parsed by pandas in a single vectorized call, which also
+    only parses each distinct timestamp once.
+
+    Args:
+        timestamps (array): timestamp strings, e.g. '10/25/2019 10:35:01 AM'
+        timezone (str): timezone the timestamps were written in, any name
+            known to the tz database. The default 'MST' is a fixed UTC-7.
+        fmt (str): strptime format of the timestamps
+
+    Returns:
+        unix_times (array): float unix seconds
+    """
+    times = pd.DatetimeIndex(pd.to_datetime(np.asarray(timestamps).ravel(),format=fmt))
+    times = times.tz_localize(timezone)
+    return np.asarray((times - pd.Timestamp(0,tz='UTC'))/pd.Timedelta(seconds=1),dtype=float)
 
-def DatetimetoUnix(data):
+def DatetimetoUnix(data,timezone='MST'):
     """Function to convert timestamps to unix time through an array.
 
     Args:
         logged_data (array): array of data including timestamps in the first column.
+        timezone (str): timezone the timestamps were written in (see datetimes_to_unix).
 
     Returns:
         timeconv_data: an array of the same shape as the input array, with timestamps in unix format.
 
     """
     timeconv_data = data
-    for row in timeconv_data:
-        timestamp = row[0]
-        timestamp = datetime.strptime(timestamp, '%m/%d/%Y %I:%M:%S %p')
-        timestamp = Time(timestamp, format='datetime')
-        unix_time = timestamp.unix
-        unix_time = unix_time + (7*3600) #MST to GMT
+    if len(timeconv_data)==0:
+        return timeconv_data
+    unix_times = datetimes_to_unix([row[0] for row in timeconv_data],timezone=timezone)
+    for row,unix_time in zip(timeconv_data,unix_times):
         row[0] = unix_time
 
     return timeconv_data
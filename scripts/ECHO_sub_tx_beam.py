@@ -62,9 +62,7 @@ outfile=ECHOmapFile[:-5]+'-'+os.path.basename(TXmodelFile[:-5])+'_rot.fits'
 print(outfile)
 write_map(outfile,ECHObeam)
 
-THETA,PHI,ECHOmapflat = project_healpix(ECHOmap)
-THETA,PHI,TXmapflat = project_healpix(TXmodel)
-THETA,PHI,ECHObeamflat = project_healpix(ECHObeam)
+THETA,PHI,(ECHOmapflat,TXmapflat,ECHObeamflat) = project_healpix(np.ma.stack((ECHOmap,TXmodel,ECHObeam)))
 
 figure(figsize=(15,6))
 suptitle(outfile[:-5])
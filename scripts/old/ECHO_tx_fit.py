@@ -1,8 +1,7 @@
 """fit for a pointing offset between the two NS runs"""
 from ECHO.read_utils import read_map,write_map
-from ECHO.plot_utils import rotate_hpm,get_interp_val,project_healpix
+from ECHO.plot_utils import rotate_hpm,get_interp_val,project_healpix,fit_tx_rotation
 from matplotlib.pyplot import *
-from scipy.optimize import fmin
 import healpy as hp
 
 A_file = '../data/acc_GB_2015_Nant_NStx_NSrx_8_beam.fits'
@@ -24,16 +23,9 @@ TXmodel = np.ma.masked_where(map_A_counts<3,TXmodel)
 TXmodel = np.ma.masked_where(map_B_counts<3,TXmodel)
 
 
-def chisq(angles,map_A,map_A_err,map_B,map_B_err,TXmodel,pol):
-    theta = angles[0]
-    phi = angles[1]
-    #phi=0
-    RXA = map_A - rotate_hpm(TXmodel,phi,theta,pol)
-    RXB = map_B  - TXmodel
-    return np.ma.mean((RXA-RXB)**2/(2*(map_A_err**2+map_B_err**2)))
 #Calibrate the transmitter angle of map A against map B
 print "fitting for a transmitter rotation"
-result = fmin(chisq,[0,0],args=(map_A,map_A_err,map_B,map_B_err,TXmodel,pol))
+result = fit_tx_rotation(map_A,map_A_err,map_B,map_B_err,TXmodel,pol=pol)
 print "theta (deg) = ",np.round(result[0],2)
 print "phi (deg) = ",np.round(result[1],2)
 TXmodel.mask = False
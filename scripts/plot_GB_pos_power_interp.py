@@ -1,7 +1,7 @@
 import numpy as np
 import sys,optparse
 from matplotlib.pyplot import *
-from ECHO.read_utils import read_orbcomm_spectrum,read_apm_logs,interp_rx,channel_select
+from ECHO.read_utils import read_orbcomm_spectra,read_apm_logs,interp_rx,channel_select
 from glob import glob
 rx_files = glob('/Users/djacobs/Google_Drive/ECHO/Experiments/Green_bank_Aug_2015/South_dipole/NS_transmitter_polarization/satpowerflight12.0*')
 assert(len(rx_files)>0)
@@ -10,9 +10,11 @@ positiontimes,positions,angletimes,angles,CMD_nums,CMD_times = read_apm_logs(apm
 
 colors=['c','b','k','m']
 i=0
+#read the satpower files once for all four antenna/polarization blocks
+rxtimes,freqs,rxspectra = read_orbcomm_spectra(rx_files,use_cache=True)
 for ant in ['N','S']:
     for pol in ['NS','EW']:
-        rxtimes,freqs,rxspectrum = read_orbcomm_spectrum(rx_files,ant,pol)
+        rxspectrum = rxspectra[ant+'_'+pol]
         #get the power in our current channel
         rx_power = channel_select(freqs,rxspectrum,137.5)
         #interpolate the rx data down to match the gps times
@@ -0,0 +1,84 @@
+"""Benchmark apm dataflash log parsing.
+
+Times read_utils.read_apm_dataflash against the readlines loop
+read_apm_log_3_3_3 used to run, on a synthetic 3.3.3 log.
+
+    python benchmark_apm_log.py --minutes 60
+"""
+from __future__ import print_function
+import numpy as np
+import optparse,os,sys,tempfile,time
+
+from ECHO.read_utils import read_apm_dataflash,apm_version
+
+o = optparse.OptionParser()
+o.add_option('--minutes',type=float,default=60,
+    help='Length of the synthetic flight log (Default = 60)')
+opts,args = o.parse_args(sys.argv[1:])
+
+
+def readlines_apm_log(apm_file):
+    # the loop read_apm_log_3_3_3 ran, without the Time conversions
+    lats,lons,alts,weektimes,ATT_times,yaws = [],[],[],[],[],[]
+    CMD_times,CMD_nums = [],[]
+    isAuto = False
+    paststartwaypoint = False
+    start = False
+    lines = open(apm_file).readlines()
+    for line in lines:
+        if line.startswith('STRT'):
+            start = True
+            continue
+        elif not start:
+            continue
+        if line.startswith('MODE'):
+            isAuto = int(line.split(',')[3])==3
+            continue
+        if not isAuto:
+            paststartwaypoint = False
+            continue
+        if line.startswith('CMD') and isAuto:
+            cmd = int(line.split(',')[3].strip())
+            paststartwaypoint = cmd>3
+        if not paststartwaypoint:continue
+        if line.startswith('GPS'):
+            lats.append(float(line.split(',')[7].strip()))
+            lons.append(float(line.split(',')[8].strip()))
+            alts.append(float(line.split(',')[9].strip()))
+            weektimes.append(list(map(float,line.split(',')[3:5])))
+        if line.startswith('ATT'):
+            ATT_times.append(float(line.split(',')[1]))
+            yaws.append(float(line.split(',')[7]))
+        if line.startswith('CMD'):
+            CMD_times.append(float(line.split(',')[1].strip()))
+            CMD_nums.append(cmd)
+    return np.array(lats),np.array(ATT_times)
+
+
+# IMU at 50 Hz, ATT at 10 Hz, GPS at 5 Hz, all in the mission
+rng = np.random.RandomState(0)
+fd,logfile = tempfile.mkstemp(suffix='.log')
+with os.fdopen(fd,'w') as f:
+    f.write('MSG, 0, ArduCopter V3.3.3 (abcdef)\nSTRT, 1, 0\nMODE, 1, Auto, 3, 1\n')
+    f.write('CMD, 1, 10, 4, 16, 0, 0, 0, 0, 33.4, -111.9, 20\n')
+    for step in range(int(opts.minutes*60*50)):
+        T = 1000000+step*20000
+        f.write('IMU, %d, 0.01, 0.02, 0.03, 0.1, 0.2, 9.8, 0, 0, 25.0, 1, 1\n' % T)
+        if step%5==0:
+            f.write('ATT, %d, 0.0, 0.1, 0.0, 0.1, 180.0, %.2f, 0, 0\n' % (T,rng.uniform(0,360)))
+        if step%10==0:
+            f.write('GPS, %d, 3, %d, 2077, 12, 0.8, %.7f, %.7f, %.2f, 1.0, 0.0, 0.0, 1, %d\n'
+                % (T,300000000+step*20,33.4+rng.normal()*1e-4,-111.9+rng.normal()*1e-4,20+rng.normal(),T))
+print('{:.1f} MB log'.format(os.path.getsize(logfile)/1e6))
+
+t0 = time.time()
+log = read_apm_dataflash(logfile,version=apm_version(logfile))
+tnew = time.time()-t0
+print('read_apm_dataflash: {:.3f} s'.format(tnew))
+
+t0 = time.time()
+lats,ATT_times = readlines_apm_log(logfile)
+told = time.time()-t0
+print('readlines loop: {:.3f} s'.format(told))
+print('speedup: {:.1f}x, same positions: {}'.format(told/tnew,np.array_equal(lats,log['GPS']['lat'])))
+os.remove(logfile)
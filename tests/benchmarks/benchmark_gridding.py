@@ -0,0 +1,54 @@
+"""Benchmark healpix gridding throughput.
+
+Times plot_utils.healpix_moments against the per-sample loop it replaced.
+The loop is only run up to --max_loop samples because it is so slow.
+
+    python benchmark_gridding.py --sizes 1e4,1e6,1e8
+"""
+from __future__ import print_function
+import numpy as np
+import healpy as hp
+import optparse,sys,time
+
+from ECHO.plot_utils import healpix_moments
+
+o = optparse.OptionParser()
+o.add_option('--sizes',type=str,default='1e4,1e6,1e8',
+    help='Comma separated list of sample counts (Default = 1e4,1e6,1e8)')
+o.add_option('--nside',type=int,default=8,
+    help='Healpix nside (Default = 8)')
+o.add_option('--max_loop',type=float,default=1e6,
+    help='Largest sample count to time the old loop at (Default = 1e6)')
+opts,args = o.parse_args(sys.argv[1:])
+
+
+def loop_moments(pixes,values,npix):
+    beam = np.zeros(npix)
+    rms = np.zeros(npix)
+    counts = np.zeros(npix)
+    for i,pix in enumerate(pixes):
+        beam[pix] += values[i]
+        rms[pix] += values[i]**2
+        counts[pix] += 1
+    return beam,rms,counts
+
+
+npix = hp.nside2npix(opts.nside)
+print('{:>12s} {:>12s} {:>14s} {:>12s} {:>14s}'.format(
+    'samples','vector (s)','vector (S/s)','loop (s)','loop (S/s)'))
+for size in map(float,opts.sizes.split(',')):
+    n = int(size)
+    pixes = np.random.randint(0,npix,size=n)
+    values = np.random.normal(-50,3,size=n)
+    t0 = time.time()
+    healpix_moments(pixes,values,npix)
+    tvec = time.time()-t0
+    if n<=opts.max_loop:
+        t0 = time.time()
+        loop_moments(pixes,values,npix)
+        tloop = time.time()-t0
+        loopstr = '{:12.4f} {:14.3e}'.format(tloop,n/tloop)
+    else:
+        loopstr = '{:>12s} {:>14s}'.format('-','-')
+    print('{:12d} {:12.4f} {:14.3e} {}'.format(n,tvec,n/tvec,loopstr))
+    del pixes,values
@@ -0,0 +1,43 @@
+"""Benchmark tlog timestamp conversion.
+
+Times time_utils.datetimes_to_unix against the per-row strptime and
+astropy.time.Time conversion DatetimetoUnix used to do.
+
+    python benchmark_timestamps.py --rows 1e6
+"""
+from __future__ import print_function
+import numpy as np
+import optparse,sys,time
+from datetime import datetime
+from astropy.time import Time
+
+from ECHO.time_utils import datetimes_to_unix
+
+o = optparse.OptionParser()
+o.add_option('--rows',type=float,default=1e6,
+    help='Number of timestamps to convert (Default = 1e6)')
+opts,args = o.parse_args(sys.argv[1:])
+
+
+def per_row_DatetimetoUnix(data):
+    for row in data:
+        timestamp = datetime.strptime(row[0], '%m/%d/%Y %I:%M:%S %p')
+        row[0] = Time(timestamp, format='datetime').unix + (7*3600)
+    return data
+
+
+# a tlog logs several messages a second, so timestamps repeat
+nrows = int(opts.rows)
+seconds = 1572024901 + np.sort(np.random.randint(0,4*3600,size=nrows))
+stamps = [time.strftime('%m/%d/%Y %I:%M:%S %p',time.gmtime(s)) for s in seconds]
+
+t0 = time.time()
+new = datetimes_to_unix(stamps)
+tnew = time.time()-t0
+print('datetimes_to_unix: {:d} rows in {:.3f} s ({:.3e} rows/s)'.format(nrows,tnew,nrows/tnew))
+
+t0 = time.time()
+old = np.array(per_row_DatetimetoUnix([[s] for s in stamps]),dtype=float)[:,0]
+told = time.time()-t0
+print('per row DatetimetoUnix: {:d} rows in {:.3f} s ({:.3e} rows/s)'.format(nrows,told,nrows/told))
+print('speedup: {:.0f}x, max difference {:g} s'.format(told/tnew,np.abs(new-old).max()))
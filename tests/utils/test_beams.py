@@ -0,0 +1,21 @@
+from ECHO import plot_utils as pu
+from ECHO.beams import BeamAccumulator
+import numpy as np
+
+
+def test_BeamAccumulator():
+    lat0, lon0 = 33.41865, -111.9295
+    rng = np.random.RandomState(8)
+    lats = lat0 + rng.uniform(-5e-4, 5e-4, size=3000)
+    lons = lon0 + rng.uniform(-5e-4, 5e-4, size=3000)
+    alts = rng.uniform(10, 50, size=3000)
+    rx = rng.normal(-50, 3, size=3000)
+    ref = pu.grid_to_healpix(lats, lons, alts, rx, lat0, lon0, nside=8)
+
+    acc = BeamAccumulator(lat0, lon0, nside=8)
+    other = BeamAccumulator(lat0, lon0, nside=8)
+    for start in range(0, 2000, 250):
+        acc.add(lats[start:start+250], lons[start:start+250], alts[start:start+250], rx[start:start+250])
+    other.add(lats[2000:], lons[2000:], alts[2000:], rx[2000:])
+    for r, o in zip(ref, acc.merge(other).snapshot()):
+        assert np.allclose(r, o, equal_nan=True)
@@ -0,0 +1,47 @@
+from ECHO import cache_utils as cu
+import numpy as np
+import os
+
+
+def test_cache_roundtrip(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    src = tmp_path / 'sortie.txt'
+    src.write_text('first')
+    key = cu.cache_key([str(src)], tag='sortie')
+    assert cu.load(key, cache_dir) is None
+    cu.save(key, {'t/global_t': np.arange(6.).reshape(3, 2), 't/waypoint_t': np.arange(4)}, cache_dir)
+    cached = cu.load(key, cache_dir)
+    assert np.array_equal(cached['t/global_t'], np.arange(6.).reshape(3, 2))
+    assert cached['t/waypoint_t'].dtype.kind == 'i'
+    src.write_text('changed')
+    assert cu.cache_key([str(src)], tag='sortie') != key
+    cu.clear_cache(cache_dir)
+    assert cu.load(key, cache_dir) is None
+
+
+def test_evict(tmp_path):
+    cache_dir = str(tmp_path)
+    for i, key in enumerate(['a', 'b', 'c']):
+        cu.save(key, {'x': np.zeros(1000)}, cache_dir, max_bytes=10**6)
+        os.utime(os.path.join(cache_dir, key+'.npz'), (i, i))
+    cu.load('a', cache_dir)
+    cu.evict(cache_dir, max_bytes=2*os.path.getsize(os.path.join(cache_dir, 'a.npz')))
+    assert sorted(os.listdir(cache_dir)) == ['a.npz', 'c.npz']
+
+
+def test_vanished_entries(tmp_path, monkeypatch):
+    # entries evicted by another process between listing and use are misses
+    cache_dir = str(tmp_path)
+    cu.save('a', {'x': np.arange(3)}, cache_dir)
+    real_glob = cu.glob.glob
+    monkeypatch.setattr(cu.glob, 'glob', lambda pattern: real_glob(pattern) + [os.path.join(cache_dir, 'gone.npz')])
+    cu.evict(cache_dir, max_bytes=0)
+    cu.clear_cache(cache_dir)
+    cu.save('a', {'x': np.arange(3)}, cache_dir)
+
+    def evicted(*args):
+        raise FileNotFoundError
+    monkeypatch.setattr(cu.os, 'utime', evicted)
+    assert np.array_equal(cu.load('a', cache_dir)['x'], np.arange(3))
+    monkeypatch.setattr(cu.np, 'load', evicted)
+    assert cu.load('a', cache_dir) is None
@@ -0,0 +1,125 @@
+import os
+from ECHO import observations as obs
+from ECHO import read_utils as ru
+from test_read_utils import write_h5, write_tlog
+import numpy as np
+
+
+def fake_ulog(ulog, output=None, messages=None):
+    # pyulog logs can't be written here, read_ulog has its own test
+    gps = np.array([[1.5e6, 1572024901e6, 33.4, -111.9, 1500.]])
+    return np.zeros((2, 5)), np.zeros((2, 9)), gps
+
+
+def make_observation(tmp_path, nsorties=3, bad=None):
+    observation = obs.Observation(33.4, -111.9, frequency=5)
+    for i in range(nsorties):
+        tlog = tmp_path / ('tlog%d.txt' % i)
+        if i != bad:
+            write_tlog(tlog)
+        data = str(tmp_path / ('rx%d.h5' % i))
+        write_h5(data)
+        ulog = tmp_path / ('flight%d.ulg' % i)
+        ulog.write_bytes(b'ULog')
+        observation.addSortie(str(tlog), str(ulog), data)
+    return observation
+
+
+def test_read_sorties(tmp_path, monkeypatch):
+    monkeypatch.setattr(ru, 'read_ulog', fake_ulog)
+    for nprocs in [1, 3]:
+        observation = make_observation(tmp_path, bad=1)
+        observation.read_sorties(nprocs=nprocs)
+        assert list(observation.read_errors) == ['sortie02']
+        for i in [0, 2]:
+            sortie = observation.sortie_list[i]
+            assert sortie.freq_chan == 5
+            assert np.array_equal(sortie.t_dict['waypoint_t'], [[1572024903., 4]])
+            assert sortie.data_dict.read('Observation1', 'Tuning1', 'XX', 5)[1].shape == (100,)
+        assert not hasattr(observation.sortie_list[1], 't_dict')
+        observation.close()
+
+
+def test_sortie_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ru, 'read_ulog', fake_ulog)
+    calls = []
+    read_tlog_txt = ru.read_tlog_txt
+    monkeypatch.setattr(ru, 'read_tlog_txt', lambda tlog: calls.append(tlog) or read_tlog_txt(tlog))
+    cache_dir = str(tmp_path / 'cache')
+    observation = make_observation(tmp_path, nsorties=1)
+    sortie = observation.sortie_list[0]
+    # off by default
+    sortie.read(cache_dir=cache_dir)
+    assert len(calls) == 1 and not os.path.exists(cache_dir)
+    sortie.read(use_cache=True, cache_dir=cache_dir)
+    parsed = dict(sortie.t_dict)
+    sortie.read(use_cache=True, cache_dir=cache_dir)
+    assert len(calls) == 2
+    for key in ['waypoint_t', 'global_t', 'local_t', 'gps_t']:
+        assert np.array_equal(sortie.t_dict[key], parsed[key])
+    assert np.array_equal(sortie.u_dict['gps_position_u'], fake_ulog(None)[2])
+    assert sortie.freq_chan == 5
+    assert np.array_equal(sortie.data_dict.read('Observation1', 'Tuning1', 'XX', 5, 1.6e9+10, 1.6e9+12)[0],
+                          1.6e9 + np.arange(10, 13))
+    # a changed source file is a miss
+    with open(sortie.tlog, 'a') as f:
+        f.write('\n')
+    sortie.read(use_cache=True, cache_dir=cache_dir)
+    assert len(calls) == 3
+    sortie.close()
+
+
+def test_flagSorties(tmp_path, monkeypatch):
+    calls = []
+    flagging = ru.mission_endpoint_flagging
+    monkeypatch.setattr(ru, 'mission_endpoint_flagging',
+                        lambda *args, **kwargs: calls.append(kwargs) or flagging(*args, **kwargs))
+    observation = make_observation(tmp_path, nsorties=1)
+    sortie = observation.sortie_list[0]
+    times = np.arange(10.)
+    sortie.t_dict = {'global_t': np.c_[times, times], 'waypoint_t': np.array([[2., 1], [5., 2], [8., 3]])}
+    observation.flagSorties()
+    assert calls == [{'segments': True}]
+    assert np.array_equal(sortie.mission_data[:, 0], times[2:9])
+    assert np.array_equal(sortie.flagged_data[:, 0], [0, 1, 9])
+    assert [wpt for wpt, leg in sortie.waypoint_legs] == [2, 3]
+
+
+def test_beam_cube(tmp_path):
+    import h5py
+    observation = make_observation(tmp_path, nsorties=2)
+    rng = np.random.RandomState(3)
+    for i, sortie in enumerate(observation.sortie_list):
+        with h5py.File(sortie.data, 'r+') as f:
+            for pol in ['XX', 'YY']:
+                f['Observation1/Tuning1/' + pol][...] = rng.uniform(1, 100, size=(100, 16))
+        sortie.data_dict = ru.ReceiverFile(sortie.data)
+        times = 1.6e9 + 40*i + np.arange(10.5, 30, 0.5)
+        sortie.mission_data = np.c_[times, 33.4 + rng.uniform(-5e-4, 5e-4, size=(len(times), 2))*[1, -1],
+                                    rng.uniform(10, 50, size=len(times)), np.zeros(len(times))]
+        sortie.mission_data[:, 2] -= 145.3
+        sortie.t_dict = {'global_t': sortie.mission_data}
+    observation.interpolate_rx_cube(1, 1, chans=[2, 5, 11])
+    cube = observation.refined_cube
+    assert cube.shape == (len(observation.refined_positions), 2, 3)
+    for p, pol in enumerate(['XX', 'YY']):
+        for c, chan in enumerate([2, 5, 11]):
+            for sortie in observation.sortie_list:
+                sortie.freq_chan = chan
+            observation.interpolate_rx(1, 1, pol)
+            assert np.allclose(observation.refined_array[:, -1], cube[:, p, c])
+    assert np.array_equal(observation.cube_freqs, 1e6*np.array([2, 5, 11]))
+
+    observation.make_beam_cube(lat=33.4, lon=-111.9-145.3, nside=4)
+    prefix = str(tmp_path / 'cube')
+    observation.write_beam_cube(prefix)
+    written = ru.read_beam_cube(prefix + '_beam_cube.fits')
+    assert written['beam'].shape == (2, 3, 192)
+    for name in ['beam', 'rms', 'counts']:
+        assert np.array_equal(written[name], getattr(observation, 'hpx_%s_cube' % name), equal_nan=True)
+    assert written['pols'] == ['XX', 'YY'] and written['nside'] == 4
+    assert np.array_equal(written['freqs'], observation.cube_freqs)
+    # every position but the first lands in one pixel of each plane
+    counts = written['counts']
+    assert counts[counts > 0].sum() == (len(observation.refined_positions) - 1) * 6
+    observation.close()
@@ -0,0 +1,184 @@
+from ECHO import plot_utils as pu
+import numpy as np
+import healpy as hp
+
+
+def loop_grid_to_healpix(pixes, rx, npix):
+    # one sample at a time; bincount must add in this order to match exactly
+    beam = np.zeros(npix)
+    rms = np.zeros(npix)
+    counts = np.zeros(npix)
+    for i, pix in enumerate(pixes):
+        beam[pix] += rx[i]
+        rms[pix] += rx[i]**2
+        counts[pix] += 1
+    beam[counts > 0] /= counts[counts > 0]
+    rms[counts > 0] /= counts[counts > 0]
+    rms -= beam**2
+    rms = np.sqrt(rms)
+    return beam, rms, counts
+
+
+def test_healpix_moments():
+    nside = 8
+    npix = hp.nside2npix(nside)
+    rng = np.random.RandomState(1)
+    pixes = rng.randint(0, npix//2, size=5000)
+    rx = rng.normal(-50, 3, size=5000)
+    ref = loop_grid_to_healpix(pixes, rx, npix)
+    out = pu.healpix_moments(pixes, rx, npix)
+    for r, o in zip(ref, out):
+        assert np.array_equal(r, o, equal_nan=True)
+    # pixels 1 and 3 get no samples
+    beam, rms, counts = pu.healpix_moments([0, 2, 2, 2], [1., 2., 4., 6.], 4)
+    assert np.array_equal(beam, [1, 0, 4, 0])
+    assert np.allclose(rms, [0, 0, np.sqrt(8/3.), 0])
+    assert np.array_equal(counts, [1, 0, 3, 0])
+
+
+def test_grid_to_healpix():
+    lat0, lon0 = 33.41865, -111.9295
+    rng = np.random.RandomState(2)
+    lats = lat0 + rng.uniform(-5e-4, 5e-4, size=2000)
+    lons = lon0 + rng.uniform(-5e-4, 5e-4, size=2000)
+    alts = rng.uniform(10, 50, size=2000)
+    rx = rng.normal(-50, 3, size=2000)
+    beam, rms, counts = pu.grid_to_healpix(lats, lons, alts, rx, lat0, lon0, nside=8)
+    seen = counts != hp.UNSEEN
+    assert np.sum(counts[seen]) == 2000
+    assert np.all(beam[~seen] == hp.UNSEEN)
+    assert np.all(rms[seen & (counts > 1)] > 0)
+
+
+def test_grid_data():
+    # 1 unit cells centred on x = 0, 1, 2 and y = 0, 1; the last sample sits
+    # on the edge between two cells and falls in neither
+    x = np.array([0, 0.2, 0.1, 2, 1.6, 0.5])
+    y = np.array([0, 0.1, 0.3, 1, 0.9, 0])
+    z = np.array([1., 3, 8, 5, 7, 100])
+    grid, bins, rmsBins, wherebin, xi, yi, gcounts, grms = pu.grid_data(x, y, z, binsize=1)
+    assert np.array_equal(xi, [[0, 1, 2], [0, 1, 2]]) and np.array_equal(yi, [[0, 0, 0], [1, 1, 1]])
+    empty = np.array([[False, True, True], [True, True, False]])
+    assert np.array_equal(grid.mask, empty) and np.array_equal(rmsBins.mask, empty)
+    assert grid[0, 0] == 3 and grid[1, 2] == 6
+    assert np.isclose(rmsBins[0, 0], np.sqrt(26/3.)) and rmsBins[1, 2] == 1
+    assert np.array_equal(bins, [[3, 0, 0], [0, 0, 2]])
+    assert np.array_equal(gcounts, [3, 3, 3, 2, 2, 0])
+    assert np.allclose(grms, [np.sqrt(26/3.)]*3 + [1, 1, 0])
+    assert [[list(w) for w in row] for row in wherebin] == [[[0, 1, 2], [], []], [[], [], [3, 4]]]
+
+    rng = np.random.RandomState(3)
+    x = rng.uniform(-100, 100, size=3000)
+    y = rng.uniform(-100, 100, size=3000)
+    z = rng.normal(-50, 3, size=3000)
+    grid, bins, rmsBins, wherebin, xi, yi, gcounts, grms = pu.grid_data(x, y, z, binsize=10)
+    assert grid.shape == xi.shape == yi.shape == bins.shape
+    assert bins.sum() == gcounts.astype(bool).sum()
+    assert len(wherebin) == xi.shape[0] and len(wherebin[0]) == xi.shape[1]
+    cell = wherebin[3][4]
+    assert np.array_equal(cell, np.flatnonzero((np.abs(x - xi[3, 4]) < 5) & (np.abs(y - yi[3, 4]) < 5)))
+    assert np.all(gcounts[cell] == bins[3, 4]) and len(cell) == bins[3, 4]
+    assert np.isclose(grid[3, 4], np.median(z[cell])) and np.isclose(rmsBins[3, 4], np.std(z[cell]))
+
+
+def test_healpix_moments_cube():
+    npix = hp.nside2npix(8)
+    rng = np.random.RandomState(7)
+    pixes = rng.randint(0, npix//2, size=4000)
+    cube = rng.normal(-50, 3, size=(4000, 2, 5))
+    beam, rms, counts = pu.healpix_moments(pixes, cube, npix)
+    assert beam.shape == rms.shape == counts.shape == (npix, 2, 5)
+    for ip in range(2):
+        for chan in range(5):
+            ref = pu.healpix_moments(pixes, cube[:, ip, chan], npix)
+            for r, o in zip(ref, (beam[:, ip, chan], rms[:, ip, chan], counts[:, ip, chan])):
+                assert np.allclose(r, o, equal_nan=True)
+    cube = np.array([[1., -1.], [2., -2.], [4., -4.], [6., -6.]])
+    beam, rms, counts = pu.healpix_moments([0, 2, 2, 2], cube, 4)
+    assert np.array_equal(beam, [[1, -1], [0, 0], [4, -4], [0, 0]])
+    assert np.allclose(rms, np.sqrt(8/3.)*np.array([[0, 0], [0, 0], [1, 1], [0, 0]]))
+    assert np.array_equal(counts, [[1, 1], [0, 0], [3, 3], [0, 0]])
+
+
+def test_get_interp_val():
+    rng = np.random.RandomState(9)
+    m = rng.normal(size=hp.nside2npix(8))
+    theta = rng.uniform(0, np.pi, size=(20, 30))
+    phi = rng.uniform(0, 2*np.pi, size=(20, 30))
+    val = pu.get_interp_val(m, theta, phi)
+    assert val.shape == (20, 30)
+    assert np.allclose(val, hp.get_interp_val(m, theta, phi))
+    assert pu.get_interp_val(m, theta, phi) is not val
+    # a masked neighbour drops out and the other weights are renormalized
+    M = np.ma.masked_where(m > 0.5, m)
+    stack = pu.get_interp_val(np.ma.stack((M, 2*M)), theta, phi)
+    pix, w = hp.get_interp_weights(8, theta[0, 0], phi[0, 0])
+    keep = ~M.mask[pix]
+    if keep.any():
+        assert np.isclose(stack[0, 0, 0], np.sum(m[pix][keep]*w[keep])/np.sum(w[keep]))
+    assert np.allclose(stack[1].filled(0), 2*stack[0].filled(0))
+
+
+def test_rotate_hpm_and_fit():
+    nside = 16
+    theta, phi = hp.pix2ang(nside, np.arange(hp.nside2npix(nside)))
+    model = 10*np.log10(np.cos(theta/2)**2*(1 + 0.3*np.cos(phi)) + 1e-3)
+    R = hp.rotator.Rotator(rot=(30, 10), deg=True, eulertype='X')
+    assert np.allclose(pu.rotate_hpm(model, 30, 10, pol='NS'), hp.get_interp_val(model, *R(theta, phi)))
+    stack = pu.rotate_hpm(np.stack((model, -model)), 30, 10, pol='NS')
+    assert np.allclose(stack[1], -stack[0])
+
+    rng = np.random.RandomState(10)
+    err = np.full(len(model), 0.05)
+    map_B = model + rng.normal(0, 0.05, len(model))
+    map_A = pu.rotate_hpm(model, 4, -7, pol='NS').filled(np.nan) + rng.normal(0, 0.05, len(model))
+    masked_model = np.ma.masked_where(theta > np.pi/2, model)
+    cached = list(pu._rotation_operators._items)
+    fit_theta, fit_phi = pu.fit_tx_rotation(map_A, err, map_B, err, masked_model, pol='NS')
+    assert abs(fit_theta + 7) < 1 and abs(fit_phi - 4) < 1
+    # the fit's one-off angles leave the cached operators alone
+    assert list(pu._rotation_operators._items) == cached
+
+
+def test_project_healpix():
+    m = np.random.RandomState(11).normal(size=hp.nside2npix(8))
+    THETA, PHI, IM = pu.project_healpix(m, rotate_angle=10)
+    assert IM.shape == THETA.shape == (100, 100)
+    assert IM.mask[0, 0] and not IM.mask[50, 50]
+    assert np.isclose(IM[50, 60], hp.get_interp_val(m, THETA[60, 50], PHI[60, 50]))
+    THETA2, PHI2, IMS = pu.project_healpix(np.stack((m, -m)), rotate_angle=10)
+    assert np.array_equal(THETA2, THETA) and np.array_equal(PHI2, PHI) and IMS.shape == (2, 100, 100)
+    assert not THETA.flags.writeable and not PHI.flags.writeable
+    assert np.allclose(IMS[1].filled(0), -IM.filled(0))
+
+
+def test_healpix_collection():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    nside = 4
+    rng = np.random.RandomState(6)
+    beam = rng.normal(-50, 3, size=hp.nside2npix(nside))
+    beam[::5] = np.nan
+    pix = np.flatnonzero(~np.isnan(beam))
+    ref = np.swapaxes(hp.boundaries(nside, pix)[:, 0:2, :], 1, 2)
+    coll = pu.make_polycoll(beam, nsides=nside)
+    verts = np.array([p.vertices[:4] for p in coll.get_paths()])
+    assert np.allclose(verts, ref)
+    assert pu.pixel_boundaries(nside) is pu.pixel_boundaries(nside)
+
+    fig, (ax, cax) = plt.subplots(1, 2)
+    pu.animate_beam(ax, beam, fig, cax, None, nsides=nside)
+    coll = ax.collections[-1]
+    pu.animate_beam(ax, beam + 10, fig, cax, None, nsides=nside)
+    assert ax.collections[-1] is coll and len(ax.collections) == 1
+    assert np.array_equal(coll.get_array().mask, np.isnan(beam))
+    assert np.isclose(coll.norm.vmin, np.nanmin(beam) + 10)
+    fig.canvas.draw()
+    plt.close(fig)
+
+    # the contour grid needs only the angles, no interpolation operator
+    pu._projection_grids.clear()
+    pu.healpix_grid([beam, beam], 'beams', ['a', 'b'], 1, 2)
+    assert len(pu._projection_grids._items) == 0
+    plt.close('all')
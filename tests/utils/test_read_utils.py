@@ -0,0 +1,448 @@
+from ECHO import read_utils as ru
+import numpy as np
+
+
+TLOG_HEAD = '10/25/2019 10:35:{sec:02d} AM : 254, 1, 1, 0 0 0 0 {msg} '
+
+
+def write_tlog(path):
+    lines = [
+        TLOG_HEAD.format(sec=1, msg='mavlink_global_position_int_t') +
+        'time_boot_ms 1500 lat 334186500 lon -1119295000 alt 1500000 relative_alt 0 vx 0 vy 0 vz 0 hdg 18000',
+        TLOG_HEAD.format(sec=1, msg='mavlink_local_position_ned_t') +
+        'time_boot_ms 1500 x 1.5 y -2.5 z -20.0 vx 0',
+        TLOG_HEAD.format(sec=2, msg='mavlink_attitude_t') + 'time_boot_ms 2000 roll 0.1',
+        TLOG_HEAD.format(sec=2, msg='mavlink_gps_raw_int_t') +
+        'time_usec 2000000 lat 334186510 lon -1119295010 alt 1500100 eph 0',
+        TLOG_HEAD.format(sec=3, msg='mavlink_mission_item_reached_t') + 'seq 4',
+        TLOG_HEAD.format(sec=4, msg='mavlink_global_position_int_t') +
+        'time_boot_ms 4500 lat 334186600 lon -1119295100 alt 1510000 relative_alt 0 vx 0 vy 0 vz 0 hdg 9000',
+    ]
+    path.write_text('\n'.join(lines) + '\n')
+
+
+def test_read_tlog_txt(tmp_path):
+    tlog = tmp_path / 'sortie.txt'
+    write_tlog(tlog)
+    wpt, glob, local, gps = ru.read_tlog_txt(str(tlog))
+    t0 = 1572024901.  # 10/25/2019 10:35:01 MST
+    assert wpt.shape == (1, 2) and wpt.dtype.kind == 'i'
+    assert np.array_equal(wpt, [[t0+2, 4]])
+    assert np.allclose(glob, [[t0, 1.5, 33.41865, -111.9295, 1500-1477.8, 180],
+                              [t0+3, 4.5, 33.41866, -111.92951, 1510-1477.8, 90]])
+    assert np.allclose(local, [[t0, 1.5, 1.5, -2.5, 20.]])
+    assert np.allclose(gps, [[t0+1, 2., 33.418651, -111.929501, 1500.1]])
+    for chunked, whole in zip(ru.read_tlog_txt(str(tlog), chunk_lines=2), (wpt, glob, local, gps)):
+        assert np.array_equal(chunked, whole)
+
+
+def write_h5(path, ntimes=100, nchan=16):
+    import h5py
+    with h5py.File(path, 'w') as f:
+        f['Observation1/time'] = 1.6e9 + np.arange(ntimes)
+        f['Observation1/Tuning1/freq'] = 1e6*np.arange(nchan)
+        f['Observation1/Tuning1/XX'] = np.arange(ntimes*nchan, dtype=float).reshape(ntimes, nchan)
+        f['Observation1/Tuning1/YY'] = -np.arange(ntimes*nchan, dtype=float).reshape(ntimes, nchan)
+
+
+# the positions of ULOG_FIELDS in the csv files the old reader indexed
+ULOG_COLUMNS = {
+    'vehicle_global_position': (10, (0, 1, 2, 3, 9)),
+    'vehicle_local_position': (22, (0, 1, 2, 3, 4, 5, 6, 20, 21)),
+    'vehicle_gps_position': (8, (0, 1, 2, 3, 4)),
+}
+
+
+def write_ulog_csvs(name, drop=None):
+    state = np.random.RandomState(5)
+    for message, (ncol, cols) in ULOG_COLUMNS.items():
+        header = ['f%d' % i for i in range(ncol)]
+        for field, col in zip(ru.ULOG_FIELDS[message], cols):
+            header[col] = field if field != drop else 'other'
+        data = np.round(state.uniform(0, 1e6, size=(4, ncol)), 3)
+        np.savetxt(name + '_%s_0.csv' % message, data, delimiter=',',
+                   header=','.join(header), comments='')
+
+
+def test_read_ulog_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(ru.pyucsv, 'convert_ulog2csv', lambda *args, **kwargs: None)
+    name = str(tmp_path / 'flight')
+    write_ulog_csvs(name)
+    global_data, local_data, gps_data = ru.read_ulog(name + '.ulg', output=str(tmp_path))
+    old = {}
+    for message, (ncol, cols) in ULOG_COLUMNS.items():
+        old[message] = np.genfromtxt(name + '_%s_0.csv' % message, delimiter=',',
+                                     skip_header=1, usecols=cols)
+    assert np.allclose(global_data[:, 0], old['vehicle_global_position'][:, 0]/1e6)
+    assert np.allclose(global_data[:, 3], old['vehicle_global_position'][:, 3]-1477.8)
+    assert np.array_equal(global_data[:, [1, 2, 4]], old['vehicle_global_position'][:, [1, 2, 4]])
+    assert np.array_equal(local_data[:, 6], -old['vehicle_local_position'][:, 6])
+    assert np.array_equal(local_data[:, 7:], old['vehicle_local_position'][:, 7:])
+    assert np.allclose(gps_data, old['vehicle_gps_position']/[1e6, 1e6, 1e7, 1e7, 1e3])
+    write_ulog_csvs(name, drop='ref_alt')
+    try:
+        ru.read_ulog(name + '.ulg', output=str(tmp_path))
+    except ValueError as e:
+        assert 'ref_alt' in str(e)
+    else:
+        assert False, 'missing field not reported'
+
+
+def test_read_ulog(tmp_path, monkeypatch):
+    # the in-memory path, with pyulog's columns as read back from the csvs
+    name = str(tmp_path / 'flight')
+    datasets = {}
+
+    class Dataset(object):
+        def __init__(self, table):
+            self.data = dict((field, table[field]) for field in table.dtype.names)
+
+    class ULog(object):
+        def __init__(self, ulog, message_name_filter_list=None):
+            assert sorted(message_name_filter_list) == sorted(ULOG_COLUMNS)
+
+        def get_dataset(self, message):
+            return datasets[message]
+
+    monkeypatch.setattr(ru.pyu, 'ULog', ULog)
+
+    def load_datasets(drop=None):
+        write_ulog_csvs(name, drop=drop)
+        for message in ULOG_COLUMNS:
+            path = name + '_%s_0.csv' % message
+            datasets[message] = Dataset(np.genfromtxt(path, delimiter=',', names=True))
+
+    load_datasets()
+    old = {}
+    for message, (ncol, cols) in ULOG_COLUMNS.items():
+        old[message] = np.genfromtxt(name + '_%s_0.csv' % message, delimiter=',',
+                                     skip_header=1, usecols=cols)
+    global_data, local_data, gps_data = ru.read_ulog(name + '.ulg')
+    assert np.allclose(global_data[:, 0], old['vehicle_global_position'][:, 0]/1e6)
+    assert np.allclose(global_data[:, 3], old['vehicle_global_position'][:, 3]-1477.8)
+    assert np.array_equal(global_data[:, [1, 2, 4]], old['vehicle_global_position'][:, [1, 2, 4]])
+    assert np.allclose(local_data[:, 0], old['vehicle_local_position'][:, 0]/1e6)
+    assert np.array_equal(local_data[:, 1:6], old['vehicle_local_position'][:, 1:6])
+    assert np.array_equal(local_data[:, 6], -old['vehicle_local_position'][:, 6])
+    assert np.array_equal(local_data[:, 7:], old['vehicle_local_position'][:, 7:])
+    assert np.allclose(gps_data, old['vehicle_gps_position']/[1e6, 1e6, 1e7, 1e7, 1e3])
+    load_datasets(drop='lon')
+    try:
+        ru.read_ulog(name + '.ulg')
+    except ValueError as e:
+        assert str(e) == 'ulog message has no field(s) lon'
+    else:
+        assert False, 'missing field not reported'
+
+
+def test_ReceiverFile(tmp_path):
+    import pickle
+    h5file = str(tmp_path / 'rx.h5')
+    write_h5(h5file)
+    ref = ru.read_h5(h5file)
+    with ru.ReceiverFile(h5file) as rx:
+        assert np.array_equal(rx.freqs('Observation1', 'Tuning1'), ref['Observation1']['Tuning1']['freq'])
+        times, data = rx.read('Observation1', 'Tuning1', 'XX', 5, 1.6e9+10, 1.6e9+20)
+        assert np.array_equal(times, ref['Observation1']['time'][10:21])
+        assert np.array_equal(data, ref['Observation1']['Tuning1']['XX'][10:21, 5])
+        times, data = rx.read('Observation1', 'Tuning1', 'YY', [7, 2], end_time=1.6e9+3)
+        assert np.array_equal(data, ref['Observation1']['Tuning1']['YY'][:4][:, [7, 2]])
+        copy = pickle.loads(pickle.dumps(rx))
+    assert rx._h5 is None
+    assert np.array_equal(copy.read('Observation1', 'Tuning1', 'XX', 5)[1], ref['Observation1']['Tuning1']['XX'][:, 5])
+    copy.close()
+
+
+def test_apply_flagtimes():
+    from astropy.time import Time
+    datatimes = Time(1.2e9 + np.arange(11.), format='gps')
+
+    def flagged(flagtimes, dt):
+        mask = ru.apply_flagtimes(datatimes, Time(1.2e9 + np.array(flagtimes, dtype=float), format='gps'), dt)
+        assert mask.shape == (11,)
+        return list(np.flatnonzero(mask))
+
+    # touching windows (1,3),(3,5) leave 3 unflagged, the window ends are open
+    assert flagged([2, 4, 8], 1.) == [2, 4, 8]
+    assert flagged([2, 4, 8], [1., 1., 1.5]) == [2, 4, 7, 8, 9]
+    # overlapping windows merge
+    assert flagged([4, 2, 4.5], 1.) == [2, 4, 5]
+    assert flagged([-3, 20], 1.) == []
+    assert flagged([], 1.) == []
+
+
+def test_mission_endpoint_flagging():
+    pos_data = np.column_stack((np.arange(100, 110.), np.arange(10.)))
+    # the mission runs from waypoint 1 to the last waypoint, ends included
+    wpt_data = np.array([[101, 0], [103, 1], [105, 2], [108, 3]])
+    flagged, mission, legs = ru.mission_endpoint_flagging(pos_data, wpt_data, segments=True)
+    assert np.array_equal(flagged[:, 1], [0, 1, 2, 9]) and np.array_equal(mission[:, 1], np.arange(3, 9))
+    assert np.shares_memory(mission, pos_data)
+    assert [(wpt, list(leg[:, 1])) for wpt, leg in legs] == [(2, [3, 4]), (3, [5, 6, 7, 8])]
+    shuffled = pos_data[np.random.RandomState(6).permutation(len(pos_data))]
+    flagged, mission, legs = ru.mission_endpoint_flagging(shuffled, wpt_data, segments=True)
+    assert sorted(flagged[:, 1]) == [0, 1, 2, 9] and sorted(mission[:, 1]) == list(range(3, 9))
+    assert [(wpt, list(leg[:, 1])) for wpt, leg in legs] == [(2, [3, 4]), (3, [5, 6, 7, 8])]
+    # waypoint 1 never reached: the mission runs from the start
+    flagged, mission, legs = ru.mission_endpoint_flagging(pos_data, np.array([[104, 2], [106, 3]]), segments=True)
+    assert np.array_equal(flagged[:, 1], [7, 8, 9]) and np.array_equal(mission[:, 1], np.arange(7))
+    assert [(wpt, list(leg[:, 1])) for wpt, leg in legs] == [(2, [0, 1, 2, 3]), (3, [4, 5, 6])]
+    # no waypoints reached: no mission
+    flagged, mission, legs = ru.mission_endpoint_flagging(pos_data, np.zeros((0, 2), dtype=int), segments=True)
+    assert np.array_equal(flagged, pos_data) and mission.shape == (0, 2) and legs == []
+
+
+def test_interp_rx():
+    from astropy.time import Time
+    rxtimes = 1.6e9 + np.arange(0, 100, 0.7)
+    rx = np.sin(rxtimes - 1.6e9)
+    postimes = 1.6e9 + np.array([-1, 0, 3.3, 50.05, 101.])
+    ref = ru.interp_rx(Time(postimes, format='unix'), Time(rxtimes, format='unix'), rx)
+    out = ru.interp_rx(postimes, rxtimes, rx)
+    assert np.isnan(out[0]) and np.isnan(out[-1])
+    assert np.allclose(out, ref, equal_nan=True)
+
+
+def write_apm_log(path):
+    # a 3.3.3 dataflash log: auto from line MODE 3, mission from CMD 4,
+    # out of the mission at CMD 2 and back in at CMD 5
+    lines = ['FMT, 128, 89, FMT, BBnNZ, Type,Length,Name,Format,Columns',
+             'MSG, 0, ArduCopter V3.3.3 (abcdef)',
+             'GPS, 1000000, 3, 100000, 2077, 12, 0.8, 1.0, 1.0, 1.0, 1, 0, 0, 1, 1000000',
+             'STRT, 1, 0', 'MODE, 2000000, Auto, 3, 1']
+    cmds = {5: 4, 10: 2, 15: 5}
+    for i in range(20):
+        T = 3000000 + i*200000
+        if i in cmds:
+            lines.append('CMD, %d, 10, %d, 16, 0, 0, 0, 0, 33.4, -111.9, 20' % (T, cmds[i]))
+        lines.append('IMU, %d, 0.1, 0.2, 0.3, 0, 0, 9.8, 0, 0, 25.0, 1, 1' % T)
+        lines.append('ATT, %d, 0.0, 0.0, 0.0, 0.0, 0.0, %d.5, 0, 0' % (T, i))
+        lines.append('GPS, %d, 3, %d, 2077, 12, 0.8, %.2f, %.2f, %d.5, 1.0, 0.0, 0.0, 1, %d'
+                     % (T, 100000 + i*200, 33 + i/100., -111 - i/100., i, T))
+        lines.append('GPS2, %d, 3, %d, 2077, 0, 0, 0, 0, 0, 0, 0, 0, 0, %d' % (T, 100000 + i*200, T))
+    lines.append('MODE, 8000000, Land, 9, 1')
+    lines.append('GPS, 8000000, 3, 105000, 2077, 12, 0.8, 0, 0, 0, 1.0, 0.0, 0.0, 1, 8000000')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def test_read_apm_dataflash(tmp_path):
+    path = str(tmp_path / 'apm.log')
+    write_apm_log(path)
+    assert ru.apm_version(path) == '3.3.3'
+    log = ru.read_apm_dataflash(path)
+    kept = np.r_[5:10, 15:20]
+    gps = log['GPS']
+    assert np.allclose(gps['lat'], 33 + kept/100.)
+    assert np.array_equal(gps['ms'], 100000 + kept*200)
+    assert gps['week'].dtype.kind == 'i'
+    assert np.array_equal(log['ATT']['yaw'], kept + 0.5)
+    assert np.array_equal(log['CMD']['num'], [4, 5])
+    # chunk boundaries fall mid line
+    small = ru.read_apm_dataflash(path, chunk_bytes=100)
+    for name in ('GPS', 'ATT', 'CMD'):
+        for col in log[name]:
+            assert np.array_equal(small[name][col], log[name][col])
+    postimes, positions, angletimes, angles, cmdtimes, cmds = ru.read_apm_log(path)
+    assert np.allclose(postimes.gps - postimes.gps[0], kept*0.2 - 1)
+    assert np.allclose(angletimes.gps, postimes.gps)
+    assert np.array_equal(positions[2], kept + 0.5)
+
+
+def test_LogIndex(tmp_path):
+    path = str(tmp_path / 'apm.log')
+    write_apm_log(path)
+    cache_dir = str(tmp_path / 'cache')
+    index = ru.LogIndex(path, cache_dir=cache_dir)
+    assert index.built and index.kind == 'apm' and index.version == '3.3.3'
+    # saved in the cache, not next to the log
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['apm.log', 'cache']
+    lines = open(path).read().split('\n')
+    cmds = index.rows('CMD')
+    assert index.lines(cmds) == [line for line in lines if line.startswith('CMD,')]
+    assert np.array_equal(index.columns(cmds, (3,))[:, 0], [4, 2, 5])
+    assert len(index.rows('GPS')) == 22 and len(index.rows('GPS2')) == 20
+    # lines take the time of the last GPS fix
+    gps = index.rows('GPS')
+    t = index.times[gps]
+    assert np.array_equal(index.rows('GPS', t[3], t[5]), gps[3:6])
+    att = index.rows('ATT', t[3], t[3])
+    assert len(att) == 1 and gps[3] < att[0] < gps[4]
+    log = ru.read_apm_dataflash(path)
+    indexed = ru.read_apm_dataflash(path, index=index)
+    for name in ('GPS', 'ATT', 'CMD'):
+        for col in log[name]:
+            assert np.array_equal(indexed[name][col], log[name][col])
+    # the saved index is used until the log changes
+    assert not ru.LogIndex(path, cache_dir=cache_dir).built
+    sidecar = path + '.idx.npz'
+    assert ru.LogIndex(path, sidecar=sidecar).built and not ru.LogIndex(path, sidecar=sidecar).built
+    with open(path, 'a') as f:
+        f.write('\nGPS, 9000000, 3, 106000, 2077, 12, 0.8, 0, 0, 0, 1.0, 0.0, 0.0, 1, 9000000\n')
+    index = ru.LogIndex(path, cache_dir=cache_dir)
+    assert index.built and len(index.rows('GPS')) == 23
+    assert ru.LogIndex(path, sidecar=sidecar).built
+
+    tlog = tmp_path / 'sortie.txt'
+    write_tlog(tlog)
+    with open(str(tlog)) as f:
+        text = f.read()
+    tlog.write_text('\n' + text)
+    index = ru.LogIndex(str(tlog), cache_dir=cache_dir)
+    assert index.kind == 'tlog'
+    assert ru.LogIndex(str(tlog), kind='tlog', cache_dir=cache_dir).kind == 'tlog'
+    tlog.write_text(text)
+    index = ru.LogIndex(str(tlog), kind='tlog', cache_dir=cache_dir)
+    rows = index.rows('mavlink_global_position_int_t')
+    assert np.array_equal(rows, [0, 5])
+    assert np.array_equal(index.columns(rows, (13, 15)), [[1500, 334186500], [4500, 334186600]])
+    t0 = 1572024901.
+    assert np.array_equal(index.rows('mavlink_global_position_int_t', t0+1), [5])
+
+
+def test_get_way(tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setattr(ru.cache_utils, 'CACHE_DIR', str(cache_dir))
+    path = tmp_path / 'apm.log'
+    write_apm_log(str(path))
+    text = path.read_text()
+    week = 2077*ru.SEC_PER_WEEK
+    tick = ru.APMLOG_SEC_PER_TICK
+    # GPS week and ms are read from fields 3 and 4 for 3.3.2 logs too
+    for header in ('ArduCopter V3.3.3 (abcdef)', 'ArduCopter'):
+        path.write_text(text.replace('ArduCopter V3.3.3 (abcdef)', header))
+        for use_index in (False, True):
+            # the GPS line in the header (line 2) is before start_line
+            GPS_time, GPS_arm, CMD_num, CMD_time = ru.get_way(str(path), start_line=3, use_index=use_index)
+            ms = np.r_[100000 + 200*np.arange(20), 105000]
+            assert np.allclose(GPS_time.gps, week + ms/1000., rtol=0, atol=1e-6)
+            assert np.isclose(GPS_arm.gps, 3000000*tick)
+            assert np.array_equal(CMD_num, [4, 2, 5])
+            assert np.allclose(CMD_time, np.array([4e6, 5e6, 6e6])*tick)
+            start_stop = ru.get_start_stop_times(str(path), use_index=use_index)
+            assert np.allclose(start_stop, [[week + 100., week + 105.]], rtol=0, atol=1e-6)
+            # the log index is only saved when asked for
+            assert cache_dir.exists() == (use_index or header == 'ArduCopter')
+
+
+def write_spectrum(path, spectra, t0=1572024901.25):
+    nchan = spectra.shape[1]
+    lines = ['#Signal Hound Device #: 1',
+             '%.2f' % t0 + ''.join(',%6.3f ' % (137 + i/1000.) for i in range(nchan))]
+    for i, spectrum in enumerate(spectra):
+        if i == 3:
+            lines.append('#binsize = 1.00, startFreq = 137.000')
+            lines.append('max = -40.000, freq = 137.500 ')
+        lines.append('%.2f' % (t0 + i/10.) + ''.join(',%6.3f' % v for v in spectrum))
+    # a spectrum still being written
+    lines.append('%.2f' % (t0 + 1) + ''.join(',%6.3f' % v for v in spectra[0, :nchan//2]))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def test_read_spectrum_file(tmp_path):
+    path = str(tmp_path / 'rx.txt')
+    spectra = np.round(np.random.RandomState(7).normal(-80, 5, size=(10, 64)), 3)
+    write_spectrum(path, spectra)
+    times, freqs, waterfall = ru.read_spectrum_file(path)
+    assert np.allclose(times, 1572024901.25 + np.arange(10)/10.)
+    assert np.allclose(freqs, 137 + np.arange(64)/1000.)
+    assert np.array_equal(waterfall, spectra)
+    times, freqs, waterfall = ru.read_spectrum_file(path, chans=(30, 34), dtype=np.float32, skip_lines=2)
+    assert np.allclose(freqs, 137 + np.arange(30, 34)/1000.)
+    assert waterfall.dtype == np.float32 and waterfall.flags['C_CONTIGUOUS']
+    assert np.array_equal(waterfall, spectra[2:, 30:34].astype(np.float32))
+    small = ru.read_spectrum_file(path, chans=(60, 64), chunk_bytes=500)
+    assert np.array_equal(small[2], spectra[:, 60:])
+    spec_times, freqs, waterfall = ru.read_echo_spectrum([path, path])
+    assert np.array_equal(waterfall, np.concatenate((spectra, spectra)))
+    assert np.allclose(spec_times.unix[:10], 1572024901.25 + np.arange(10)/10.)
+
+
+def test_Waterfall(tmp_path):
+    path = str(tmp_path / 'rx.txt')
+    spectra = np.round(np.random.RandomState(8).normal(-80, 5, size=(10, 64)), 3)
+    write_spectrum(path, spectra)
+    times, freqs, _ = ru.read_spectrum_file(path)
+    prefix = str(tmp_path / 'rx')
+    wf = ru.spectrum_to_waterfall([path, path], prefix, chans=(8, 40), chunk_bytes=700)
+    assert isinstance(wf.spectra, np.memmap) and wf.spectra.flags['F_CONTIGUOUS']
+    assert wf.shape == (20, 32) and wf.dtype == np.float32
+    assert np.array_equal(wf[:], np.concatenate((spectra, spectra))[:, 8:40].astype(np.float32))
+    assert np.array_equal(wf.freqs, freqs[8:40])
+    wf = ru.Waterfall(prefix)
+    assert wf.time_format == 'unix' and np.array_equal(wf.times[:10], times)
+    t, f, s = wf.select(times[2], times[4], chans=(0, 3))
+    assert np.array_equal(t, times[2:5]) and np.array_equal(s, spectra[2:5, 8:11].astype(np.float32))
+    # downstream functions take the memory map without copying it
+    channel = ru.channel_select(wf.freqs, wf, 5)
+    assert isinstance(channel, np.memmap) and not channel.flags['OWNDATA']
+    postimes = np.linspace(times[1], times[3], 7)
+    assert np.allclose(ru.interp_rx(postimes, times, channel[:10]),
+                       ru.interp_rx(postimes, times, spectra[:, 13]), atol=1e-4)
+    wf = ru.write_waterfall(str(tmp_path / 'orb'), times, freqs, spectra, time_format='gps')
+    assert wf.time_format == 'gps' and np.array_equal(wf[:, 3], spectra[:, 3])
+
+
+def test_read_orbcomm_satpower(tmp_path, monkeypatch):
+    power = np.round(np.random.RandomState(9).uniform(1, 100, size=(6, 24)), 4)
+    t0 = 1123456789.5
+    lines = ['%.1f ' % (t0 + i) + ' '.join('%.4f' % v for v in row) for i, row in enumerate(power)]
+    lines.insert(2, 'satellite FM114 rising')
+    lines[4] = ' ' + lines[4] + ' '
+    path = tmp_path / 'satpowerflight12.0'
+    path.write_text('\n'.join(lines) + '\n')
+    # nothing is cached unless asked for
+    monkeypatch.setattr(ru.cache_utils, 'CACHE_DIR', str(tmp_path / 'default_cache'))
+    orbTimes, freqs, spectrum = ru.read_orbcomm_spectrum([str(path)], 'N', 'EW')
+    assert np.allclose(orbTimes.gps, t0 + np.arange(6)) and np.array_equal(freqs, ru.getsatfourchanNG_freqs)
+    assert np.allclose(spectrum, ru.dB2(power[:, 18:24]))
+    orbTimes, freqs, spectra = ru.read_orbcomm_spectra([str(path)])
+    assert sorted(spectra) == ['N_EW', 'N_NS', 'S_EW', 'S_NS']
+    assert np.array_equal(spectra['N_EW'], spectrum)
+    assert not (tmp_path / 'default_cache').exists()
+    times, data = ru.read_orbcomm_satpower([str(path)], chans=[0, 23])
+    assert np.array_equal(data, power[:, [0, 23]])
+
+    cache_dir = str(tmp_path / 'cache')
+    times, data = ru.read_orbcomm_satpower([str(path)], use_cache=True, cache_dir=cache_dir)
+    assert np.array_equal(times, t0 + np.arange(6)) and np.array_equal(data, power)
+    monkeypatch.setattr(ru, '_line_blocks', None)  # later reads come from the cache
+    orbTimes, freqs, cached = ru.read_orbcomm_spectra([str(path)], use_cache=True, cache_dir=cache_dir)
+    assert all(np.array_equal(cached[name], spectra[name]) for name in spectra)
+
+
+def test_spectrum_to_waterfall_growing(tmp_path, monkeypatch):
+    path = str(tmp_path / 'rx.txt')
+    spectra = np.round(np.random.RandomState(9).normal(-80, 5, size=(10, 16)), 3)
+    write_spectrum(path, spectra)
+    spectrum_blocks = ru._spectrum_blocks
+    calls = []
+
+    def growing(filename, *args, **kwargs):
+        # the receiver finishes its last line and writes more between the passes
+        calls.append(filename)
+        if len(calls) == 2:
+            with open(filename, 'a') as f:
+                f.write(''.join(',%6.3f' % v for v in spectra[0, 8:]) + '\n')
+                f.write('\n'.join('%.2f' % (1572024903.25 + i) + ''.join(',%6.3f' % v for v in s)
+                                  for i, s in enumerate(spectra)) + '\n')
+        return spectrum_blocks(filename, *args, **kwargs)
+    monkeypatch.setattr(ru, '_spectrum_blocks', growing)
+    wf = ru.spectrum_to_waterfall([path], str(tmp_path / 'rx'), chunk_bytes=300)
+    assert np.array_equal(wf[:], spectra.astype(np.float32))
+    monkeypatch.undo()
+    assert len(ru.read_spectrum_file(path)[0]) == 21
+
+    other = str(tmp_path / 'other.txt')
+    write_spectrum(other, spectra[:, :8])
+    try:
+        ru.spectrum_to_waterfall([path, other], str(tmp_path / 'both'))
+    except ValueError as e:
+        assert 'other.txt' in str(e)
+    else:
+        assert False, 'frequency mismatch not reported'
+
+    assert not isinstance(np.array(wf), np.memmap) and np.array(wf).flags['OWNDATA']
+    assert np.shares_memory(np.asarray(wf), wf.spectra) and not np.shares_memory(np.array(wf), wf.spectra)
+    assert np.asarray(wf, dtype=np.float64).dtype == np.float64
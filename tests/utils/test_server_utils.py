@@ -0,0 +1,78 @@
+from ECHO import server_utils as su
+import numpy as np
+from scipy.interpolate import interp1d
+
+
+def write_fixes(f, times):
+    for t in times:
+        dt = t - 1.2e9
+        f.write('%.3f,%.6f,%.6f,%.2f\n' % (t, 33.4 + 1e-5*dt, -111.9 - 1e-5*dt, 10 + dt))
+
+
+def test_PositionTracker(tmp_path):
+    gps_file = tmp_path / 'gps.txt'
+    times = 1.2e9 + np.r_[np.arange(0, 20, 0.2), np.arange(40, 60, 0.2)]
+    with open(str(gps_file), 'w') as f:
+        f.write('# gps time,lat,lon,alt\n')
+        write_fixes(f, times[:50])
+        f.write('1200000010.100,33.4')  # line still being written
+    tracker = su.PositionTracker(str(gps_file), dt=0.5)
+    assert len(tracker.gps.data) == 50
+    with open(str(gps_file), 'a') as f:
+        f.write('00100,-111.900100,10.00\n')
+        write_fixes(f, times[50:])
+    assert tracker.update() == len(times) - 50 + 1
+    assert tracker.update() == 0
+
+    data = tracker.gps.data
+    queries = 1.2e9 + np.array([0, 5.05, 10, 19.9, 30, 45.33, 59.8, 70])
+    lats, lons, alts, valid = tracker.query(queries)
+    assert np.array_equal(valid, [True, True, True, True, False, True, True, False])
+    lati = interp1d(data[:, 0], data[:, 1], kind='zero')
+    alti = interp1d(data[:, 0], data[:, 3], kind='zero')
+    assert np.array_equal(lats[valid], lati(queries[valid]))
+    assert np.array_equal(alts[valid], alti(queries[valid]))
+    assert np.all(np.isnan(lons[~valid]))
+
+    # the file is started again mid-run with a later, shorter flight
+    with open(str(gps_file), 'w') as f:
+        write_fixes(f, 1.2e9 + np.arange(100, 102, 0.2))
+    assert tracker.update() == 10
+    assert tracker.t0 == 1.2e9 + 100 and tracker.counts.sum() == 10
+    lats, lons, alts, valid = tracker.query(1.2e9 + np.array([5.05, 100.5, 101.8]))
+    assert np.array_equal(valid, [False, True, True])
+    assert np.allclose(alts[valid], [110.4, 111.8])
+    # emptied: nothing is left to answer from
+    open(str(gps_file), 'w').close()
+    assert tracker.update() == 0
+    assert len(tracker.counts) == 0 and tracker.time_range() is None
+
+
+def test_create_app(tmp_path, monkeypatch):
+    gps_file = tmp_path / 'gps.txt'
+    with open(str(gps_file), 'w') as f:
+        write_fixes(f, 1.2e9 + np.arange(0, 20, 0.2))
+    monkeypatch.setattr(su, 'pool_time', 60)
+    app = su.create_app(str(gps_file))
+    client = app.test_client()
+    pos = client.get('/ECHO/lms/v1.0/pos/1200000005.1').get_json()
+    assert np.isclose(pos['alt'], 15.)
+    assert b'outside range' in client.get('/ECHO/lms/v1.0/pos/1200000030.0').data
+
+
+def test_batch_pos(tmp_path, monkeypatch):
+    gps_file = tmp_path / 'gps.txt'
+    with open(str(gps_file), 'w') as f:
+        write_fixes(f, 1.2e9 + np.arange(0, 20, 0.2))
+    monkeypatch.setattr(su, 'pool_time', 60)
+    app = su.create_app(str(gps_file))
+    client = app.test_client()
+    times = 1.2e9 + np.array([5.1, 30., 0., 19.8])
+    pos = client.post('/ECHO/lms/v1.0/pos', json={'times': times.tolist()}).get_json()
+    assert pos['valid'] == [True, False, True, True]
+    assert np.allclose(pos['alt'], [15., -1, 10., 29.8])
+    for t, lat in zip(times[[0, 2, 3]], np.array(pos['lat'])[[0, 2, 3]]):
+        assert client.get('/ECHO/lms/v1.0/pos/%.1f' % t).get_json()['lat'] == lat
+    for body in [{'nope': 1}, 'times', [1, 2], {'times': [[1], [2, 3]]}, {'times': {'a': 1}}]:
+        assert client.post('/ECHO/lms/v1.0/pos', json=body).status_code == 400
+    assert client.post('/ECHO/lms/v1.0/pos', data=b'not json').status_code == 400
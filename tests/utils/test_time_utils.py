@@ -0,0 +1,57 @@
+from ECHO import time_utils as tu
+import numpy as np
+
+
+def test_datetimes_to_unix():
+    stamps = ['10/25/2019 10:35:01 AM', '10/25/2019 01:05:00 PM', '1/5/2019 12:00:00 AM']
+    ref = [1572024901., 1572033900., 1546671600.]
+    assert np.array_equal(tu.datetimes_to_unix(stamps), ref)
+    assert np.array_equal(tu.datetimes_to_unix(stamps, timezone='UTC'), np.array(ref) - 7*3600)
+
+
+def test_DatetimetoUnix():
+    rows = [['10/25/2019 10:35:01 AM', 1.5], ['10/25/2019 10:35:02 AM', 2.5]]
+    out = tu.DatetimetoUnix(rows)
+    assert out[0] == [1572024901., 1.5]
+    assert out[1] == [1572024902., 2.5]
+
+
+def test_time_filters():
+    rng = np.random.RandomState(5)
+    times = np.sort(rng.uniform(0, 1000, size=3000))
+    waypts = np.r_[rng.uniform(0, 1000, size=50), times[10] - 3]
+    ref = np.array([tu.inrange(waypts, t) for t in times])
+    assert np.array_equal(tu.waypt_time_filter(waypts, times), ref)
+    timeranges = [[10, 100], [90, 200], [200, 300], [500, 510]]
+    ref = np.zeros(len(times), dtype=bool)
+    for start, end in timeranges:
+        ref |= (times > start) & (times < end)
+    assert np.array_equal(tu.flight_time_filter(timeranges, times), ref)
+
+
+def test_window_index():
+    starts = np.array([50., 0., 20., 30.])
+    ends = np.array([60., 10., 40., 35.])
+    times = np.array([-1., 0., 5., 10., 25., 32., 38., 45., 55., 60.])
+    assert np.array_equal(tu.window_index(times, starts, ends), [-1, -1, 1, -1, 2, 2, 2, -1, 0, -1])
+    assert np.array_equal(tu.window_index(times, starts, ends, closed=True), [-1, 1, 1, 1, 2, 2, 2, -1, 0, 0])
+    assert np.array_equal(tu.window_index(times, starts, ends) >= 0, tu.interval_mask(times, starts, ends))
+
+
+def test_TimeIndex():
+    rng = np.random.RandomState(6)
+    times = np.round(rng.uniform(-10, 1010, size=(40, 50)), 1)
+    times[0, :3] = [100., 200., 300.]  # on window edges
+    index = tu.TimeIndex(times)
+    starts = np.round(rng.uniform(0, 1000, size=30), 1)
+    ends = starts + np.round(rng.uniform(0, 40, size=30), 1)
+    starts[:3], ends[:3] = [100., 150., 300.], [200., 250., 300.]
+    for closed in [False, True]:
+        assert np.array_equal(tu.interval_mask(index, starts, ends, closed=closed),
+                              tu.interval_mask(times, starts, ends, closed=closed))
+        assert np.array_equal(tu.window_index(index, starts, ends, closed=closed),
+                              tu.window_index(times, starts, ends, closed=closed))
+    assert np.array_equal(tu.flight_time_filter(np.c_[starts, ends], index),
+                          tu.flight_time_filter(np.c_[starts, ends], times))
+    assert np.array_equal(tu.waypt_time_filter(starts, index), tu.waypt_time_filter(starts, times))
+    assert not tu.interval_mask(index, [], []).any() and (tu.window_index(index, [], []) == -1).all()